@@ -0,0 +1,118 @@
+# A vectorized spin engine for the slot machine.
+#
+# 'get_slot_machine_spin' in main.py is perfect for playing one round at a time, but it rebuilds
+# the list of symbols on every call and draws each symbol with 'random.choice' + 'list.remove'.
+# Payout audits need tens of millions of spins, so this module draws whole batches of spins at
+# once with NumPy while keeping exactly the same per-reel distribution.
+
+from functools import lru_cache
+
+import numpy as np
+
+# How many spins are drawn per internal step. This keeps the working memory bounded
+# (roughly CHUNK_SIZE * cols * pool_size bytes) no matter how many spins are requested.
+CHUNK_SIZE = 65536
+
+
+@lru_cache(maxsize=32)
+def _symbol_pool(symbol_items):
+    """
+    Builds the pool of symbol codes once per symbol configuration.
+
+    Args:
+        symbol_items (tuple): The (symbol, count) pairs of a symbol dictionary.
+
+    Returns:
+        numpy.ndarray: One entry per symbol on the reel, holding the symbol's code
+        (its position in the symbol dictionary).
+    """
+    counts = [count for _, count in symbol_items]
+    dtype = np.min_scalar_type(max(len(counts) - 1, 0))
+    pool = np.repeat(np.arange(len(counts), dtype=dtype), counts)
+    # The pool is shared between calls, so make sure nobody changes it by accident.
+    pool.flags.writeable = False
+    return pool
+
+
+def symbol_codes(symbols):
+    """
+    Lists the symbols in the order of their integer codes.
+
+    Args:
+        symbols (dict): A dictionary of symbols and their counts (or values).
+
+    Returns:
+        list: The symbols, where the symbol at index i is the one with code i.
+    """
+    return list(symbols)
+
+
+def spin_batch(n, rows, cols, symbols, rng=None):
+    """
+    Generates many slot machine spins at once.
+
+    Each column is drawn without replacement from the full symbol pool, exactly like
+    'get_slot_machine_spin': the symbol in row 0 is a uniform pick from the pool, the symbol in
+    row 1 a uniform pick from what is left, and so on. This is done with a partial
+    Fisher-Yates shuffle that runs on every column of every spin at the same time.
+
+    Args:
+        n (int): The number of spins to generate.
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+        symbols (dict): A dictionary of symbols and their counts.
+        rng (numpy.random.Generator, optional): The random generator to draw from.
+            A freshly seeded one is used if it is not given.
+
+    Returns:
+        numpy.ndarray: An integer array of shape (n, cols, rows). Entry [i, c, r] is the code of
+        the symbol in row r of column c on spin i (see 'symbol_codes').
+
+    Raises:
+        ValueError: If a column needs more symbols than the pool holds.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    pool = _symbol_pool(tuple(symbols.items()))
+    pool_size = len(pool)
+    if rows > pool_size:
+        raise ValueError(f"Cannot draw {rows} rows from a pool of {pool_size} symbols.")
+
+    grids = np.empty((n, cols, rows), dtype=pool.dtype)
+    # The smallest integer type that can index into the pool keeps the shuffle cheap.
+    index_dtype = np.min_scalar_type(max(pool_size - 1, 0))
+    identity = np.arange(pool_size, dtype=index_dtype)
+
+    for start in range(0, n, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n - start)
+        # One row of 'order' per column being drawn, each starting as 0, 1, ..., pool_size - 1.
+        order = np.tile(identity, (size * cols, 1))
+        lanes = np.arange(size * cols)
+        for row in range(rows):
+            # Pick one of the symbols that have not been drawn yet (positions row..pool_size-1)
+            # and swap it into position 'row'. Positions before 'row' are already drawn.
+            picks = rng.integers(row, pool_size, size=size * cols)
+            chosen = order[lanes, picks]
+            order[lanes, picks] = order[:, row]
+            order[:, row] = chosen
+
+        drawn = pool[order[:, :rows]]
+        grids[start:start + size] = drawn.reshape(size, cols, rows)
+
+    return grids
+
+
+def to_columns(grid, symbols):
+    """
+    Converts one spin from 'spin_batch' back into the list-of-columns format used in main.py.
+
+    Args:
+        grid (numpy.ndarray): One spin of shape (cols, rows).
+        symbols (dict): The symbol dictionary the spin was drawn with.
+
+    Returns:
+        list: A list of lists, ready for 'print_slot_machine' and 'check_winnings'.
+    """
+    names = symbol_codes(symbols)
+    return [[names[code] for code in column] for column in grid.tolist()]
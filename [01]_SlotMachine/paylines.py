@@ -0,0 +1,188 @@
+# Payline tables and a vectorized winnings checker for the slot machine.
+#
+# 'check_winnings' in main.py only knows the horizontal rows 1..lines and loops over them in
+# Python for every spin. Here a payline is simply the row picked in each column, so a machine
+# can use diagonals, V-shapes, zig-zags or anything else, and a whole batch of spins from
+# 'spin_batch' is scored with a few array comparisons.
+
+import numpy as np
+
+from engine import CHUNK_SIZE, symbol_codes
+
+# Winning lines are reported as a bitmask in a 64-bit integer, one bit per payline.
+MAX_PAYLINES = 64
+
+
+def horizontal_paylines(rows, cols, lines=None):
+    """
+    Builds the classic paylines used by 'check_winnings': line n is row n, straight across.
+
+    Args:
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+        lines (int, optional): How many rows to use. Defaults to all of them.
+
+    Returns:
+        numpy.ndarray: A payline table of shape (lines, cols).
+    """
+    lines = rows if lines is None else lines
+    return np.repeat(np.arange(lines), cols).reshape(lines, cols)
+
+
+def _shape_paylines(rows, cols):
+    """
+    Lists the well-known payline shapes that fit the machine, most familiar first.
+
+    Args:
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+
+    Returns:
+        list: Paylines, each a tuple with the row to use in every column.
+    """
+    middle = (cols - 1) / 2
+    shapes = [tuple([row] * cols) for row in range(rows)]
+
+    # Diagonals, bouncing back when they reach the top or bottom row (a single row has none).
+    for start in range(rows if rows > 1 else 0):
+        for step in (1, -1):
+            line, row = [], start
+            for _ in range(cols):
+                line.append(row)
+                if not 0 <= row + step < rows:
+                    step = -step
+                row += step
+            shapes.append(tuple(line))
+
+    # V-shapes and upside-down V-shapes of every depth.
+    for top in range(rows):
+        for bottom in range(rows):
+            if top != bottom:
+                depth = bottom - top
+                shapes.append(tuple(
+                    round(top + depth * (1 - abs(col - middle) / middle)) if middle else top
+                    for col in range(cols)
+                ))
+
+    # Zig-zags between two rows.
+    for first in range(rows):
+        for second in range(rows):
+            if first != second:
+                shapes.append(tuple(first if col % 2 == 0 else second for col in range(cols)))
+
+    return shapes
+
+
+def _connected_paylines(rows, cols):
+    """
+    Lists every payline that moves at most one row between neighbouring columns.
+
+    Args:
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+
+    Returns:
+        list: Paylines, each a tuple with the row to use in every column.
+    """
+    lines = [(row,) for row in range(rows)]
+    for _ in range(cols - 1):
+        lines = [line + (row,) for line in lines
+                 for row in (line[-1], line[-1] - 1, line[-1] + 1) if 0 <= row < rows]
+    return lines
+
+
+def standard_paylines(rows, cols, count):
+    """
+    Builds a table of 'count' distinct paylines for a machine of any size.
+
+    The horizontal rows come first (so the first 'rows' lines match 'check_winnings'),
+    then diagonals, V-shapes and zig-zags, then any remaining connected lines.
+
+    Args:
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+        count (int): The number of paylines wanted.
+
+    Returns:
+        numpy.ndarray: A payline table of shape (count, cols).
+
+    Raises:
+        ValueError: If the machine does not have that many distinct paylines.
+    """
+    # 'dict.fromkeys' drops duplicates while keeping the order.
+    candidates = dict.fromkeys(_shape_paylines(rows, cols) + _connected_paylines(rows, cols))
+    if count > len(candidates):
+        raise ValueError(f"A {rows}x{cols} machine only has {len(candidates)} paylines to choose from.")
+    return np.array(list(candidates)[:count]).reshape(count, cols)
+
+
+def payout_table(symbols, values):
+    """
+    Lines up the symbol values with the symbol codes used by 'spin_batch'.
+
+    Args:
+        symbols (dict): The symbol dictionary the spins were drawn with.
+        values (dict): A dictionary of symbol values.
+
+    Returns:
+        numpy.ndarray: The value of each symbol code.
+    """
+    return np.array([values[symbol] for symbol in symbol_codes(symbols)], dtype=np.int64)
+
+
+def evaluate(grids, paylines, bet, payouts):
+    """
+    Scores a batch of spins against a payline table.
+
+    A payline wins when every column shows the same symbol on it, and pays the value of
+    that symbol times the bet, just like 'check_winnings'.
+
+    Args:
+        grids (numpy.ndarray): Spins of shape (n, cols, rows) from 'spin_batch'.
+        paylines (numpy.ndarray): A payline table of shape (lines, cols).
+        bet (int): The amount bet on each line.
+        payouts (numpy.ndarray): The value of each symbol code (see 'payout_table').
+
+    Returns:
+        tuple: The winnings of every spin (int64 array of length n) and the winning lines of
+        every spin as a bitmask (uint64 array, bit i set when payline i won).
+
+    Raises:
+        ValueError: If the table has more paylines than fit in the bitmask, or does not
+        match the shape of the grids.
+    """
+    paylines = np.asarray(paylines)
+    lines, cols = paylines.shape
+    if lines > MAX_PAYLINES:
+        raise ValueError(f"At most {MAX_PAYLINES} paylines are supported.")
+    if cols != grids.shape[1] or paylines.max() >= grids.shape[2] or paylines.min() < 0:
+        raise ValueError("The payline table does not fit the slot machine grid.")
+
+    columns = np.arange(cols)
+    line_bits = np.left_shift(np.uint64(1), np.arange(lines, dtype=np.uint64))
+    winnings = np.empty(len(grids), dtype=np.int64)
+    masks = np.empty(len(grids), dtype=np.uint64)
+
+    for start in range(0, len(grids), CHUNK_SIZE):
+        chunk = grids[start:start + CHUNK_SIZE]
+        # Shape (spins, lines, cols): the symbol under every payline in every column.
+        on_lines = chunk[:, columns, paylines]
+        wins = (on_lines == on_lines[:, :, :1]).all(axis=2)
+        winnings[start:start + len(chunk)] = (payouts[on_lines[:, :, 0]] * wins).sum(axis=1) * bet
+        masks[start:start + len(chunk)] = wins.astype(np.uint64) @ line_bits
+
+    return winnings, masks
+
+
+def winning_lines(mask):
+    """
+    Turns a bitmask from 'evaluate' back into line numbers, like those of 'check_winnings'.
+
+    Args:
+        mask (int): The winning-line bitmask of one spin.
+
+    Returns:
+        list: The winning line numbers, starting at 1.
+    """
+    mask = int(mask)
+    return [line + 1 for line in range(mask.bit_length()) if mask >> line & 1]
@@ -0,0 +1,177 @@
+# An exact return-to-player (RTP) calculator for the slot machine.
+#
+# Instead of playing millions of spins and averaging, this module works out the exact
+# probability of every line outcome from the way 'get_slot_machine_spin' draws its reels:
+# every column is an independent draw of 'rows' symbols, without replacement, from the pool
+# described by 'symbol_count' (a multivariate hypergeometric draw).
+
+from fractions import Fraction
+
+from main import COLS, MAX_LINES, ROWS, symbol_count, symbol_value
+
+
+def _column_draws(length, counts, total, one):
+    """
+    Lists every ordered draw of 'length' symbols from one column, with its probability.
+
+    Args:
+        length (int): How many symbols are drawn (the rows we care about).
+        counts (list): How many copies of each symbol the pool holds.
+        total (int): The size of the pool.
+        one: The number 1 in the arithmetic being used (1.0 or Fraction(1)).
+
+    Returns:
+        list: (draw, probability) pairs, where 'draw' is a tuple of symbol indices.
+    """
+    draws = [((), one)]
+    for drawn in range(length):
+        next_draws = []
+        for draw, probability in draws:
+            for symbol, count in enumerate(counts):
+                # Symbols already drawn in this column are no longer in the pool.
+                left = count - draw.count(symbol)
+                if left > 0:
+                    next_draws.append((draw + (symbol,), probability * left / (total - drawn)))
+        draws = next_draws
+    return draws
+
+
+def _match_probability(draw, mask, counts, total, one):
+    """
+    Calculates the chance that another column shows the same symbols as 'draw' on the lines in 'mask'.
+
+    Args:
+        draw (tuple): The symbol indices of the first column.
+        mask (int): A bitmask of line numbers (bit 0 is line 1).
+        counts (list): How many copies of each symbol the pool holds.
+        total (int): The size of the pool.
+        one: The number 1 in the arithmetic being used.
+
+    Returns:
+        The probability, as a float or a Fraction.
+    """
+    probability = one
+    used = [0] * len(counts)
+    drawn = 0
+    for line, symbol in enumerate(draw):
+        if mask >> line & 1:
+            probability = probability * (counts[symbol] - used[symbol]) / (total - drawn)
+            used[symbol] += 1
+            drawn += 1
+    return probability
+
+
+def payout_distribution(rows, cols, lines, symbols, values, exact=False):
+    """
+    Works out the exact probability of every possible payout of one spin.
+
+    The first column decides which symbol each line would pay. The other columns are
+    independent, so the chance that they all agree with it on a set of lines S is
+    match(S) ** (cols - 1). The chance that *exactly* the lines in S win then follows from
+    inclusion-exclusion over the supersets of S.
+
+    Args:
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+        lines (int): The number of lines bet on (rows 1..lines, like 'check_winnings').
+        symbols (dict): A dictionary of symbols and their counts.
+        values (dict): A dictionary of symbol values.
+        exact (bool): Use exact fractions instead of floating point numbers.
+
+    Returns:
+        dict: Maps each payout, as a multiple of the bet per line, to its probability.
+
+    Raises:
+        ValueError: If the number of lines or rows does not fit the machine.
+    """
+    counts = list(symbols.values())
+    payouts = [values[symbol] for symbol in symbols]
+    total = sum(counts)
+    if not 1 <= lines <= rows:
+        raise ValueError(f"The number of lines must be between 1 and {rows}.")
+    if rows > total:
+        raise ValueError(f"Cannot draw {rows} rows from a pool of {total} symbols.")
+
+    one = Fraction(1) if exact else 1.0
+    zero = one - one
+    full = (1 << lines) - 1
+    distribution = {}
+
+    for draw, probability in _column_draws(lines, counts, total, one):
+        # at_least[S] is the chance that the lines in S (and maybe others) all win.
+        at_least = [_match_probability(draw, mask, counts, total, one) ** (cols - 1)
+                    for mask in range(full + 1)]
+        # Turn "at least these lines" into "exactly these lines" (Mobius inversion).
+        for line in range(lines):
+            bit = 1 << line
+            for mask in range(full + 1):
+                if not mask & bit:
+                    at_least[mask] -= at_least[mask | bit]
+
+        for mask in range(full + 1):
+            if at_least[mask]:
+                payout = sum(payouts[symbol] for line, symbol in enumerate(draw) if mask >> line & 1)
+                distribution[payout] = distribution.get(payout, zero) + probability * at_least[mask]
+
+    return distribution
+
+
+def analyze(rows, cols, lines, symbols, values, exact=False):
+    """
+    Calculates the theoretical RTP, variance and hit rates of the slot machine.
+
+    Args:
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+        lines (int): The number of lines bet on.
+        symbols (dict): A dictionary of symbols and their counts.
+        values (dict): A dictionary of symbol values.
+        exact (bool): Use exact fractions instead of floating point numbers.
+
+    Returns:
+        dict: A report with these keys:
+            'rtp': The expected winnings divided by the total bet.
+            'variance': The variance of the winnings divided by the total bet.
+            'hit_frequency': The chance that a spin wins anything.
+            'line_hit_rate': The chance that any single line wins.
+            'symbol_hit_rates': For each symbol, the chance that a single line wins with it.
+            'distribution': The payout distribution (see 'payout_distribution').
+    """
+    distribution = payout_distribution(rows, cols, lines, symbols, values, exact)
+    total = sum(symbols.values())
+    one = Fraction(1) if exact else 1.0
+
+    # Winnings are 'payout * bet' and the total bet is 'bet * lines', so the bet cancels out.
+    rtp = sum(payout * probability for payout, probability in distribution.items()) / lines
+    second_moment = sum(payout ** 2 * probability for payout, probability in distribution.items()) / lines ** 2
+    # Every row of a column shows a given symbol with chance count / total.
+    symbol_hit_rates = {symbol: (one * count / total) ** cols for symbol, count in symbols.items()}
+
+    return {
+        "rtp": rtp,
+        "variance": second_moment - rtp ** 2,
+        "hit_frequency": sum(probability for payout, probability in distribution.items() if payout > 0),
+        "line_hit_rate": sum(symbol_hit_rates.values()),
+        "symbol_hit_rates": symbol_hit_rates,
+        "distribution": dict(sorted(distribution.items())),
+    }
+
+
+def main():
+    """
+    Prints the RTP report of the current machine for every number of lines.
+    """
+    print(f"{ROWS}x{COLS} machine, symbols {symbol_count}, values {symbol_value}")
+    for lines in range(1, MAX_LINES + 1):
+        report = analyze(ROWS, COLS, lines, symbol_count, symbol_value)
+        print(f"{lines} line(s): RTP {report['rtp']:.4%}, "
+              f"std dev {report['variance'] ** 0.5:.4f} x total bet, "
+              f"hit frequency {report['hit_frequency']:.4%}")
+
+    print("Chance that a single line wins with each symbol:")
+    for symbol, rate in analyze(ROWS, COLS, 1, symbol_count, symbol_value)["symbol_hit_rates"].items():
+        print(f"  {symbol}: {rate:.6%}")
+
+
+if __name__ == "__main__":
+    main()
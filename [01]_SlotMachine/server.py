@@ -0,0 +1,425 @@
+# An asyncio game server for the slot machine.
+#
+# 'main()' in main.py plays one blocking game for one player and keeps the balance in a local
+# variable. This server hosts many players at once over TCP, plays each round with the same
+# 'get_slot_machine_spin' and 'check_winnings' functions, and records every deposit and spin
+# in an append-only ledger file before answering the player.
+#
+# The protocol is one JSON object per line. A player sends
+#   {"op": "deposit", "amount": 100}
+#   {"op": "spin", "lines": 3, "bet": 5}
+#   {"op": "balance"}
+#   {"op": "stats"}
+# and gets back one JSON object per request with "ok": true, or "ok": false and an "error".
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import deque
+
+from main import (COLS, MAX_BET, MAX_LINES, MIN_BET, ROWS, check_winnings, get_slot_machine_spin,
+                  symbol_count, symbol_value)
+
+# How many ledger records are written with a single write + fsync at most.
+MAX_BATCH = 4096
+# How many recent spin latencies are kept to work out the percentiles.
+LATENCY_SAMPLES = 100000
+# The longest request line, in bytes. A longer one ends the session.
+MAX_LINE = 2 ** 16
+
+
+class Ledger:
+    """
+    An append-only file of JSON records with group commit.
+
+    Records are queued by many sessions at once. A single writer task takes everything that is
+    waiting, writes it in one go, syncs the file once, and only then tells each session that
+    its record is safely on disk. While one batch is being synced the next one fills up, so the
+    cost of fsync is shared by all the records in a batch.
+    """
+
+    def __init__(self, path, sync=True):
+        """
+        Opens the ledger for appending.
+
+        Args:
+            path (str): The ledger file. Records are only ever added to its end.
+            sync (bool): Call fsync after every batch (turn off only for throwaway ledgers).
+        """
+        self.path = path
+        self.sync = sync
+        self.file = open(path, "ab")
+        self.queue = asyncio.Queue()
+        self.sequence = 0
+        self.batches = 0
+        self.records = 0
+        self.writer = None
+
+    def start(self):
+        """Starts the writer task. Must be called from inside the event loop."""
+        self.writer = asyncio.create_task(self._write_batches())
+
+    async def append(self, record):
+        """
+        Adds a record to the ledger and waits until it is on disk.
+
+        Args:
+            record (dict): The record to store. A sequence number is added to it.
+        """
+        self.sequence += 1
+        record["seq"] = self.sequence
+        done = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((json.dumps(record, separators=(",", ":")), done))
+        await done
+
+    async def _write_batches(self):
+        """Writes queued records in batches until the task is cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < MAX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            data = "".join(line + "\n" for line, _ in batch).encode()
+            try:
+                # The write and fsync happen in a thread so the players keep being served.
+                await loop.run_in_executor(None, self._write, data)
+            except OSError as error:
+                for _, done in batch:
+                    done.set_exception(error)
+                    self.queue.task_done()
+                continue
+
+            self.batches += 1
+            self.records += len(batch)
+            for _, done in batch:
+                done.set_result(None)
+                self.queue.task_done()
+
+    def _write(self, data):
+        """Writes one batch of records and makes sure it reaches the disk."""
+        self.file.write(data)
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    async def close(self):
+        """Writes whatever is still queued and closes the file."""
+        await self.queue.join()
+        if self.writer is not None:
+            self.writer.cancel()
+        self.file.close()
+
+
+class SlotServer:
+    """
+    Hosts slot machine sessions, one per TCP connection.
+    """
+
+    def __init__(self, ledger):
+        """
+        Creates a server that records everything in 'ledger'.
+
+        Args:
+            ledger (Ledger): The append-only ledger for deposits and spins.
+        """
+        self.ledger = ledger
+        self.next_session = 0
+        self.active_sessions = 0
+        self.spins = 0
+        self.started = time.perf_counter()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    async def handle(self, reader, writer):
+        """
+        Serves one player until they disconnect.
+
+        Args:
+            reader (asyncio.StreamReader): The player's incoming requests.
+            writer (asyncio.StreamWriter): Where the answers are sent.
+        """
+        self.next_session += 1
+        self.active_sessions += 1
+        session = {"id": self.next_session, "balance": 0}
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is longer than the stream's limit. What's left of it can't be told
+                    # apart from the next request, so answer and close the connection.
+                    reply = {"ok": False, "error": f"Request longer than {MAX_LINE} bytes."}
+                    writer.write(json.dumps(reply).encode() + b"\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                received = time.perf_counter()
+                op = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("A request must be a JSON object.")
+                    op = request.get("op")
+                    reply = await self.dispatch(session, request)
+                except (ValueError, TypeError, KeyError) as error:
+                    reply = {"ok": False, "error": str(error)}
+
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+                if op == "spin" and reply["ok"]:
+                    self.latencies.append(time.perf_counter() - received)
+        except ConnectionError:
+            pass
+        finally:
+            self.active_sessions -= 1
+            writer.close()
+
+    async def dispatch(self, session, request):
+        """
+        Runs one request of a player.
+
+        Args:
+            session (dict): The player's session ('id' and 'balance').
+            request (dict): The decoded request.
+
+        Returns:
+            dict: The answer to send back.
+        """
+        op = request["op"]
+        if op == "deposit":
+            return await self.deposit(session, request["amount"])
+        if op == "spin":
+            return await self.spin(session, request["lines"], request["bet"])
+        if op == "balance":
+            return {"ok": True, "balance": session["balance"]}
+        if op == "stats":
+            return {"ok": True, **self.stats()}
+        raise ValueError(f"Unknown op: {op}")
+
+    async def deposit(self, session, amount):
+        """
+        Adds money to a player's balance, with the same rules as 'deposit()'.
+
+        Args:
+            session (dict): The player's session.
+            amount (int): The amount to deposit.
+
+        Returns:
+            dict: The answer with the new balance.
+        """
+        if not _is_int(amount) or amount <= 0:
+            return {"ok": False, "error": "Amount must be greater than 0."}
+        balance = session["balance"] + amount
+        try:
+            await self.ledger.append({"session": session["id"], "type": "deposit", "amount": amount,
+                                      "balance": balance, "time": time.time()})
+        except OSError as error:
+            return {"ok": False, "error": f"The deposit could not be recorded: {error}",
+                    "balance": session["balance"]}
+        session["balance"] = balance
+        return {"ok": True, "balance": balance}
+
+    async def spin(self, session, lines, bet):
+        """
+        Plays one round for a player, with the same rules as 'spin()'.
+
+        Args:
+            session (dict): The player's session.
+            lines (int): The number of lines to bet on.
+            bet (int): The amount to bet on each line.
+
+        Returns:
+            dict: The answer with the spun columns, the winnings and the new balance.
+        """
+        if not _is_int(lines) or not 1 <= lines <= MAX_LINES:
+            return {"ok": False, "error": "Enter a valid number of lines."}
+        if not _is_int(bet) or not MIN_BET <= bet <= MAX_BET:
+            return {"ok": False, "error": f"Amount must be between ${MIN_BET} - ${MAX_BET}."}
+        total_bet = bet * lines
+        if total_bet > session["balance"]:
+            return {"ok": False, "error": "You do not have enough to bet that amount.",
+                    "balance": session["balance"]}
+
+        slots = get_slot_machine_spin(ROWS, COLS, symbol_count)
+        winnings, winning_lines = check_winnings(slots, lines, bet, symbol_value)
+        balance = session["balance"] + winnings - total_bet
+        # The answer is only sent once the spin is in the ledger, so an acknowledged spin is
+        # never lost, even if the server crashes right after. The balance only changes then
+        # too: a spin the ledger couldn't record didn't happen.
+        try:
+            await self.ledger.append({"session": session["id"], "type": "spin", "lines": lines, "bet": bet,
+                                      "columns": slots, "winnings": winnings, "balance": balance,
+                                      "time": time.time()})
+        except OSError as error:
+            return {"ok": False, "error": f"The spin could not be recorded: {error}",
+                    "balance": session["balance"]}
+        session["balance"] = balance
+        self.spins += 1
+        return {"ok": True, "columns": slots, "winnings": winnings,
+                "winning_lines": winning_lines, "balance": balance}
+
+    def stats(self):
+        """
+        Summarizes the load on the server.
+
+        Returns:
+            dict: Active sessions, spins played, spins per second, p50/p99 spin latency in
+            milliseconds and the average number of ledger records per commit.
+        """
+        latencies = sorted(self.latencies)
+        elapsed = time.perf_counter() - self.started
+        return {
+            "sessions": self.active_sessions,
+            "spins": self.spins,
+            "spins_per_second": self.spins / elapsed if elapsed else 0.0,
+            "p50_ms": _percentile(latencies, 0.50) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+            "records_per_commit": self.ledger.records / self.ledger.batches if self.ledger.batches else 0.0,
+        }
+
+
+def _is_int(value):
+    """Checks for a JSON integer; true and false decode to bool, which is an int in Python."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _percentile(values, fraction):
+    """
+    Picks a percentile from a sorted list (nearest rank).
+
+    Args:
+        values (list): Sorted values.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        float: The percentile, or 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def serve(host, port, ledger_path, sync=True):
+    """
+    Runs the server until it is interrupted.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        ledger_path (str): The ledger file.
+        sync (bool): fsync every ledger batch.
+    """
+    ledger = Ledger(ledger_path, sync)
+    ledger.start()
+    server = SlotServer(ledger)
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_LINE)
+    print(f"Serving on {host}:{port}, ledger {ledger_path}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await ledger.close()
+
+
+async def _play(host, port, spins, lines, bet, latencies):
+    """
+    Plays one simulated player against the server.
+
+    Args:
+        host (str): The server address.
+        port (int): The server port.
+        spins (int): How many spins to play.
+        lines (int): The number of lines to bet on.
+        bet (int): The bet per line.
+        latencies (list): Collects the round-trip time of every spin.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(json.dumps({"op": "deposit", "amount": spins * lines * bet}).encode() + b"\n")
+    await reader.readline()
+    request = json.dumps({"op": "spin", "lines": lines, "bet": bet}).encode() + b"\n"
+    for _ in range(spins):
+        sent = time.perf_counter()
+        writer.write(request)
+        reply = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - sent)
+        if not reply["ok"]:
+            break
+    writer.close()
+    await writer.wait_closed()
+
+
+async def benchmark(players, spins, sync=True):
+    """
+    Starts a server on localhost and plays many players against it at the same time.
+
+    Args:
+        players (int): The number of concurrent players.
+        spins (int): How many spins each player plays.
+        sync (bool): fsync every ledger batch.
+
+    Returns:
+        dict: The client-side p50/p99 latency and spins per second, plus the server's stats.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = Ledger(os.path.join(directory, "ledger.jsonl"), sync)
+        ledger.start()
+        server = SlotServer(ledger)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0, backlog=players)
+        port = listener.sockets[0].getsockname()[1]
+
+        latencies = []
+        started = time.perf_counter()
+        async with listener:
+            await asyncio.gather(*(_play("127.0.0.1", port, spins, MAX_LINES, MIN_BET, latencies)
+                                   for _ in range(players)))
+        elapsed = time.perf_counter() - started
+        await ledger.close()
+
+    latencies.sort()
+    return {
+        "players": players,
+        "spins": len(latencies),
+        "spins_per_second": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "server": server.stats(),
+    }
+
+
+def main():
+    """
+    Runs the server, or a localhost benchmark, from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Slot machine game server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--ledger", default="ledger.jsonl", help="append-only ledger file")
+    serve_parser.add_argument("--no-sync", action="store_true", help="do not fsync ledger batches")
+    bench_parser = commands.add_parser("bench", help="play many players against a localhost server")
+    bench_parser.add_argument("--players", type=int, default=500)
+    bench_parser.add_argument("--spins", type=int, default=100, help="spins per player")
+    bench_parser.add_argument("--no-sync", action="store_true", help="do not fsync ledger batches")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.ledger, not args.no_sync))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    report = asyncio.run(benchmark(args.players, args.spins, not args.no_sync))
+    print(f"{report['players']} players, {report['spins']:,} spins: "
+          f"{report['spins_per_second']:,.0f} spins/s, "
+          f"p50 {report['p50_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms")
+    print(f"Ledger: {report['server']['records_per_commit']:.1f} records per commit")
+
+
+if __name__ == "__main__":
+    main()
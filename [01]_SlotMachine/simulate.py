@@ -0,0 +1,207 @@
+# A headless Monte Carlo simulator for the slot machine.
+#
+# The game in main.py asks for every bet with 'input()' and draws from the global 'random'
+# module, so it cannot be used to play a billion spins. This module plays many sessions at
+# once with the vectorized engine, spreads the sessions over a pool of processes and gives
+# every shard of sessions its own seeded random stream, so a run can be replayed exactly.
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from engine import spin_batch
+from main import COLS, MAX_BET, MAX_LINES, MIN_BET, ROWS, symbol_count, symbol_value
+from paylines import evaluate, horizontal_paylines, payout_table, standard_paylines
+
+# How many spins (summed over all sessions of a shard) are played per vectorized step.
+SPINS_PER_BLOCK = 262144
+# How many sessions each shard (one task for the process pool) holds.
+SESSIONS_PER_SHARD = 256
+
+
+def _play_shard(task):
+    """
+    Plays one shard of sessions. This runs inside a worker process.
+
+    Args:
+        task (tuple): (seed, sessions, spins, balance, bet, paylines, checkpoints, machine), where
+            'machine' is the (rows, cols, symbols, values) tuple of the slot machine.
+
+    Returns:
+        dict: The final balances, spins played and checkpoint balances of every session, plus
+        the amount won in the shard.
+    """
+    seed, sessions, spins, balance, bet, paylines, checkpoints, machine = task
+    rows, cols, symbols, values = machine
+    rng = np.random.default_rng(seed)
+    payouts = payout_table(symbols, values)
+    total_bet = bet * len(paylines)
+
+    balances = np.full(sessions, balance, dtype=np.int64)
+    spins_played = np.zeros(sessions, dtype=np.int64)
+    # A checkpoint past the spins played keeps the starting balance rather than garbage.
+    checkpoint_balances = np.full((sessions, len(checkpoints)), balance, dtype=np.int64)
+    won = 0
+    won_squared = 0.0
+
+    block = max(1, SPINS_PER_BLOCK // sessions)
+    for start in range(0, spins, block):
+        size = min(block, spins - start)
+        grids = spin_batch(sessions * size, rows, cols, symbols, rng)
+        wins = evaluate(grids, paylines, bet, payouts)[0].reshape(sessions, size)
+        net = wins - total_bet
+
+        # A session keeps playing only while it can afford the total bet, just like 'spin()'.
+        # Once it cannot, it stops for good.
+        before = balances[:, None] + np.cumsum(net, axis=1) - net
+        playing = np.logical_and.accumulate(before >= total_bet, axis=1)
+        net = np.where(playing, net, 0)
+        wins = np.where(playing, wins, 0)
+        history = balances[:, None] + np.cumsum(net, axis=1)
+
+        for index, checkpoint in enumerate(checkpoints):
+            if start < checkpoint <= start + size:
+                checkpoint_balances[:, index] = history[:, checkpoint - start - 1]
+
+        balances = history[:, -1]
+        spins_played += playing.sum(axis=1)
+        won += int(wins.sum())
+        won_squared += float((wins.astype(np.float64) ** 2).sum())
+
+    return {
+        "balances": balances,
+        "spins_played": spins_played,
+        "checkpoint_balances": checkpoint_balances,
+        "won": won,
+        "won_squared": won_squared,
+    }
+
+
+def simulate(sessions, spins, balance, bet, lines, seed=None, workers=None, checkpoints=10,
+             rows=ROWS, cols=COLS, symbols=symbol_count, values=symbol_value, paylines=None,
+             confidence_z=1.96):
+    """
+    Plays 'sessions' sessions of up to 'spins' spins each and summarizes the results.
+
+    Sessions are cut into fixed shards and every shard gets its own child of one
+    numpy SeedSequence. The results only depend on the seed, never on the number of workers
+    or the order they finish in.
+
+    Args:
+        sessions (int): The number of players to simulate.
+        spins (int): The maximum number of spins per session.
+        balance (int): The starting balance of every session.
+        bet (int): The bet per line.
+        lines (int): The number of lines bet on. Ignored when 'paylines' is given.
+        seed (int, optional): The seed of the run. A random one is picked (and reported) if
+            it is not given.
+        workers (int, optional): The number of worker processes. Defaults to one per CPU.
+        checkpoints (int): How many evenly spaced points of each balance trajectory to keep.
+        rows (int): The number of rows on the slot machine.
+        cols (int): The number of columns on the slot machine.
+        symbols (dict): A dictionary of symbols and their counts.
+        values (dict): A dictionary of symbol values.
+        paylines (numpy.ndarray, optional): The payline table to play (see paylines.py).
+            Defaults to the horizontal rows 1..lines, like 'check_winnings'.
+        confidence_z (float): The z-score of the RTP confidence interval (1.96 for 95%).
+
+    Returns:
+        dict: A report with the seed, the RTP and its confidence interval, the ruin probability,
+        the balance trajectories and the throughput of the run.
+    """
+    if paylines is None:
+        paylines = horizontal_paylines(rows, cols, lines)
+    seed_sequence = np.random.SeedSequence(seed)
+    checkpoint_spins = sorted({max(1, spins * (index + 1) // checkpoints) for index in range(checkpoints)})
+    machine = (rows, cols, dict(symbols), dict(values))
+
+    shard_sizes = [min(SESSIONS_PER_SHARD, sessions - start) for start in range(0, sessions, SESSIONS_PER_SHARD)]
+    tasks = [(child, size, spins, balance, bet, paylines, checkpoint_spins, machine)
+             for child, size in zip(seed_sequence.spawn(len(shard_sizes)), shard_sizes)]
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = list(map(_play_shard, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 'map' hands the results back in shard order, whichever worker finishes first.
+            results = list(executor.map(_play_shard, tasks))
+    elapsed = time.perf_counter() - started
+
+    balances = np.concatenate([result["balances"] for result in results])
+    spins_played = np.concatenate([result["spins_played"] for result in results])
+    trajectories = np.concatenate([result["checkpoint_balances"] for result in results])
+    total_spins = int(spins_played.sum())
+    total_bet = bet * len(paylines)
+
+    # Every spin costs the same total bet, so the RTP is the mean return of a single spin.
+    returns = sum(result["won"] for result in results) / total_bet
+    returns_squared = sum(result["won_squared"] for result in results) / total_bet ** 2
+    rtp = returns / total_spins if total_spins else 0.0
+    variance = returns_squared / total_spins - rtp ** 2 if total_spins else 0.0
+    margin = confidence_z * (max(variance, 0.0) / total_spins) ** 0.5 if total_spins else 0.0
+
+    return {
+        "seed": seed_sequence.entropy,
+        "sessions": sessions,
+        "spins": total_spins,
+        "rtp": rtp,
+        "rtp_interval": (rtp - margin, rtp + margin),
+        "ruin_probability": float((balances < total_bet).mean()),
+        "mean_final_balance": float(balances.mean()),
+        "checkpoints": checkpoint_spins,
+        "trajectory_quantiles": {
+            quantile: np.quantile(trajectories, quantile, axis=0).tolist() for quantile in (0.05, 0.5, 0.95)
+        },
+        "trajectories": trajectories,
+        "elapsed": elapsed,
+        "spins_per_second": total_spins / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    """
+    Runs a simulation from the command line and prints the report.
+    """
+    parser = argparse.ArgumentParser(description="Simulate slot machine sessions without any prompts.")
+    parser.add_argument("--sessions", type=int, default=1000, help="number of players")
+    parser.add_argument("--spins", type=int, default=1000, help="maximum spins per player")
+    parser.add_argument("--balance", type=int, default=100, help="starting balance")
+    parser.add_argument("--bet", type=int, default=MIN_BET, help=f"bet per line (${MIN_BET}-${MAX_BET})")
+    parser.add_argument("--lines", type=int, default=MAX_LINES, help=f"lines to bet on (1-{MAX_LINES})")
+    parser.add_argument("--rows", type=int, default=ROWS, help="rows on the machine")
+    parser.add_argument("--cols", type=int, default=COLS, help="columns on the machine")
+    parser.add_argument("--paylines", type=int, default=None,
+                        help="play this many standard paylines (diagonals, V-shapes, ...) instead of --lines rows")
+    parser.add_argument("--seed", type=int, default=None, help="seed, to replay a run exactly")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if not 1 <= args.lines <= min(MAX_LINES, args.rows) or not MIN_BET <= args.bet <= MAX_BET:
+        parser.error("lines or bet out of range")
+    if args.sessions < 1 or args.spins < 1:
+        parser.error("sessions and spins must be at least 1")
+
+    paylines = None
+    if args.paylines is not None:
+        paylines = standard_paylines(args.rows, args.cols, args.paylines)
+    report = simulate(args.sessions, args.spins, args.balance, args.bet, args.lines, args.seed, args.workers,
+                      rows=args.rows, cols=args.cols, paylines=paylines)
+    low, high = report["rtp_interval"]
+    print(f"Seed: {report['seed']}")
+    print(f"Played {report['spins']:,} spins in {report['elapsed']:.2f}s "
+          f"({report['spins_per_second']:,.0f} spins/s)")
+    print(f"RTP: {report['rtp']:.4%} (95% CI {low:.4%} - {high:.4%})")
+    print(f"Ruin probability: {report['ruin_probability']:.2%}")
+    print(f"Mean final balance: ${report['mean_final_balance']:,.2f}")
+    print("Balance after spin (5% / 50% / 95%):")
+    quantiles = report["trajectory_quantiles"]
+    for index, checkpoint in enumerate(report["checkpoints"]):
+        print(f"  {checkpoint:>10,}: {quantiles[0.05][index]:>10,.0f} "
+              f"{quantiles[0.5][index]:>10,.0f} {quantiles[0.95][index]:>10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# A low-latency audio engine for the alarm clock.
+#
+# 'playsound("FilePath/WakeUp.mp3")' reads and decodes the MP3 file only when the alarm goes
+# off, so the sound starts late by a varying amount (and not at all if the path is wrong).
+# This engine decodes every sound once, up front, into raw 16-bit PCM samples, keeps one
+# output stream open the whole time, and mixes sounds into it as soon as they are triggered.
+# Alarms that go off together share the same decoded samples.
+
+import argparse
+import os
+import threading
+import time
+from collections import deque
+
+import miniaudio
+import numpy as np
+
+from scheduler import Scheduler
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# How many frames the output asks for at a time. Smaller means lower latency, but more work.
+PERIOD_FRAMES = 256
+# How many recent latencies are kept.
+LATENCY_SAMPLES = 10000
+
+
+class Voice:
+    """
+    One sound that is playing: the shared samples plus how far along they are.
+    """
+
+    def __init__(self, samples, deadline):
+        self.samples = samples
+        self.position = 0
+        self.deadline = deadline  # When the sound was meant to start, if known.
+        self.started = None  # When its first sample was handed to the output.
+
+
+class AudioEngine:
+    """
+    Decodes sounds once and mixes the playing ones into a single output stream.
+
+    The output (a sound card or a 'NullSink') pulls 'render(frames)' at a steady pace;
+    'play' only adds a voice, so triggering a sound never waits for disk or decoding. Close
+    the engine when done with it (or use it in a 'with' block), or the sound card stays open.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.sounds = {}
+        self.voices = []
+        # Seconds from deadline to first sample, for the latest voices with a deadline.
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._device = None
+
+    def load(self, name, path):
+        """
+        Decodes a sound file into memory.
+
+        Args:
+            name (str): The name to play the sound by.
+            path (str): The sound file (MP3, WAV, FLAC or Vorbis).
+
+        Raises:
+            FileNotFoundError: If the file does not exist, so a wrong path shows up at
+                startup rather than when the alarm goes off.
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Sound file not found: {path}")
+        decoded = miniaudio.decode_file(path, output_format=miniaudio.SampleFormat.SIGNED16,
+                                        nchannels=CHANNELS, sample_rate=SAMPLE_RATE)
+        self.sounds[name] = np.frombuffer(decoded.samples, dtype=np.int16)
+
+    def duration(self, name):
+        """The length of a loaded sound, in seconds."""
+        return len(self.sounds[name]) / CHANNELS / SAMPLE_RATE
+
+    def play(self, name, deadline=None):
+        """
+        Starts playing a loaded sound, on top of anything that is already playing.
+
+        Args:
+            name (str): The name the sound was loaded with.
+            deadline (float, optional): When the sound was meant to start, on the engine's
+                clock. Used to measure the latency.
+        """
+        voice = Voice(self.sounds[name], deadline)
+        with self._lock:
+            self.voices.append(voice)
+
+    def render(self, frames):
+        """
+        Produces the next 'frames' frames of output.
+
+        Args:
+            frames (int): How many frames the output wants.
+
+        Returns:
+            numpy.ndarray: frames * CHANNELS signed 16-bit samples.
+        """
+        count = frames * CHANNELS
+        with self._lock:
+            voices = list(self.voices)
+
+        # Added up in 32 bits, then clipped, so overlapping sounds don't wrap around.
+        mixed = np.zeros(count, dtype=np.int32)
+        now = self.clock()
+        for voice in voices:
+            chunk = voice.samples[voice.position:voice.position + count]
+            voice.position += len(chunk)
+            if voice.started is None:
+                voice.started = now
+                if voice.deadline is not None:
+                    self.latencies.append(now - voice.deadline)
+            mixed[:len(chunk)] += chunk
+        if len(voices) > 1:
+            np.clip(mixed, -32768, 32767, out=mixed)
+        out = mixed.astype(np.int16)
+
+        with self._lock:
+            self.voices = [voice for voice in self.voices if voice.position < len(voice.samples)]
+            if not self.voices:
+                self._idle.notify_all()
+        return out
+
+    def stop_all(self):
+        """Stops every sound that is playing."""
+        with self._lock:
+            self.voices = []
+            self._idle.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits until nothing is playing any more.
+
+        Args:
+            timeout (float, optional): Give up after this many seconds.
+        """
+        with self._lock:
+            self._idle.wait_for(lambda: not self.voices, timeout)
+
+    def _stream(self):
+        """The generator miniaudio pulls output from."""
+        frames = yield b""
+        while True:
+            frames = yield self.render(frames)
+
+    def open_device(self, buffer_msec=20):
+        """
+        Opens the sound card and keeps it running, playing silence until a sound is played.
+
+        Args:
+            buffer_msec (int): The size of the device buffer, which bounds the latency.
+        """
+        self._device = miniaudio.PlaybackDevice(output_format=miniaudio.SampleFormat.SIGNED16,
+                                                nchannels=CHANNELS, sample_rate=SAMPLE_RATE,
+                                                buffersize_msec=buffer_msec)
+        stream = self._stream()
+        next(stream)
+        self._device.start(stream)
+
+    def close(self):
+        """Closes the sound card, if it was opened."""
+        if self._device is not None:
+            self._device.close()
+            self._device = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NullSink:
+    """
+    A stand-in for a sound card: pulls PERIOD_FRAMES frames at the pace of real playback
+    and throws them away. Used to measure latency without any audio hardware.
+    """
+
+    def __init__(self, engine, period_frames=PERIOD_FRAMES):
+        self.engine = engine
+        self.period = period_frames / SAMPLE_RATE
+        self.period_frames = period_frames
+        self.scheduler = Scheduler(engine.clock)
+
+    def start(self):
+        """Starts pulling audio in a background thread."""
+        self.scheduler.call_later(0, self.engine.render, self.period_frames, interval=self.period)
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+
+
+def benchmark(path, rounds=100, simultaneous=3, spacing=0.05):
+    """
+    Measures the time from alarm deadlines to the first sample of their sound, on a NullSink.
+
+    Args:
+        path (str): The sound file to play.
+        rounds (int): How many times a group of alarms goes off.
+        simultaneous (int): How many alarms go off at the same deadline in every round (they
+            share the decoded sound and are mixed together).
+        spacing (float): Seconds between rounds. Sounds are stopped before the next round.
+
+    Returns:
+        dict: The decode time and the p50/p99/max latency, in milliseconds.
+    """
+    engine = AudioEngine()
+    started = time.perf_counter()
+    engine.load("alarm", path)
+    decode_ms = (time.perf_counter() - started) * 1000
+
+    sink = NullSink(engine)
+    sink.start()
+    alarm_scheduler = Scheduler(engine.clock)
+    first = alarm_scheduler.clock() + 0.1
+    for number in range(rounds):
+        deadline = first + number * spacing
+        for _ in range(simultaneous):
+            alarm_scheduler.call_at(deadline, engine.play, "alarm", deadline)
+        alarm_scheduler.call_at(deadline + spacing / 2, engine.stop_all)
+    alarm_scheduler.run()
+    sink.stop()
+
+    latencies = sorted(engine.latencies)
+    return {
+        "decode_ms": decode_ms,
+        "alarms": len(latencies),
+        "period_ms": sink.period * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure alarm sound latency with a null audio sink.")
+    parser.add_argument("sound", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "WakeUp.mp3"),
+                        help="sound file to play")
+    parser.add_argument("--rounds", type=int, default=100, help="groups of alarms to fire")
+    parser.add_argument("--simultaneous", type=int, default=3, help="alarms per group")
+    args = parser.parse_args()
+
+    report = benchmark(args.sound, args.rounds, args.simultaneous)
+    print(f"Decoded once in {report['decode_ms']:.1f} ms")
+    print(f"{report['alarms']} alarms, output period {report['period_ms']:.1f} ms: "
+          f"deadline to first sample p50 {report['p50_ms']:.2f} ms, "
+          f"p99 {report['p99_ms']:.2f} ms, max {report['max_ms']:.2f} ms")
@@ -1,13 +1,20 @@
 # https://www.fesliyanstudios.com/royalty-free-sound-effects-download/alarm-203
 # https://dunsinoyekan.com/wp-content/uploads/2024/04/Dunsin-Oyekan_Worthy-Of-My-Praise_Alarm.mp3
 
-# The code below is a simple alarm program. It uses the `playsound` library to play an audio file
-# and the `time` library to create a countdown timer.
+# The code below is a simple alarm program. It uses a small audio engine (see audio.py) to play
+# an audio file and a scheduler (see scheduler.py) to create a countdown timer.
 # The comments at the top are links to the sound files used, but they are not
 # part of the Python code itself.
 
-from playsound import playsound  # This line imports the function to play a sound file.
-import time  # This line imports the time module, which allows us to work with time-related functions.
+import argparse  # Reads the time to wait from the command line, when it is given there.
+import math  # Rounds the time left up to whole seconds.
+import os  # This line imports the os module, used to find the sound file next to this script.
+
+from audio import AudioEngine  # Decodes sounds once and plays them without delay.
+from scheduler import Scheduler  # Runs callbacks at exact deadlines.
+
+# The alarm sound lives next to this script, so it is found from any working directory.
+SOUND_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "WakeUp.mp3")
 
 # ANSI escape codes are used to control the terminal's cursor and screen.
 # They allow the program to clear the screen or move the cursor without
@@ -16,44 +23,107 @@ CLEAR = "\033[2J"  # This code clears the entire terminal screen.
 CLEAR_AND_RETURN = "\033[H"  # This code moves the cursor to the home position (top-left corner).
 
 
-def alarm(seconds):
+def show_time_left(time_left):
+    """
+    Prints the countdown over the previous one.
+
+    Args:
+        time_left (int): The number of whole seconds until the alarm sounds.
+    """
+    minutes_left = time_left // 60  # Use integer division to get the number of full minutes.
+    seconds_left = time_left % 60  # Use the modulo operator to get the remaining seconds.
+
+    # The f-string formats the output. `CLEAR_AND_RETURN` moves the cursor
+    # back to the top-left, so the new time overwrites the old one, creating
+    # a smooth countdown effect. The `:02d` format specifier ensures that
+    # minutes and seconds are always displayed with two digits (e.g., 05 instead of 5).
+    print(f"{CLEAR_AND_RETURN}Alarm will sound in: {minutes_left:02d}:{seconds_left:02d}")
+
+
+def load_sounds():
+    """
+    Decodes the alarm sound and opens the sound card, ready to play without delay.
+
+    Returns:
+        AudioEngine: The engine, with the sound loaded as "alarm".
+    """
+    engine = AudioEngine()
+    engine.load("alarm", SOUND_FILE)
+    engine.open_device()
+    return engine
+
+
+def alarm(seconds, scheduler=None, engine=None):
     """
     This function creates a countdown timer and plays an alarm sound when the time is up.
 
+    The alarm and every countdown update are scheduled at exact times, measured from one
+    deadline on the monotonic clock. So the alarm never drifts late, and the countdown is only
+    redrawn when the number of seconds shown changes.
+
     Args:
         seconds (int): The total number of seconds for the alarm countdown.
+        scheduler (Scheduler, optional): Schedule the alarm on this scheduler, next to other
+            alarms, instead of waiting for it here.
+        engine (AudioEngine, optional): The audio engine to play the alarm sound on. Alarms
+            that share an engine share the decoded sound. Without one, an engine is opened
+            for this alarm and closed once its sound has played.
     """
-    time_elasped = 0  # Initialize a counter for the time that has passed.
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = Scheduler()
+    own_engine = engine is None
+    if own_engine:
+        # Decode the sound now, before the countdown, not when the alarm goes off.
+        engine = load_sounds()
 
-    print(CLEAR)  # Clear the terminal screen before starting the countdown.
-    while time_elasped < seconds:  # The loop continues until the elapsed time equals the total seconds.
-        time.sleep(1)  # Pause the program for 1 second. This is the core of the countdown.
-        time_elasped += 1  # Increment the elapsed time by 1 second.
+    deadline = scheduler.clock() + seconds  # The exact moment the alarm should sound.
+
+    def tick():
+        # Worked out from the deadline rather than counted down: the scheduler skips ticks
+        # it missed (e.g. while the computer was suspended), and the display must still match.
+        show_time_left(max(math.ceil(deadline - scheduler.clock()), 0))
 
-        # Calculate the remaining time to display to the user.
-        time_left = seconds - time_elasped
-        minutes_left = time_left // 60  # Use integer division to get the number of full minutes.
-        seconds_left = time_left % 60  # Use the modulo operator to get the remaining seconds.
+    def ring():
+        ticker.cancel()  # The countdown is over.
+        show_time_left(0)
+        engine.play("alarm", deadline)
+        if own_engine and not own_scheduler:
+            # Nobody waits for the sound here: close the engine once it has played.
+            scheduler.call_later(engine.duration("alarm") + 1, engine.close)
 
-        # Print the countdown.
-        # The f-string formats the output. `CLEAR_AND_RETURN` moves the cursor
-        # back to the top-left, so the new time overwrites the old one, creating
-        # a smooth countdown effect. The `:02d` format specifier ensures that
-        # minutes and seconds are always displayed with two digits (e.g., 05 instead of 5).
-        print(f"{CLEAR_AND_RETURN}Alarm will sound in: {minutes_left:02d}:{seconds_left:02d}")
+    print(CLEAR)  # Clear the terminal screen before starting the countdown.
+    # The alarm is scheduled first, so at the deadline it runs before the last countdown tick.
+    scheduler.call_at(deadline, ring)
+    # One tick per second, at deadline - (seconds - 1), deadline - (seconds - 2), ...
+    ticker = scheduler.call_at(deadline - seconds + 1, tick, interval=1)
 
-    # Once the loop finishes, the time is up. Play the alarm sound.
-    # NOTE: You need to replace "FilePath/WakeUp.mp3" with the actual path to your sound file.
-    playsound("FilePath/WakeUp.mp3")
+    if own_scheduler:
+        try:
+            scheduler.run()
+            engine.wait()  # Let the sound play to the end, like playsound did.
+        finally:
+            if own_engine:
+                engine.close()
 
 
 # --- Main part of the script ---
 
-# Prompt the user to enter the number of minutes and seconds for the alarm.
-minutes = int(input("How many minutes to wait: "))
-seconds = int(input("How many seconds to wait: "))
-# Calculate the total number of seconds from the user's input.
-total_seconds = minutes * 60 + seconds
+if __name__ == "__main__":
+    # The time to wait can be given on the command line ("--minutes 5"); otherwise it is asked for.
+    parser = argparse.ArgumentParser(description="Sound an alarm after a countdown.")
+    parser.add_argument("--minutes", type=int, help="minutes to wait")
+    parser.add_argument("--seconds", type=int, help="seconds to wait")
+    args = parser.parse_args()
+
+    if args.minutes is None and args.seconds is None:
+        # Prompt the user to enter the number of minutes and seconds for the alarm.
+        minutes = int(input("How many minutes to wait: "))
+        seconds = int(input("How many seconds to wait: "))
+    else:
+        minutes, seconds = args.minutes or 0, args.seconds or 0
+    # Calculate the total number of seconds from the user's input.
+    total_seconds = minutes * 60 + seconds
 
-# Call the `alarm` function with the total number of seconds.
-alarm(total_seconds)
+    # Call the `alarm` function with the total number of seconds.
+    alarm(total_seconds)
@@ -0,0 +1,208 @@
+# A drift-free scheduler for many alarms and timers at once.
+#
+# The original 'alarm()' counted down with 'time.sleep(1)' in a loop. Every pass through the
+# loop takes a little longer than one second (printing, looping), so the alarm drifts late,
+# and only one alarm can run at a time. This scheduler keeps every deadline in a heap, on the
+# monotonic clock (which never jumps when the system time changes), and sleeps exactly until
+# the earliest one.
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class Alarm:
+    """
+    A handle for a scheduled callback. Keep it to cancel the alarm later.
+    """
+
+    def __init__(self, deadline, callback, args, interval):
+        self.deadline = deadline  # When the callback runs next, on the scheduler's clock.
+        self.callback = callback
+        self.args = args
+        self.interval = interval  # Seconds between runs of a repeating timer, or None.
+        self.cancelled = False
+
+    def cancel(self):
+        """Stops the alarm. It will not run again."""
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    Runs callbacks at their deadlines, from a single thread.
+
+    Deadlines are absolute times on the monotonic clock, so a repeating timer fires at
+    start, start + interval, start + 2 * interval, ... no matter how long the callbacks take.
+    Alarms can be added or cancelled from any thread, also while the scheduler is sleeping.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Creates an empty scheduler.
+
+        Args:
+            clock (callable): Returns the current time in seconds. Must never go backwards.
+        """
+        self.clock = clock
+        self._heap = []
+        self._counter = itertools.count()  # Keeps alarms with equal deadlines in order.
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return sum(not alarm.cancelled for _, _, alarm in self._heap)
+
+    def call_at(self, deadline, callback, *args, interval=None):
+        """
+        Runs 'callback(*args)' at an absolute time on the scheduler's clock.
+
+        Args:
+            deadline (float): When to run, e.g. 'scheduler.clock() + 60'.
+            callback (callable): The function to run.
+            *args: Arguments for the callback.
+            interval (float, optional): Run again every 'interval' seconds after that.
+
+        Returns:
+            Alarm: A handle to cancel the alarm with.
+        """
+        if interval is not None and interval <= 0:
+            raise ValueError("The interval must be greater than 0.")
+        alarm = Alarm(deadline, callback, args, interval)
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), alarm))
+            # Wake the scheduler in case this alarm is now the earliest one.
+            self._condition.notify()
+        return alarm
+
+    def call_at_many(self, entries):
+        """
+        Schedules many alarms at once, e.g. when a saved list of alarms is loaded.
+
+        Rebuilding the heap once is much faster than pushing the alarms one by one.
+
+        Args:
+            entries: (deadline, callback, args) tuples. The alarms do not repeat.
+
+        Returns:
+            list: The Alarm handles, in the same order as 'entries'.
+        """
+        alarms = []
+        with self._condition:
+            for deadline, callback, args in entries:
+                alarm = Alarm(deadline, callback, args, None)
+                self._heap.append((deadline, next(self._counter), alarm))
+                alarms.append(alarm)
+            heapq.heapify(self._heap)
+            self._condition.notify()
+        return alarms
+
+    def call_later(self, delay, callback, *args, interval=None):
+        """
+        Runs 'callback(*args)' after 'delay' seconds. See 'call_at'.
+        """
+        return self.call_at(self.clock() + delay, callback, *args, interval=interval)
+
+    def cancel(self, alarm):
+        """
+        Cancels an alarm. It stays in the heap until its deadline, but is skipped.
+
+        Args:
+            alarm (Alarm): The handle returned by 'call_at' or 'call_later'.
+        """
+        alarm.cancel()
+        with self._condition:
+            self._condition.notify()
+
+    def _next_due(self, stop_when_empty):
+        """
+        Waits until an alarm is due and takes it out of the heap.
+
+        Returns:
+            Alarm: The due alarm, or None when the scheduler should stop.
+        """
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    if stop_when_empty:
+                        return None
+                    self._condition.wait()
+                    continue
+
+                deadline, _, alarm = self._heap[0]
+                if alarm.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+
+                delay = deadline - self.clock()
+                if delay > 0:
+                    # Sleep exactly until the earliest deadline, or until an alarm is added.
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                if alarm.interval is not None:
+                    # The next run is counted from the deadline, not from now, so it never
+                    # drifts. Runs that were missed entirely are skipped.
+                    alarm.deadline += alarm.interval
+                    now = self.clock()
+                    if alarm.deadline <= now:
+                        alarm.deadline += (now - alarm.deadline) // alarm.interval * alarm.interval + alarm.interval
+                    heapq.heappush(self._heap, (alarm.deadline, next(self._counter), alarm))
+                return alarm
+            return None
+
+    def run(self, stop_when_empty=True):
+        """
+        Runs alarms as they come due, in the calling thread.
+
+        Args:
+            stop_when_empty (bool): Return once no alarms are left. Otherwise keep waiting for
+                new ones until 'stop' is called.
+        """
+        self._running = True
+        self._run_alarms(stop_when_empty)
+
+    def _run_alarms(self, stop_when_empty):
+        """
+        Runs due alarms until '_next_due' says to stop.
+
+        A callback that raises doesn't stop the scheduler: its traceback is printed and the
+        next alarm runs as usual.
+        """
+        try:
+            while (alarm := self._next_due(stop_when_empty)) is not None:
+                # Callbacks run outside the lock, so they can schedule or cancel other alarms.
+                if alarm.cancelled:
+                    continue
+                try:
+                    alarm.callback(*alarm.args)
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            self._running = False
+
+    def start(self):
+        """
+        Runs the scheduler in a background thread until 'stop' is called.
+
+        Returns:
+            threading.Thread: The scheduler thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run_alarms, args=(False,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stops the scheduler after the callback that is running now (if any)."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
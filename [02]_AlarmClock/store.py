@@ -0,0 +1,372 @@
+# A persistent alarm store for the alarm clock.
+#
+# An alarm started with 'alarm()' only lives inside that one call, so closing the program (or
+# a crash) loses it. This store keeps alarms in an append-only log file: every change is one
+# JSON line added to the end, and the file is rewritten with just the live alarms
+# ("compacted") once it has grown well past them. On startup the log is replayed, alarms that
+# should have rung while the program was not running are reported in order, and the rest are
+# put on the scheduler.
+#
+# Times in the store are wall-clock times (seconds since the epoch), because monotonic clock
+# readings mean nothing after a restart. They are turned into monotonic deadlines only when
+# alarms are scheduled.
+
+import argparse
+import contextlib
+import gc
+import json
+import math
+import os
+import time
+
+from scheduler import Scheduler
+
+# Compact the log once it holds this many more records than there are live alarms.
+COMPACT_SLACK = 10000
+
+# Log records are JSON arrays, which load about twice as fast as objects:
+#   ["a", id, at, every, label, last_fired]   an alarm was added
+#   ["d", id]                                 an alarm was deleted
+#   ["f", id, at]                             an alarm rang for its time 'at'
+#   ["n", next_id]                            ids below this were used (first in a compacted log)
+ADD = "a"
+DELETE = "d"
+FIRED = "f"
+NEXT_ID = "n"
+
+
+def _encode(record):
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    Pauses the garbage collector while a large number of objects is created.
+
+    Loading 100,000 alarms creates a few hundred thousand objects that all stay alive, and the
+    collector would otherwise walk all of them again and again, doubling the startup time.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _sync_directory(path):
+    """
+    Makes sure a rename inside the directory of 'path' reaches the disk. Windows can't open a
+    directory for this (and doesn't need it).
+    """
+    if os.name != "posix":
+        return
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def _add_record(alarm):
+    return [ADD, alarm["id"], alarm["at"], alarm["every"], alarm["label"], alarm["last_fired"]]
+
+
+class AlarmStore:
+    """
+    Alarms kept in an append-only log file.
+
+    Every alarm is a dict with an 'id', its first time 'at', an optional 'every' (repeat every
+    this many seconds), a 'label', and 'last_fired' (the last time it rang, or None). Repeating
+    alarms are stored as a rule, never as a list of future times.
+    """
+
+    def __init__(self, path, sync=True):
+        """
+        Opens a store, replaying its log.
+
+        Args:
+            path (str): The log file. It is created if it does not exist.
+            sync (bool): fsync after every change, so it survives a power cut.
+        """
+        self.path = path
+        self.sync = sync
+        self.alarms = {}
+        self.next_id = 1
+        self.records = 0
+        self.damaged = False
+        with _gc_paused():
+            self._load()
+        self.file = open(path, "ab")
+        if self.damaged:
+            # Rewrite the log without the broken records, so new ones are not appended to them.
+            self.compact()
+
+    def _load(self):
+        """Replays the log into 'self.alarms'."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as file:
+            data = file.read().strip()
+        if not data:
+            return
+
+        try:
+            # Parsing the whole log as one JSON array is much faster than line by line.
+            records = json.loads(b"[" + data.replace(b"\n", b",") + b"]")
+        except ValueError:
+            # A crash in the middle of a write can leave a torn last line; skip what is broken.
+            records = []
+            for line in data.splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+            self.damaged = True
+
+        alarms = self.alarms
+        # New ids continue after the highest one in the log (or the one kept by compaction,
+        # which drops the records of deleted alarms), so an id is never used twice.
+        next_id = 1
+        for record in records:
+            try:
+                op = record[0]
+                if op == ADD:
+                    _, alarm_id, at, every, label, last_fired = record
+                    alarms[alarm_id] = {"id": alarm_id, "at": at, "every": every, "label": label,
+                                        "last_fired": last_fired}
+                    next_id = max(next_id, alarm_id + 1)
+                elif op == DELETE:
+                    alarms.pop(record[1], None)
+                elif op == FIRED:
+                    if record[1] in alarms:
+                        alarms[record[1]]["last_fired"] = record[2]
+                elif op == NEXT_ID:
+                    next_id = max(next_id, record[1])
+            except (IndexError, KeyError, TypeError, ValueError):
+                # A record of the wrong shape: skip it like a torn line.
+                self.damaged = True
+        self.next_id = next_id
+        self.records = len(records)
+
+    def _append(self, record):
+        """Adds one record to the end of the log."""
+        self.file.write(_encode(record))
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.records += 1
+        if self.records > len(self.alarms) + COMPACT_SLACK:
+            self.compact()
+
+    def add(self, at, every=None, label=""):
+        """
+        Stores a new alarm.
+
+        Args:
+            at (float): When the alarm first rings, in seconds since the epoch.
+            every (float, optional): Ring again every this many seconds.
+            label (str): A name for the alarm.
+
+        Returns:
+            dict: The new alarm.
+        """
+        if every is not None and every <= 0:
+            raise ValueError("The repeat interval must be greater than 0.")
+        alarm = {"id": self.next_id, "at": at, "every": every, "label": label, "last_fired": None}
+        self.next_id += 1
+        self.alarms[alarm["id"]] = alarm
+        self._append(_add_record(alarm))
+        return alarm
+
+    def delete(self, alarm_id):
+        """Removes an alarm."""
+        if self.alarms.pop(alarm_id, None) is not None:
+            self._append([DELETE, alarm_id])
+
+    def mark_fired(self, alarm_id, at):
+        """
+        Records that an alarm rang. One-off alarms are removed once they have rung.
+
+        Args:
+            alarm_id (int): The alarm.
+            at (float): The time it was due (not when it actually rang).
+        """
+        alarm = self.alarms.get(alarm_id)
+        if alarm is None:
+            return
+        if alarm["every"] is None:
+            self.delete(alarm_id)
+        else:
+            alarm["last_fired"] = at
+            self._append([FIRED, alarm_id, at])
+
+    def compact(self):
+        """
+        Rewrites the log with only the live alarms.
+
+        The new log is written next to the old one and then swapped in with a single rename,
+        so a crash at any point leaves either the old or the new log, never half of one. It
+        starts with the next id, which the dropped records of deleted alarms can't tell.
+        """
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(_encode([NEXT_ID, self.next_id]))
+            file.write(b"".join(_encode(_add_record(alarm)) for alarm in self.alarms.values()))
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temporary, self.path)
+        _sync_directory(self.path)
+        self.file = open(self.path, "ab")
+        self.records = len(self.alarms) + 1
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def next_time(alarm, after):
+        """
+        Works out the first time an alarm rings after 'after', from its rule.
+
+        Args:
+            alarm (dict): The alarm.
+            after (float): A time in seconds since the epoch.
+
+        Returns:
+            float: The next time, or None if a one-off alarm has already rung.
+        """
+        if alarm["every"] is None:
+            return alarm["at"] if alarm["at"] > after else None
+        if alarm["at"] > after:
+            return alarm["at"]
+        # Every time is computed as at + steps * every, never by adding up intervals, so the
+        # same time always comes out exactly the same. Rounding can make the division one step
+        # short, though.
+        steps = math.floor((after - alarm["at"]) / alarm["every"]) + 1
+        while alarm["at"] + steps * alarm["every"] <= after:
+            steps += 1
+        return alarm["at"] + steps * alarm["every"]
+
+    def missed(self, now=None):
+        """
+        Finds the alarms that should have rung while nothing was running.
+
+        A repeating alarm that missed several times is only reported once, at its latest
+        missed time.
+
+        Args:
+            now (float, optional): The current time. Defaults to time.time().
+
+        Returns:
+            list: (time it was due, alarm) pairs, earliest first.
+        """
+        now = time.time() if now is None else now
+        missed = []
+        for alarm in self.alarms.values():
+            if alarm["every"] is None:
+                due = alarm["at"] if alarm["at"] <= now else None
+            elif alarm["at"] <= now:
+                steps = math.floor((now - alarm["at"]) / alarm["every"])
+                if alarm["at"] + steps * alarm["every"] > now:
+                    steps -= 1
+                due = alarm["at"] + steps * alarm["every"]
+            else:
+                due = None
+            if due is not None and (alarm["last_fired"] is None or due > alarm["last_fired"]):
+                missed.append((due, alarm))
+        missed.sort(key=lambda pair: (pair[0], pair[1]["id"]))
+        return missed
+
+    def schedule(self, scheduler, callback, now=None):
+        """
+        Rings the missed alarms (in order) and puts every other alarm on a scheduler.
+
+        Args:
+            scheduler (Scheduler): The scheduler to add the alarms to.
+            callback (callable): Called as callback(alarm, due_time) when an alarm rings.
+            now (float, optional): The current time. Defaults to time.time().
+
+        Returns:
+            int: The number of alarms that were missed.
+        """
+        now = time.time() if now is None else now
+        missed = self.missed(now)
+        for due, alarm in missed:
+            callback(alarm, due)
+            self.mark_fired(alarm["id"], due)
+
+        # Wall-clock time -> the scheduler's monotonic clock.
+        offset = scheduler.clock() - now
+        with _gc_paused():
+            entries = []
+            for alarm in self.alarms.values():
+                due = self.next_time(alarm, now)
+                if due is not None:
+                    entries.append((due + offset, self._ring, (scheduler, offset, alarm, due, callback)))
+            scheduler.call_at_many(entries)
+        return len(missed)
+
+    def _ring(self, scheduler, offset, alarm, due, callback):
+        """Rings an alarm from the scheduler, records it and schedules its next time."""
+        if alarm["id"] not in self.alarms:
+            return  # Deleted after it was scheduled.
+        callback(alarm, due)
+        self.mark_fired(alarm["id"], due)
+        # Repeating alarms are scheduled one time at a time, straight from their rule.
+        next_due = self.next_time(alarm, due)
+        if next_due is not None:
+            scheduler.call_at(next_due + offset, self._ring, scheduler, offset, alarm, next_due, callback)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep alarms that survive a restart.")
+    parser.add_argument("--store", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "alarms.log"),
+                        help="alarm log file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="add an alarm")
+    add_parser.add_argument("seconds", type=float, help="seconds from now until the alarm rings")
+    add_parser.add_argument("--every", type=float, help="ring again every this many seconds")
+    add_parser.add_argument("--label", default="", help="a name for the alarm")
+    delete_parser = commands.add_parser("delete", help="delete an alarm")
+    delete_parser.add_argument("id", type=int)
+    commands.add_parser("list", help="list the alarms")
+    commands.add_parser("run", help="ring missed alarms, then wait for the rest")
+    args = parser.parse_args()
+
+    store = AlarmStore(args.store)
+    if args.command == "add":
+        alarm = store.add(time.time() + args.seconds, args.every, args.label)
+        print(f"Added alarm {alarm['id']}")
+    elif args.command == "delete":
+        store.delete(args.id)
+    elif args.command == "list":
+        now = time.time()
+        for alarm in store.alarms.values():
+            due = store.next_time(alarm, now)
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(due)) if due is not None else "missed"
+            repeat = f", every {alarm['every']:g} s" if alarm["every"] else ""
+            print(f"{alarm['id']}\t{when}{repeat}\t{alarm['label']}")
+    else:
+        # Imported here so the other commands work without audio.
+        from main import load_sounds
+
+        with load_sounds() as engine:
+            scheduler = Scheduler()
+
+            def ring(alarm, due):
+                late = time.time() - due
+                note = f" (missed by {late:.0f} s)" if late > 1 else ""
+                print(f"Alarm {alarm['id']} {alarm['label']}{note}")
+                engine.play("alarm")
+
+            store.schedule(scheduler, ring)
+            scheduler.run()
+            engine.wait()
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+import numpy as np
+
+from policy import CHARACTER_CLASSES, Policy
+
+MAGIC = b"PWIDX001"
+# Magic, byte order check, number of keys, directory bits.
+HEADER = struct.Struct("<8sQQQ")
+BYTE_ORDER_CHECK = 0x0102030405060708
+# How many keys are sorted in memory at a time while building an index.
+RUN_SIZE = 1 << 22
+# The directory aims for about this many keys per bucket.
+KEYS_PER_BUCKET = 64
+# How many passwords 'audit_passwords' looks up per batch.
+AUDIT_BATCH = 65536
+
+_unpack_key = struct.Struct(">Q").unpack_from
+# A SHA-1 digest: its first 8 bytes (big-endian) are the key.
+_DIGEST = np.dtype([("key", ">u8"), ("rest", "V12")])
+
+
+def policy_entropy(policy):
+    """
+    Calculates the exact entropy of a policy, in bits.
+
+    This is log2 of the number of different passwords the policy allows, i.e. what an attacker
+    who knows the policy has to search through. The passwords are counted exactly, one
+    position at a time, keeping track of how many characters each class still needs and (for
+    'no_repeat') which class the previous character came from.
+
+    Args:
+        policy (Policy): The policy.
+
+    Returns:
+        float: The entropy in bits.
+    """
+    minimums = tuple(minimum for _, _, minimum in policy.classes)
+    sizes = [len(alphabet) for _, alphabet, _ in policy.classes]
+    # (characters taken from each class, capped at its minimum; class of the last character)
+    states = {((0,) * len(sizes), None): 1}
+    for _ in range(policy.length):
+        next_states = {}
+        for (taken, last), count in states.items():
+            for index, size in enumerate(sizes):
+                choices = size - 1 if policy.no_repeat and last == index else size
+                if choices:
+                    key = (taken[:index] + (min(taken[index] + 1, minimums[index]),) + taken[index + 1:], index)
+                    next_states[key] = next_states.get(key, 0) + count * choices
+        states = next_states
+
+    total = sum(count for (taken, _), count in states.items() if taken == minimums)
+    return math.log2(total) if total else 0.0
+
+
+def password_entropy(password):
+    """
+    Estimates the entropy of an existing password from the character classes it uses.
+
+    Args:
+        password (str): The password.
+
+    Returns:
+        float: len(password) * log2(size of all classes the password draws from), in bits.
+    """
+    pool = 0
+    rest = set(password)
+    for name in ("lower", "upper", "digits", "special"):
+        alphabet = CHARACTER_CLASSES[name]
+        if rest & set(alphabet):
+            pool += len(alphabet)
+            rest -= set(alphabet)
+    # Anything else (spaces, accents, ...): count it as a large class of its own.
+    if rest:
+        pool += 100
+    return len(password) * math.log2(pool) if pool else 0.0
+
+
+def password_key(password):
+    """
+    Turns a password into its 64-bit index key: the first 8 bytes of its SHA-1 hash.
+
+    Using SHA-1 means breach lists that are only published as SHA-1 hashes can be indexed too.
+    Bytes that aren't UTF-8 (read with errors="surrogateescape", as in Latin-1 breach dumps)
+    are hashed as they were in the file.
+    """
+    return _unpack_key(hashlib.sha1(password.encode("utf-8", "surrogateescape")).digest())[0]
+
+
+def _read_keys(path, hashed):
+    """
+    Reads index keys from a corpus file.
+
+    Args:
+        path (str): One password per line, or one SHA-1 hex hash per line (optionally followed
+            by ':count', as in the Pwned Passwords lists) when 'hashed' is set.
+        hashed (bool): The file holds SHA-1 hashes instead of passwords.
+
+    Yields:
+        int: The keys.
+    """
+    with open(path, encoding="utf-8", errors="surrogateescape") as file:
+        for line in file:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            if hashed:
+                yield int(line[:16], 16)
+            else:
+                yield password_key(line)
+
+
+def _write_runs(keys, directory):
+    """
+    Sorts the keys in memory-sized runs and writes every run to its own file.
+
+    Returns:
+        list: (path, number of keys) of every run.
+    """
+    runs = []
+    run = array("Q")
+    for key in keys:
+        run.append(key)
+        if len(run) == RUN_SIZE:
+            runs.append(_write_run(run, directory, len(runs)))
+            run = array("Q")
+    if run or not runs:
+        runs.append(_write_run(run, directory, len(runs)))
+    return runs
+
+
+def _write_run(run, directory, number):
+    path = os.path.join(directory, f"run{number}.bin")
+    with open(path, "wb") as file:
+        array("Q", sorted(run)).tofile(file)
+    return path, len(run)
+
+
+def _iter_run(path, size):
+    with open(path, "rb") as file:
+        while size:
+            chunk = array("Q")
+            chunk.fromfile(file, min(size, 65536))
+            size -= len(chunk)
+            yield from chunk
+
+
+def build_index(corpus, index_path, hashed=False):
+    """
+    Builds an on-disk index of a breached-password corpus.
+
+    The index is a sorted array of 64-bit keys, with a directory in front of it that points
+    to where every range of keys (by their top bits) starts. The corpus is sorted in runs that
+    fit in memory and the runs are merged, so corpora much larger than RAM can be indexed.
+
+    Args:
+        corpus (str): The corpus file (see '_read_keys').
+        index_path (str): The index file to create.
+        hashed (bool): The corpus holds SHA-1 hashes instead of passwords.
+
+    Returns:
+        int: The number of distinct keys in the index.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(index_path))) as directory:
+        runs = _write_runs(_read_keys(corpus, hashed), directory)
+        upper_bound = sum(size for _, size in runs)
+        bits = max(0, min(24, math.ceil(math.log2(max(upper_bound, 1) / KEYS_PER_BUCKET))))
+        buckets = array("Q", bytes(8 * ((1 << bits) + 1)))
+        keys_offset = HEADER.size + len(buckets) * 8
+
+        count = 0
+        previous = None
+        with open(index_path, "wb") as file:
+            file.seek(keys_offset)
+            out = array("Q")
+            for key in heapq.merge(*(_iter_run(path, size) for path, size in runs)):
+                if key == previous:
+                    continue
+                previous = key
+                # Count the keys per bucket first; they become start offsets below.
+                buckets[(key >> (64 - bits)) + 1 if bits else 1] += 1
+                out.append(key)
+                count += 1
+                if len(out) == 65536:
+                    out.tofile(file)
+                    out = array("Q")
+            out.tofile(file)
+
+            for bucket in range(1, len(buckets)):
+                buckets[bucket] += buckets[bucket - 1]
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, BYTE_ORDER_CHECK, count, bits))
+            buckets.tofile(file)
+    return count
+
+
+class BreachIndex:
+    """
+    A memory-mapped breached-password index built by 'build_index'.
+
+    Nothing is read into memory up front; the operating system pages in the parts of the file
+    that lookups touch. A lookup finds its bucket in the directory and then binary-searches
+    the few keys in that bucket.
+    """
+
+    def __init__(self, path):
+        """
+        Opens an index.
+
+        Raises:
+            ValueError: If the file is not an index, or was built on a machine with a
+                different byte order.
+        """
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, order, self.count, self.bits = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a password index.")
+        view = memoryview(self.map)
+        if view[8:16].cast("Q")[0] != order:
+            raise ValueError(f"{path} was built with a different byte order.")
+        keys_offset = HEADER.size + ((1 << self.bits) + 1) * 8
+        self.buckets = view[HEADER.size:keys_offset].cast("Q")
+        self.keys = view[keys_offset:keys_offset + self.count * 8].cast("Q")
+        self.key_array = np.frombuffer(self.keys, dtype=np.uint64)
+        self.shift = 64 - self.bits
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, password):
+        return self.contains_key(password_key(password))
+
+    def contains_key(self, key):
+        """
+        Checks whether a key (see 'password_key') is in the index.
+
+        Returns:
+            bool: True if it is.
+        """
+        bucket = key >> self.shift if self.bits else 0
+        end = self.buckets[bucket + 1]
+        position = bisect_left(self.keys, key, self.buckets[bucket], end)
+        return position < end and self.keys[position] == key
+
+    def contains_many(self, passwords):
+        """
+        Looks up many passwords at once.
+
+        This is the same as 'password in index' for every password, but only the hashing is
+        done per password: the keys of the whole batch are looked up with one searchsorted.
+
+        Returns:
+            list: True or False for every password.
+        """
+        sha1 = hashlib.sha1
+        digests = b"".join([sha1(password.encode("utf-8", "surrogateescape")).digest() for password in passwords])
+        if not digests or not self.count:
+            return [False] * (len(digests) // 20)
+        keys = np.frombuffer(digests, dtype=_DIGEST)["key"].astype(np.uint64)
+        positions = np.searchsorted(self.key_array, keys)
+        np.minimum(positions, self.count - 1, out=positions)
+        return (self.key_array[positions] == keys).tolist()
+
+    def close(self):
+        self.key_array = None  # Its hold on the map has to go before the map can be closed.
+        self.keys.release()
+        self.buckets.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def audit_passwords(passwords, index, minimum_bits=60.0):
+    """
+    Checks passwords against a breach index and an entropy estimate.
+
+    Args:
+        passwords: An iterable of passwords.
+        index (BreachIndex): The breached-password index.
+        minimum_bits (float): Passwords with a lower estimated entropy count as weak.
+
+    Yields:
+        tuple: (password, breached, estimated bits, weak) for every password.
+    """
+    passwords = iter(passwords)
+    while batch := list(islice(passwords, AUDIT_BATCH)):
+        for password, breached in zip(batch, index.contains_many(batch)):
+            bits = password_entropy(password)
+            yield password, breached, bits, breached or bits < minimum_bits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit password policies and password lists.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    entropy_parser = commands.add_parser("entropy", help="print the exact entropy of a policy")
+    entropy_parser.add_argument("policy", help="JSON policy file")
+    build_parser = commands.add_parser("build", help="index a breached-password corpus")
+    build_parser.add_argument("corpus", help="one password (or SHA-1 hash with --sha1) per line")
+    build_parser.add_argument("index", help="index file to create")
+    build_parser.add_argument("--sha1", action="store_true", help="the corpus holds SHA-1 hashes")
+    check_parser = commands.add_parser("check", help="check a password list against an index")
+    check_parser.add_argument("index", help="index built with 'build'")
+    check_parser.add_argument("passwords", help="one password per line ('-' for stdin)")
+    check_parser.add_argument("--minimum-bits", type=float, default=60.0, help="weaker passwords are reported")
+    args = parser.parse_args()
+
+    if args.command == "entropy":
+        policy = Policy.load(args.policy)
+        print(f"{policy_entropy(policy):.2f} bits")
+    elif args.command == "build":
+        print(f"Indexed {build_index(args.corpus, args.index, args.sha1):,} keys")
+    else:
+        file = sys.stdin if args.passwords == "-" else open(args.passwords, encoding="utf-8", errors="surrogateescape")
+        checked = weak = breached = 0
+        with BreachIndex(args.index) as index:
+            passwords = (line.rstrip("\r\n") for line in file)
+            for password, is_breached, bits, is_weak in audit_passwords(passwords, index, args.minimum_bits):
+                checked += 1
+                breached += is_breached
+                weak += is_weak
+                if is_weak:
+                    reason = "breached" if is_breached else f"{bits:.0f} bits"
+                    print(f"{password}\t{reason}")
+        print(f"Checked {checked:,} passwords: {breached:,} breached, {weak:,} weak", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import csv
+import io
+import json
+import os
+import secrets
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from policy import Policy, has_repeat
+
+# How many random bytes are read from the OS at a time.
+BUFFER_SIZE = 1 << 16
+# How many passwords are built per batch.
+BATCH_SIZE = 4096
+# How many passwords each worker process generates per task.
+SHARD_SIZE = 100000
+
+
+class RandomStream:
+    """
+    Turns large os.urandom buffers into unbiased random choices.
+
+    A byte is mapped to one of n choices with 'byte % n', but only bytes below the largest
+    multiple of n are used; the others are thrown away (rejection sampling), so every choice is
+    exactly as likely as the others. Both steps run in C with bytes.translate, over a whole
+    buffer at a time.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._tables = {}
+        self._spare = {}
+
+    def _table(self, size):
+        if size not in self._tables:
+            if not 1 <= size <= 256:
+                raise ValueError("Can only choose between 1 and 256 options.")
+            limit = 256 - 256 % size
+            table = bytes(byte % size for byte in range(256))
+            self._tables[size] = (table, bytes(range(limit, 256)))
+        return self._tables[size]
+
+    def indices(self, size, count):
+        """
+        Draws 'count' random numbers in range(size).
+
+        Returns:
+            bytes: One number per byte.
+        """
+        table, rejected = self._table(size)
+        spare = self._spare.get(size, b"")
+        parts = [spare]
+        have = len(spare)
+        while have < count:
+            # Ask for a bit more than needed so one read is usually enough.
+            wanted = max(self.buffer_size, (count - have) * 256 // (256 - len(rejected)) + 64)
+            part = os.urandom(wanted).translate(table, rejected)
+            parts.append(part)
+            have += len(part)
+        drawn = b"".join(parts)
+        self._spare[size] = drawn[count:]
+        return drawn[:count]
+
+    def chars(self, alphabet, count):
+        """
+        Draws 'count' random characters from 'alphabet'.
+
+        Returns:
+            str: The characters.
+        """
+        mapping = {index: char for index, char in enumerate(alphabet)}
+        return self.indices(len(alphabet), count).decode("latin-1").translate(mapping)
+
+
+def generate_passwords(count, length, numbers=True, special_characters=True, stream=None):
+    """
+    Generates 'count' passwords of exactly 'length' characters.
+
+    Every password contains at least one digit and one special character when they are asked
+    for, just like 'generate_password', but without its retry loop (see 'policy_passwords').
+
+    Args:
+        count (int): The number of passwords.
+        length (int): The length of every password.
+        numbers (bool): Include digits (at least one per password).
+        special_characters (bool): Include special characters (at least one per password).
+        stream (RandomStream, optional): The source of randomness.
+
+    Yields:
+        str: The passwords.
+    """
+    return policy_passwords(Policy.from_options(length, numbers, special_characters), count, stream)
+
+
+def policy_passwords(policy, count, stream=None):
+    """
+    Generates 'count' passwords that meet a policy.
+
+    The characters a class minimum asks for are drawn from that class and placed at random
+    positions, and the rest of the password is drawn from all allowed characters, so no
+    password ever has to be thrown away and retried. With 'no_repeat', a character equal to the
+    one before it is redrawn from its own class, avoiding both neighbours.
+
+    Args:
+        policy (Policy): The policy to meet.
+        count (int): The number of passwords.
+        stream (RandomStream, optional): The source of randomness.
+
+    Yields:
+        str: The passwords.
+    """
+    stream = stream or RandomStream()
+    required = [alphabet for _, alphabet, minimum in policy.classes for _ in range(minimum)]
+    free = policy.length - len(required)
+
+    for start in range(0, count, BATCH_SIZE):
+        size = min(BATCH_SIZE, count - start)
+        filler = stream.chars(policy.alphabet, free * size)
+        # One required character and one insert position per password and per slot. Inserting
+        # at a uniform position of the growing password gives uniform, distinct positions.
+        inserts = [(stream.chars(alphabet, size), stream.indices(free + step + 1, size))
+                   for step, alphabet in enumerate(required)]
+
+        for index in range(size):
+            pwd = filler[index * free:(index + 1) * free]
+            for chars, positions in inserts:
+                position = positions[index]
+                pwd = pwd[:position] + chars[index] + pwd[position:]
+            if policy.no_repeat and has_repeat(pwd):
+                pwd = _remove_repeats(pwd, policy)
+            yield pwd
+
+
+def _remove_repeats(pwd, policy):
+    """
+    Redraws every character that equals the one before it.
+
+    The new character comes from the same class (so the class minimums still hold) and differs
+    from both neighbours (so no new repeat appears).
+    """
+    chars = list(pwd)
+    for index in range(1, len(chars)):
+        if chars[index] == chars[index - 1]:
+            neighbours = set(chars[index - 1:index + 2])
+            options = [char for char in policy.class_of(chars[index]) if char not in neighbours]
+            if not options:
+                # Only classes without a minimum can be this small; any other character will do.
+                options = [char for char in policy.alphabet if char not in neighbours]
+            chars[index] = secrets.choice(options)
+    return "".join(chars)
+
+
+def _format_shard(task):
+    """
+    Generates one shard of a batch and formats it. This runs inside a worker process.
+
+    Args:
+        task (tuple): (policy, first id, number of passwords, output format).
+
+    Returns:
+        str: The formatted rows of the shard.
+    """
+    policy, first, size, fmt = task
+    passwords = policy_passwords(policy, size)
+    if fmt == "csv":
+        rows = io.StringIO()
+        csv.writer(rows, lineterminator="\n").writerows(zip(range(first, first + size), passwords))
+        return rows.getvalue()
+    if fmt == "jsonl":
+        dumps = json.dumps
+        return "".join(f'{{"id":{number},"password":{dumps(pwd)}}}\n'
+                       for number, pwd in zip(range(first, first + size), passwords))
+    return "".join(pwd + "\n" for pwd in passwords)
+
+
+def write_batch(policy, count, file, fmt="text", workers=None, shard_size=SHARD_SIZE):
+    """
+    Generates a large batch of passwords across a pool of processes and writes it out.
+
+    The batch is cut into shards of consecutive ids. Shards are written in id order, whichever
+    worker finishes first, so the output is always the same shape: ids 0..count-1, in order.
+
+    Args:
+        policy (Policy): The policy every password meets.
+        count (int): The number of passwords.
+        file: A text file (or sys.stdout).
+        fmt (str): "text" (one password per line), "csv" (id,password) or "jsonl".
+        workers (int, optional): The number of worker processes. Defaults to one per CPU.
+        shard_size (int): How many passwords each task generates.
+    """
+    if fmt == "csv":
+        file.write("id,password\n")
+    tasks = [(policy, first, min(shard_size, count - first), fmt) for first in range(0, count, shard_size)]
+    if workers == 1:
+        for task in tasks:
+            file.write(_format_shard(task))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for text in executor.map(_format_shard, tasks):
+            file.write(text)
+
+
+def write_passwords(passwords, file):
+    """
+    Writes passwords to a file, one per line, in large chunks.
+
+    Args:
+        passwords: An iterable of passwords.
+        file: A text file (or sys.stdout).
+    """
+    chunk = []
+    for pwd in passwords:
+        chunk.append(pwd)
+        if len(chunk) == BATCH_SIZE:
+            file.write("\n".join(chunk) + "\n")
+            chunk.clear()
+    if chunk:
+        file.write("\n".join(chunk) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate many passwords at once.")
+    parser.add_argument("count", type=int, help="number of passwords")
+    parser.add_argument("--length", type=int, default=16, help="length of every password")
+    parser.add_argument("--no-numbers", action="store_true", help="leave out digits")
+    parser.add_argument("--no-special", action="store_true", help="leave out special characters")
+    parser.add_argument("--policy", help="JSON policy file (overrides the options above)")
+    parser.add_argument("--format", choices=["text", "csv", "jsonl"], default="text", help="output format")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (0: one per CPU)")
+    parser.add_argument("-o", "--output", help="file to write to (default: stdout)")
+    args = parser.parse_args()
+
+    if args.policy:
+        policy = Policy.load(args.policy)
+    else:
+        policy = Policy.from_options(args.length, not args.no_numbers, not args.no_special)
+
+    file = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        if args.workers == 1 and args.format == "text":
+            write_passwords(policy_passwords(policy, args.count), file)
+        else:
+            write_batch(policy, args.count, file, args.format, args.workers or None)
+    finally:
+        if args.output:
+            file.close()
+
+
+if __name__ == "__main__":
+    main()
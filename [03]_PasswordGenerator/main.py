@@ -1,3 +1,4 @@
+import argparse
 import random
 import string
 
@@ -36,9 +37,26 @@ def generate_password(min_length, numbers=True, special_characters=True):
     return pwd
 
 
-min_length = int(input("Enter the minimum length (in digits): "))
-has_number = input("Do you want to have numbers (y/n)? ").lower() == "y"
-has_special = input(
-    "Do you want to have special characters (y/n)? ").lower() == "y"
-pwd = generate_password(min_length, has_number, has_special)
-print(f"The generated password is: {pwd}")
+def main(argv=None):
+    """
+    Generates a password from command-line options, or asks for them if no length is given.
+    """
+    parser = argparse.ArgumentParser(description="Generate a password.")
+    parser.add_argument("--length", type=int, help="the minimum length (asked for if left out)")
+    parser.add_argument("--no-numbers", action="store_true", help="leave out numbers")
+    parser.add_argument("--no-special", action="store_true", help="leave out special characters")
+    args = parser.parse_args(argv)
+
+    if args.length is None:
+        min_length = int(input("Enter the minimum length (in digits): "))
+        has_number = input("Do you want to have numbers (y/n)? ").lower() == "y"
+        has_special = input(
+            "Do you want to have special characters (y/n)? ").lower() == "y"
+    else:
+        min_length, has_number, has_special = args.length, not args.no_numbers, not args.no_special
+    pwd = generate_password(min_length, has_number, has_special)
+    print(f"The generated password is: {pwd}")
+
+
+if __name__ == "__main__":
+    main()
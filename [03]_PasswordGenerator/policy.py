@@ -0,0 +1,158 @@
+import json
+import re
+import string
+
+# The character classes a policy can use without spelling out their alphabet.
+CHARACTER_CLASSES = {
+    "lower": string.ascii_lowercase,
+    "upper": string.ascii_uppercase,
+    "letters": string.ascii_letters,
+    "digits": string.digits,
+    "special": string.punctuation,
+}
+
+# Characters that are easy to mix up when a password is read or typed by hand.
+AMBIGUOUS = "Il1|O0o`'\""
+
+_REPEAT = re.compile(r"(.)\1", re.DOTALL)
+
+
+def has_repeat(password):
+    """Returns True if the same character appears twice in a row in 'password'."""
+    return _REPEAT.search(password) is not None
+
+
+class Policy:
+    """
+    A declarative description of the passwords to generate.
+
+    A policy has a fixed length and a list of character classes. Every class has an alphabet
+    and a minimum number of characters that each password must take from it. Passwords only
+    use characters from these classes. Policies are usually loaded from a dict or JSON file:
+
+        {
+            "length": 16,
+            "classes": {"lower": 1, "upper": 1, "digits": 2, "special": 1},
+            "alphabets": {"special": "!@#$%&*"},
+            "exclude_ambiguous": true,
+            "exclude": "",
+            "no_repeat": true
+        }
+
+    'classes' maps class names to minimum counts; the built-in names are those of
+    CHARACTER_CLASSES and any other name needs an entry in 'alphabets'. 'no_repeat' forbids the
+    same character twice in a row.
+    """
+
+    def __init__(self, length, classes, exclude="", no_repeat=False):
+        """
+        Creates and checks a policy.
+
+        Args:
+            length (int): The length of every password.
+            classes (list): (name, alphabet, minimum) for every character class.
+            exclude (str): Characters that must never be used.
+            no_repeat (bool): Forbid the same character twice in a row.
+
+        Raises:
+            ValueError: If no password can meet the policy.
+        """
+        self.length = length
+        self.exclude = exclude
+        self.no_repeat = no_repeat
+        self.classes = []
+        seen = set()
+        for name, alphabet, minimum in classes:
+            # Drop excluded and duplicate characters, keeping the order of the alphabet.
+            alphabet = "".join(dict.fromkeys(char for char in alphabet if char not in exclude))
+            if not alphabet:
+                raise ValueError(f"The {name!r} class has no characters left.")
+            if len(alphabet) > 256:
+                raise ValueError(f"The {name!r} class has more than 256 characters.")
+            if seen & set(alphabet):
+                raise ValueError(f"The {name!r} class shares characters with another class.")
+            if no_repeat and minimum and len(alphabet) < 3:
+                raise ValueError(f"The {name!r} class needs at least 3 characters to avoid repeats.")
+            seen.update(alphabet)
+            self.classes.append((name, alphabet, minimum))
+
+        self.alphabet = "".join(alphabet for _, alphabet, _ in self.classes)
+        if len(self.alphabet) > 256:
+            raise ValueError("A policy can use at most 256 different characters.")
+        if not self.required_count() <= length <= 256:
+            raise ValueError(f"The length must be between {self.required_count()} and 256 characters.")
+
+    def required_count(self):
+        """Returns how many characters of every password are taken by the class minimums."""
+        return sum(minimum for _, _, minimum in self.classes)
+
+    def class_of(self, char):
+        """Returns the alphabet of the class that 'char' belongs to."""
+        for _, alphabet, _ in self.classes:
+            if char in alphabet:
+                return alphabet
+        raise ValueError(f"{char!r} is not allowed by the policy.")
+
+    def check(self, password):
+        """
+        Checks whether a password meets the policy.
+
+        Returns:
+            bool: True if it does.
+        """
+        if len(password) != self.length or any(char not in self.alphabet for char in password):
+            return False
+        if self.no_repeat and has_repeat(password):
+            return False
+        return all(sum(password.count(char) for char in alphabet) >= minimum
+                   for _, alphabet, minimum in self.classes)
+
+    @classmethod
+    def from_options(cls, length, numbers=True, special_characters=True):
+        """
+        Builds the policy of 'generate_password': letters, plus at least one digit and one
+        special character when they are asked for.
+        """
+        classes = [("letters", string.ascii_letters, 0)]
+        if numbers:
+            classes.append(("digits", string.digits, 1))
+        if special_characters:
+            classes.append(("special", string.punctuation, 1))
+        return cls(length, classes)
+
+    @classmethod
+    def from_dict(cls, config):
+        """
+        Builds a policy from its dict form (see the class docstring).
+
+        Raises:
+            ValueError: If a class has no alphabet or no password can meet the policy.
+        """
+        alphabets = config.get("alphabets", {})
+        classes = []
+        for name, minimum in config.get("classes", {"letters": 0, "digits": 1, "special": 1}).items():
+            alphabet = alphabets.get(name, CHARACTER_CLASSES.get(name))
+            if alphabet is None:
+                raise ValueError(f"The {name!r} class needs an alphabet.")
+            classes.append((name, alphabet, minimum))
+
+        exclude = config.get("exclude", "")
+        if config.get("exclude_ambiguous", False):
+            exclude += AMBIGUOUS
+        return cls(config.get("length", 16), classes, exclude, config.get("no_repeat", False))
+
+    @classmethod
+    def load(cls, path):
+        """Builds a policy from a JSON file."""
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
+
+    def to_dict(self):
+        """Returns the dict form of the policy."""
+        return {
+            "length": self.length,
+            "classes": {name: minimum for name, _, minimum in self.classes},
+            "alphabets": {name: alphabet for name, alphabet, _ in self.classes},
+            "exclude": self.exclude,
+            "no_repeat": self.no_repeat,
+        }
@@ -0,0 +1,437 @@
+# Alerts on the listings, checked as each snapshot arrives.
+#
+# Questions like "did BTC move more than 2% in 5 minutes?" or "which coins entered the top
+# 100?" used to mean rerunning notebook cells over all of api.csv. The AlertEngine instead keeps
+# a small state table: one slot per coin in a few numpy arrays, and a ring of the recent
+# snapshots, so a new snapshot is compared with the ones before it without reading history.
+#
+# Rules are checked all at once with array operations. Every rule comes down to
+#
+#     sign * (measure - level) > 0
+#
+# where the measure is a field's value, its % change over a window, or its % distance from its
+# mean over a window. Rules that share a measure (same field, kind of measure and window) share
+# the work of computing it, for every coin at once. A rule fires when its condition becomes
+# true, not on every snapshot while it stays true.
+#
+# Rules are dicts (e.g. read from a JSON file):
+#     {"name": "BTC 2% in 5 min", "kind": "move", "coin": "BTC", "level": 2, "seconds": 300}
+#     {"name": "new top 100", "kind": "top", "level": 100}
+# 'coin' is a symbol or an id; without it the rule applies to every coin.
+
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The fields rules can look at.
+FIELDS = [
+    "quote.USD.price",
+    "quote.USD.market_cap",
+    "quote.USD.volume_24h",
+    "quote.USD.percent_change_1h",
+    "quote.USD.percent_change_24h",
+    "cmc_rank",
+]
+# kind -> (measure, sign, needs a window). The measures are:
+#   value: the field's value
+#   change: % change since the snapshot 'seconds' ago ('abs_change' ignores the direction)
+#   deviation: % distance of the value from its mean over the last 'seconds'
+KINDS = {
+    "above": ("value", 1, False),  # The value rises above 'level'.
+    "below": ("value", -1, False),  # The value falls below 'level'.
+    "rise": ("change", 1, True),  # It rose by more than 'level' % within 'seconds'.
+    "fall": ("change", -1, True),  # It fell by more than 'level' % within 'seconds'.
+    "move": ("abs_change", 1, True),  # It moved by more than 'level' % either way.
+    "cross_above": ("deviation", 1, True),  # It goes more than 'level' % above its 'seconds' average.
+    "cross_below": ("deviation", -1, True),  # It goes more than 'level' % below its 'seconds' average.
+    "top": ("value", -1, False),  # The coin enters the top 'level' by rank.
+}
+# Polls are never exactly 'interval' apart; a snapshot this much too new still counts as
+# 'seconds' old.
+SLACK = 1.0
+
+
+def _rule(spec, number):
+    """Checks a rule dict and fills in its defaults."""
+    kind = spec.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"Rule {number}: unknown kind {kind!r} (one of {', '.join(KINDS)}).")
+    measure, sign, windowed = KINDS[kind]
+    field = spec.get("field", "cmc_rank" if kind == "top" else "quote.USD.price")
+    if field not in FIELDS:
+        raise ValueError(f"Rule {number}: field {field!r} isn't tracked (one of {', '.join(FIELDS)}).")
+    if kind == "top" and field != "cmc_rank":
+        raise ValueError(f"Rule {number}: 'top' rules use the rank.")
+    if windowed and not spec.get("seconds", 0) > 0:
+        raise ValueError(f"Rule {number}: '{kind}' rules need a window ('seconds').")
+    level = given = float(spec.get("level", 0.0))
+    if kind in ("fall", "cross_below"):
+        level = -level
+    elif kind == "top":
+        level += 0.5  # rank <= N
+    return {
+        "name": spec.get("name", f"rule {number}"),
+        "kind": kind,
+        "coin": spec.get("coin"),
+        "field": field,
+        "given_level": given,
+        "level": level,
+        "sign": sign,
+        "key": (FIELDS.index(field), measure, float(spec["seconds"]) if windowed else 0.0),
+    }
+
+
+def load_rules(path):
+    """Reads a JSON list of rule dicts."""
+    with open(path) as file:
+        return json.load(file)
+
+
+class JsonLinesSink:
+    """Appends events to a JSON lines file, one object per line."""
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def __call__(self, events):
+        for event in events:
+            self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class AlertEngine:
+    """
+    Checks a set of rules against every new snapshot and reports the ones that fire.
+    """
+
+    def __init__(self, rules, sinks=(), capacity=1024, depth=16):
+        """
+        Args:
+            rules (list): Rule dicts (see the top of this file).
+            sinks (list): Callables that get the list of events of every snapshot.
+            capacity (int): Coin slots to start with; grows as needed.
+            depth (int): Snapshots the ring holds to start with. It grows until it covers the
+                longest window of the rules.
+
+        Raises:
+            ValueError: If a rule is malformed.
+        """
+        self.rules = [_rule(spec, number) for number, spec in enumerate(rules, 1)]
+        self.sinks = list(sinks)
+        self.longest = max((rule["key"][2] for rule in self.rules), default=0.0)
+
+        # The distinct measures, and which one every rule uses.
+        keys = list(dict.fromkeys(rule["key"] for rule in self.rules))
+        self.keys = {name: np.array([key[index] for key in keys]) for index, name in
+                     enumerate(("field", "measure", "seconds"))}
+        group = {key: number for number, key in enumerate(keys)}
+        single = [rule for rule in self.rules if rule["coin"] is not None]
+        every = [rule for rule in self.rules if rule["coin"] is None]
+        self.single, self.every = single, every
+        for name, rules in (("single", single), ("every", every)):
+            setattr(self, f"{name}_group", np.array([group[rule["key"]] for rule in rules], dtype=np.int64))
+            setattr(self, f"{name}_sign", np.array([rule["sign"] for rule in rules], dtype=np.float64))
+            setattr(self, f"{name}_level", np.array([rule["level"] for rule in rules], dtype=np.float64))
+            setattr(self, f"{name}_field", np.array([rule["key"][0] for rule in rules], dtype=np.int64))
+        self.single_slot = np.full(len(single), -1, dtype=np.int64)
+        self.single_active = np.zeros(len(single), dtype=bool)
+        self.every_active = np.zeros((len(every), capacity), dtype=bool)
+
+        # Coin slots, as in analytics.CoinStats.
+        self.slots = {}  # coin id -> slot
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.symbols = {}  # coin id -> symbol
+        self.current = np.full((len(FIELDS), capacity), np.nan)
+
+        # The ring of recent snapshots: values, and running sums and counts of the values so
+        # the mean over any window is one subtraction.
+        self.ring_time = np.full(depth, -np.inf)
+        self.ring_values = np.full((depth, len(FIELDS), capacity), np.nan)
+        self.ring_sum = np.zeros((depth, len(FIELDS), capacity))
+        self.ring_count = np.zeros((depth, len(FIELDS), capacity), dtype=np.int64)
+        self.position = -1  # Ring entry of the latest snapshot.
+        self.snapshots = 0
+        self._last_ids = self._last_slots = None
+
+    def _slots_for(self, ids, symbols):
+        """Returns the slot of every coin id, giving new coins a slot."""
+        if self._last_ids is not None and np.array_equal(ids, self._last_ids):
+            return self._last_slots
+        slots = np.empty(len(ids), dtype=np.int64)
+        for index, coin_id in enumerate(ids.tolist()):
+            slot = self.slots.get(coin_id)
+            if slot is None:
+                slot = self.slots[coin_id] = len(self.slots)
+            slots[index] = slot
+        if len(self.slots) > len(self.ids):
+            self._grow(max(len(self.ids) * 2, len(self.slots)))
+        self.ids[slots] = ids
+        if symbols is not None:
+            self.symbols.update(zip(ids.tolist(), symbols))
+        # Coins of single-coin rules may have just appeared (or changed symbol).
+        by_symbol = {symbol: coin_id for coin_id, symbol in self.symbols.items()}
+        for number, rule in enumerate(self.single):
+            coin_id = by_symbol.get(rule["coin"]) if isinstance(rule["coin"], str) else rule["coin"]
+            self.single_slot[number] = self.slots.get(coin_id, -1)
+        self._last_ids, self._last_slots = ids, slots
+        return slots
+
+    def _grow(self, capacity):
+        extra = capacity - len(self.ids)
+
+        def extend(array, fill):
+            shape = array.shape[:-1] + (extra,)
+            return np.concatenate([array, np.full(shape, fill, dtype=array.dtype)], axis=-1)
+
+        self.ids = extend(self.ids, 0)
+        self.current = extend(self.current, np.nan)
+        self.every_active = extend(self.every_active, False)
+        self.ring_values = extend(self.ring_values, np.nan)
+        self.ring_sum = extend(self.ring_sum, 0.0)
+        self.ring_count = extend(self.ring_count, 0)
+
+    def _advance(self, timestamp):
+        """Moves the ring to a new entry, growing it if the entry it would reuse is still needed."""
+        depth = len(self.ring_time)
+        oldest = (self.position + 1) % depth
+        following = (self.position + 2) % depth
+        # The oldest snapshot is still needed while it is the last one old enough for the
+        # longest window, i.e. while the snapshot after it is too new.
+        if self.ring_time[oldest] > -np.inf and self.ring_time[following] > timestamp - self.longest + SLACK:
+            order = (oldest + np.arange(depth)) % depth
+            self.ring_time = np.concatenate([self.ring_time[order], np.full(depth, -np.inf)])
+            for name, fill in (("ring_values", np.nan), ("ring_sum", 0.0), ("ring_count", 0)):
+                array = getattr(self, name)[order]
+                setattr(self, name, np.concatenate([array, np.full(array.shape, fill, dtype=array.dtype)]))
+            self.position = depth - 1
+            depth *= 2
+        previous = self.position
+        self.position = (self.position + 1) % depth
+        return previous
+
+    def _entries(self, seconds):
+        """For each window, the latest ring entry at least that old (-1 if there is none)."""
+        depth = len(self.ring_time)
+        order = (self.position + 1 + np.arange(depth)) % depth
+        times = self.ring_time[order]
+        found = np.searchsorted(times, self.ring_time[self.position] - seconds + SLACK, side="right") - 1
+        entries = np.where(found >= 0, order[np.maximum(found, 0)], -1)
+        entries[(found < 0) | (times[np.maximum(found, 0)] == -np.inf)] = -1
+        return entries
+
+    def _measures(self, count):
+        """Computes every distinct measure for the first 'count' slots: a (measures, count) array."""
+        fields, measures, seconds = self.keys["field"], self.keys["measure"], self.keys["seconds"]
+        result = np.full((len(fields), count), np.nan)
+        plain = measures == "value"
+        result[plain] = self.current[fields[plain], :count]
+        windowed = np.flatnonzero(~plain)
+        if not len(windowed):
+            return result
+        entries = self._entries(seconds[windowed])
+        known = entries >= 0
+        windowed, entries = windowed[known], entries[known]
+        field = fields[windowed]
+        now = self.current[field, :count]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = (now / self.ring_values[entries, field, :count] - 1.0) * 100.0
+            sums = self.ring_sum[self.position, field, :count] - self.ring_sum[entries, field, :count]
+            counts = self.ring_count[self.position, field, :count] - self.ring_count[entries, field, :count]
+            deviation = (now * counts / sums - 1.0) * 100.0
+        kind = measures[windowed][:, None]
+        result[windowed] = np.where(kind == "change", change,
+                                    np.where(kind == "abs_change", np.abs(change), deviation))
+        return result
+
+    def tick(self, timestamp, ids, values, symbols=None):
+        """
+        Adds one snapshot and checks the rules.
+
+        Args:
+            timestamp (float): When the snapshot was taken, in seconds since the epoch.
+            ids (np.ndarray): The coin ids in the snapshot, each at most once.
+            values (np.ndarray): (len(ids), len(FIELDS)) values, NaN where missing.
+            symbols (list, optional): The coins' symbols, for rules and events that use them.
+
+        Returns:
+            list: The events of the rules that fired (also handed to the sinks).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(ids), len(FIELDS))
+        slots = self._slots_for(ids, symbols)
+        count = len(self.slots)
+
+        # Coins missing from this snapshot have no values (and so match no rule).
+        self.current[:] = np.nan
+        self.current[:, slots] = values.T
+        previous = self._advance(timestamp)
+        position = self.position
+        self.ring_time[position] = timestamp
+        self.ring_values[position] = self.current
+        known = ~np.isnan(self.current)
+        if previous >= 0 and self.snapshots:
+            self.ring_sum[position] = self.ring_sum[previous] + np.where(known, self.current, 0.0)
+            self.ring_count[position] = self.ring_count[previous] + known
+        else:
+            self.ring_sum[position] = np.where(known, self.current, 0.0)
+            self.ring_count[position] = known
+
+        measures = self._measures(count)
+        with np.errstate(invalid="ignore"):
+            slot = self.single_slot
+            single = (slot >= 0) & (self.single_sign * (measures[self.single_group, np.maximum(slot, 0)]
+                                                       - self.single_level) > 0)
+            every = self.every_sign[:, None] * (measures[self.every_group] - self.every_level[:, None]) > 0
+
+        events = []
+        if self.snapshots:  # The first snapshot only sets the state: nothing "became" true yet.
+            moment = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+            numbers = np.flatnonzero(single & ~self.single_active)
+            events += self._events(moment, self.single, self.single_group[numbers], self.single_field[numbers],
+                                   numbers, slot[numbers], measures)
+            numbers, coins = np.nonzero(every & ~self.every_active[:, :count])
+            events += self._events(moment, self.every, self.every_group[numbers], self.every_field[numbers],
+                                   numbers, coins, measures)
+        self.single_active = single
+        self.every_active[:, :count] = every
+        self.snapshots += 1
+        for sink in self.sinks:
+            if events:
+                sink(events)
+        return events
+
+    def _events(self, moment, rules, groups, fields, numbers, slots, measures):
+        """Builds the events of rules[numbers] (with these measures and fields) firing for 'slots'."""
+        values = self.current[fields, slots].tolist()
+        measured = measures[groups, slots].tolist()
+        events = []
+        for number, coin_id, value, measure in zip(numbers.tolist(), self.ids[slots].tolist(), values, measured):
+            rule = rules[number]
+            events.append({
+                "time": moment,
+                "rule": rule["name"],
+                "kind": rule["kind"],
+                "id": coin_id,
+                "symbol": self.symbols.get(coin_id),
+                "field": rule["field"],
+                "value": value,
+                "measure": measure,
+                "level": rule["given_level"],
+            })
+        return events
+
+    def update(self, table):
+        """
+        Adds one snapshot from a store table (see store.py) and checks the rules.
+
+        Args:
+            table (pa.Table): The rows of one snapshot: 'timestamp', 'id', 'symbol' and FIELDS.
+
+        Returns:
+            list: The events of the rules that fired.
+        """
+        timestamp = table.column("timestamp")[0].as_py().timestamp()
+        ids = table.column("id").to_numpy(zero_copy_only=False)
+        values = np.column_stack([pc.cast(table.column(field), pa.float64()).to_numpy(zero_copy_only=False)
+                                  for field in FIELDS])
+        symbols = None
+        if self._last_ids is None or not np.array_equal(ids, self._last_ids):
+            symbols = table.column("symbol").to_pylist()
+        return self.tick(timestamp, ids, values, symbols)
+
+
+def random_rules(count, coins, every_share=0.1, seed=0):
+    """Makes a mix of rules on random coins (ids 1..coins), for benchmarks."""
+    rng = np.random.default_rng(seed)
+    rules = []
+    for number in range(count):
+        kind = str(rng.choice(list(KINDS)))
+        rule = {"name": f"rule {number}", "kind": kind}
+        if rng.random() >= every_share:
+            rule["coin"] = int(rng.integers(1, coins + 1))
+        if kind in ("above", "below"):
+            rule["field"] = "quote.USD.percent_change_1h"
+            rule["level"] = float(rng.normal(0, 2))
+        elif kind == "top":
+            rule["level"] = int(rng.choice([10, 50, 100, 500]))
+        else:
+            rule["level"] = float(rng.uniform(0.0, 2.0) if kind.startswith("cross") else rng.uniform(0.2, 2.0))
+            rule["seconds"] = float(rng.choice([300, 900, 3600]))
+        rules.append(rule)
+    return rules
+
+
+def benchmark(coins=5000, rules=1000, snapshots=240, interval=60.0, every_share=0.1, seed=0):
+    """
+    Feeds random minute snapshots to an AlertEngine with random rules and times every tick.
+
+    Returns:
+        dict: Mean, 99th percentile and max milliseconds per tick, the share of the interval
+            the slowest tick used, and events per tick.
+    """
+    rng = np.random.default_rng(seed)
+    engine = AlertEngine(random_rules(rules, coins, every_share, seed), capacity=coins)
+    ids = np.arange(1, coins + 1)
+    symbols = [f"C{coin_id}" for coin_id in ids]
+    prices = rng.lognormal(0, 3, coins)
+    supply = rng.lognormal(18, 2, coins)
+    changes = rng.normal(0, 2, (coins, 2))
+    start = time.time() - snapshots * interval
+    ticks = []
+    events = 0
+    for number in range(snapshots):
+        prices *= np.exp(rng.normal(0, 0.004, coins))
+        caps = prices * supply
+        ranks = np.empty(coins)
+        ranks[np.argsort(-caps)] = np.arange(1, coins + 1)
+        # The % changes drift rather than jump, like the real ones between two polls.
+        changes = changes * 0.98 + rng.normal(0, 0.3, (coins, 2))
+        values = np.column_stack([prices, caps, caps / 50, changes, ranks])
+        began = time.perf_counter()
+        events += len(engine.tick(start + number * interval, ids, values, symbols))
+        ticks.append(time.perf_counter() - began)
+    ticks = np.sort(ticks) * 1000
+    return {"tick_ms": ticks.mean(), "tick_p99_ms": ticks[int(0.99 * (len(ticks) - 1))],
+            "tick_max_ms": ticks[-1], "budget_used": ticks[-1] / 1000 / interval,
+            "events_per_tick": events / snapshots}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check alert rules against snapshots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="check the rules against the snapshots in a store")
+    replay_parser.add_argument("store", help="store folder (see store.py)")
+    replay_parser.add_argument("rules", help="JSON file with a list of rules")
+    replay_parser.add_argument("--output", help="append the events to this JSON lines file")
+    bench_parser = commands.add_parser("bench", help="time ticks with random rules on random data")
+    bench_parser.add_argument("--coins", type=int, default=5000)
+    bench_parser.add_argument("--rules", type=int, default=1000)
+    bench_parser.add_argument("--snapshots", type=int, default=240)
+    bench_parser.add_argument("--every-share", type=float, default=0.1, help="share of rules on all coins")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        for name, value in benchmark(args.coins, args.rules, args.snapshots, every_share=args.every_share).items():
+            print(f"{name}: {value:.4g}")
+    else:
+        from store import read_snapshots
+
+        sinks = [lambda events: print("\n".join(json.dumps(event) for event in events))]
+        if args.output:
+            sinks.append(JsonLinesSink(args.output))
+        engine = AlertEngine(load_rules(args.rules), sinks)
+        table = read_snapshots(args.store, columns=["id", *FIELDS])
+        times = pc.cast(table.column("timestamp"), pa.int64()).to_numpy()
+        bounds = np.flatnonzero(np.diff(times)) + 1
+        fired = 0
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+            fired += len(engine.update(table.slice(start, end - start)))
+        print(f"{engine.snapshots} snapshots, {fired} events")
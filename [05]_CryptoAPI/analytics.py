@@ -0,0 +1,414 @@
+# Running statistics per coin, updated as each snapshot arrives.
+#
+# The notebook answers "what is the average percent change of each coin?" with
+# 'df.groupby('name')[[...]].mean()' over the whole history, followed by stack/reset_index/
+# rename/replace, and does it again for every question. Here every coin has a slot in a few
+# numpy arrays that hold its running count, mean, variance (Welford's method), min, max and
+# exponentially weighted moving average. A new snapshot updates them with a handful of
+# vectorized operations, so the work per snapshot doesn't grow with the history, and a query
+# just reads the arrays.
+#
+# Time windows ("the last hour") keep the snapshots inside the window, in blocks with a summary
+# each (count, mean and squared differences by Welford's method, min and max), so a query only
+# merges a few block summaries plus the snapshots at the edge of the window. Sums kept up by
+# adding snapshots as they enter and subtracting them as they leave would be cheaper to query,
+# but lose the variance of a steady, high-priced coin to cancellation.
+
+import argparse
+import math
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The fields tracked by default.
+FIELDS = [
+    "quote.USD.price",
+    "quote.USD.percent_change_1h",
+    "quote.USD.percent_change_24h",
+    "quote.USD.percent_change_7d",
+    "quote.USD.percent_change_30d",
+    "quote.USD.percent_change_60d",
+    "quote.USD.percent_change_90d",
+]
+
+
+def _accumulate(count, mean, m2, slots, values, present):
+    """
+    Adds one value per slot and field (where 'present') to running counts, means and sums of
+    squared differences from the mean, with Welford's method: one pass, and numerically stable.
+    """
+    added = count[slots] + present
+    delta = np.where(present, values - mean[slots], 0.0)
+    updated = mean[slots] + np.divide(delta, added, out=np.zeros_like(delta), where=added > 0)
+    m2[slots] += np.where(present, delta * (values - updated), 0.0)
+    mean[slots] = updated
+    count[slots] = added
+
+
+class _Block:
+    """A run of consecutive snapshots in a window, with their count, mean, m2, min and max per slot."""
+
+    def __init__(self, capacity, fields):
+        self.entries = deque()  # (time, slots, values, present)
+        self.count = np.zeros((capacity, fields))  # Floats, as they are only used to weigh.
+        self.mean = np.zeros((capacity, fields))
+        self.m2 = np.zeros((capacity, fields))
+        self.minimum = np.full((capacity, fields), np.nan)
+        self.maximum = np.full((capacity, fields), np.nan)
+        self.added = 0  # Snapshots added so far.
+        self.expired = False  # Some of its snapshots have left the window.
+
+    def add(self, slots, values, present):
+        """Adds a snapshot's values to the summaries (not to 'entries')."""
+        _accumulate(self.count, self.mean, self.m2, slots, values, present)
+        self.minimum[slots] = np.fmin(self.minimum[slots], values)
+        self.maximum[slots] = np.fmax(self.maximum[slots], values)
+
+    def _grow(self, extra, fields):
+        self.count = np.vstack([self.count, np.zeros((extra, fields))])
+        self.mean = np.vstack([self.mean, np.zeros((extra, fields))])
+        self.m2 = np.vstack([self.m2, np.zeros((extra, fields))])
+        self.minimum = np.vstack([self.minimum, np.full((extra, fields), np.nan)])
+        self.maximum = np.vstack([self.maximum, np.full((extra, fields), np.nan)])
+
+
+class Window:
+    """
+    Aggregates over the snapshots of the last 'seconds' seconds.
+
+    The count per coin is updated incrementally. Mean, variance, min and max are kept per block
+    of snapshots; a query merges the block summaries and re-reads only the snapshots of blocks
+    that are partly out of the window. Blocks hold about sqrt(snapshots in the window) snapshots
+    each, which keeps both parts of a query small.
+    """
+
+    def __init__(self, seconds, capacity, fields):
+        self.seconds = seconds
+        self.fields = fields
+        self.size = 0  # Snapshots in the window.
+        self.block_size = 1
+        self.count = np.zeros((capacity, fields), dtype=np.int64)
+        self.blocks = deque()
+
+    def _grow(self, capacity):
+        extra = capacity - len(self.count)
+        self.count = np.vstack([self.count, np.zeros((extra, self.fields), dtype=np.int64)])
+        for block in self.blocks:
+            block._grow(extra, self.fields)
+
+    def add(self, timestamp, slots, values, present):
+        """Adds a snapshot and drops the snapshots that have left the window."""
+        self.count[slots] += present
+
+        if not self.blocks or self.blocks[-1].added >= self.block_size:
+            self.block_size = max(1, math.isqrt(self.size))
+            self.blocks.append(_Block(len(self.count), self.fields))
+        block = self.blocks[-1]
+        block.entries.append((timestamp, slots, values, present))
+        block.added += 1
+        self.size += 1
+        block.add(slots, values, present)
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """Drops the snapshots taken 'seconds' or more before 'now'."""
+        while self.blocks:
+            block = self.blocks[0]
+            while block.entries and block.entries[0][0] <= now - self.seconds:
+                _, slots, _, present = block.entries.popleft()
+                self.count[slots] -= present
+                self.size -= 1
+                block.expired = True
+            if block.entries or block is self.blocks[-1]:
+                break
+            self.blocks.popleft()
+
+    def aggregate(self):
+        """
+        Merges the blocks into statistics over the window.
+
+        Returns:
+            tuple: (count, mean, m2, min, max) arrays; mean, min and max are NaN for coins
+                without values.
+        """
+        shape = (len(self.count), self.fields)
+        blocks = []
+        for block in self.blocks:
+            if block.expired:
+                # Summarize what is left of it afresh.
+                partial = _Block(shape[0], self.fields)
+                for _, slots, values, present in block.entries:
+                    partial.add(slots, values, present)
+                block = partial
+            blocks.append(block)
+
+        # The mean, then the squared differences from it: each block's own, plus its count
+        # times the square of how far its mean is from the overall one.
+        weighted, spread = np.zeros(shape), np.empty(shape)
+        minimum, maximum = np.full(shape, np.nan), np.full(shape, np.nan)
+        for block in blocks:
+            np.multiply(block.count, block.mean, out=spread)
+            weighted += spread
+            np.fmin(minimum, block.minimum, out=minimum)
+            np.fmax(maximum, block.maximum, out=maximum)
+        mean = np.divide(weighted, self.count, out=np.zeros(shape), where=self.count > 0)
+        m2 = np.zeros(shape)
+        for block in blocks:
+            np.subtract(block.mean, mean, out=spread)
+            spread *= spread
+            spread *= block.count
+            m2 += spread
+            m2 += block.m2
+        mean[self.count == 0] = np.nan
+        return self.count.copy(), mean, m2, minimum, maximum
+
+
+class CoinStats:
+    """
+    Running statistics of some fields of every coin, one snapshot at a time.
+
+    For every coin and field it keeps the count, mean, variance, min, max and EWMA over all
+    snapshots seen, plus windowed count/mean/std/min/max for every window. Values that are
+    missing (NaN) are skipped, per field.
+    """
+
+    def __init__(self, fields=FIELDS, halflife=3600.0, windows=(3600.0, 86400.0), capacity=1024):
+        """
+        Args:
+            fields (list): The columns to track (store column names).
+            halflife (float): Seconds after which an old value weighs half as much in the EWMA.
+                The weight depends on the time between snapshots, not on their number, so
+                irregular polling doesn't skew it.
+            windows (tuple): Window lengths in seconds.
+            capacity (int): Coin slots to start with; grows as needed.
+        """
+        self.fields = list(fields)
+        self.halflife = halflife
+        self.slots = {}  # coin id -> slot
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.names = {}  # coin id -> (name, symbol)
+        width = len(self.fields)
+        self.count = np.zeros((capacity, width), dtype=np.int64)
+        self.mean = np.zeros((capacity, width))
+        self.m2 = np.zeros((capacity, width))  # Sum of squared differences from the mean.
+        self.minimum = np.full((capacity, width), np.nan)
+        self.maximum = np.full((capacity, width), np.nan)
+        self.ewma = np.full((capacity, width), np.nan)
+        self.last_value = np.full((capacity, width), np.nan)
+        self.last_time = np.full(capacity, np.nan)
+        self.windows = {seconds: Window(seconds, capacity, width) for seconds in windows}
+        self.snapshots = 0
+        self._last_ids = self._last_slots = None
+
+    def _slots_for(self, ids):
+        """Returns the slot of every coin id, giving new coins a slot."""
+        # Snapshots usually list the same coins in the same order as the one before.
+        if self._last_ids is not None and np.array_equal(ids, self._last_ids):
+            return self._last_slots
+        slots = np.empty(len(ids), dtype=np.int64)
+        for index, coin_id in enumerate(ids.tolist()):
+            slot = self.slots.get(coin_id)
+            if slot is None:
+                slot = self.slots[coin_id] = len(self.slots)
+            slots[index] = slot
+        if len(self.slots) > len(self.count):
+            self._grow(max(len(self.count) * 2, len(self.slots)))
+        self.ids[slots] = ids
+        # A copy: the caller may refill the same array with the next snapshot's ids.
+        self._last_ids, self._last_slots = ids.copy(), slots
+        return slots
+
+    def _grow(self, capacity):
+        extra = capacity - len(self.count)
+        width = len(self.fields)
+
+        def extend(array, fill):
+            shape = (extra,) + array.shape[1:]
+            return np.concatenate([array, np.full(shape, fill, dtype=array.dtype)])
+
+        self.ids = extend(self.ids, 0)
+        self.count = extend(self.count, 0)
+        self.mean = extend(self.mean, 0.0)
+        self.m2 = extend(self.m2, 0.0)
+        self.minimum = extend(self.minimum, np.nan)
+        self.maximum = extend(self.maximum, np.nan)
+        self.ewma = extend(self.ewma, np.nan)
+        self.last_value = extend(self.last_value, np.nan)
+        self.last_time = extend(self.last_time, np.nan)
+        for window in self.windows.values():
+            window._grow(capacity)
+
+    def update(self, timestamp, ids, values):
+        """
+        Adds one snapshot.
+
+        Args:
+            timestamp (float): When the snapshot was taken, in seconds since the epoch.
+            ids (np.ndarray): The coin ids in the snapshot, each at most once.
+            values (np.ndarray): (len(ids), len(fields)) values, NaN where missing.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(ids), len(self.fields))
+        slots = self._slots_for(ids)
+        present = ~np.isnan(values)
+
+        _accumulate(self.count, self.mean, self.m2, slots, values, present)
+        self.minimum[slots] = np.fmin(self.minimum[slots], values)
+        self.maximum[slots] = np.fmax(self.maximum[slots], values)
+
+        # EWMA with a weight that depends on the time since the coin's last snapshot.
+        elapsed = timestamp - self.last_time[slots]
+        alpha = np.where(np.isnan(elapsed), 1.0, -np.expm1(-np.log(2) * elapsed / self.halflife))[:, None]
+        previous = self.ewma[slots]
+        updated = np.where(np.isnan(previous), values, previous + alpha * (values - previous))
+        self.ewma[slots] = np.where(present, updated, previous)
+        self.last_value[slots] = np.where(present, values, self.last_value[slots])
+        self.last_time[slots] = timestamp
+
+        for window in self.windows.values():
+            window.add(timestamp, slots, values, present)
+        self.snapshots += 1
+
+    def update_table(self, table):
+        """
+        Adds the snapshots in a store table (see store.py), oldest first.
+
+        Args:
+            table (pa.Table): Rows with 'timestamp', 'id', the tracked fields, and optionally
+                'name' and 'symbol'.
+        """
+        table = table.sort_by([("timestamp", "ascending")])
+        times = table.column("timestamp")
+        # Rows of one snapshot share a timestamp; split the table where it changes.
+        seconds = pc.cast(times.cast(pa.timestamp("us", tz="UTC")), pa.int64()).to_numpy() / 1e6
+        ids = table.column("id").to_numpy()
+        values = np.column_stack([table.column(field).to_numpy(zero_copy_only=False).astype(np.float64)
+                                  for field in self.fields])
+        if "symbol" in table.column_names:
+            names = table.column("name").to_pylist() if "name" in table.column_names else [None] * table.num_rows
+            for coin_id, name, symbol in zip(ids.tolist(), names, table.column("symbol").to_pylist()):
+                self.names[coin_id] = (name, symbol)
+        bounds = np.flatnonzero(np.diff(seconds)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(seconds)]):
+            self.update(seconds[start], ids[start:end], values[start:end])
+
+    def _rows(self, ids):
+        if ids is None:
+            return np.arange(len(self.slots))
+        return np.array([self.slots[coin_id] for coin_id in ids], dtype=np.int64)
+
+    def _frame(self, rows, columns):
+        """Builds the result of a query: 'columns' holds (stat, array of the rows) pairs."""
+        frame = pd.DataFrame(
+            {f"{field}.{stat}": array[:, index] for stat, array in columns for index, field in enumerate(self.fields)},
+            index=pd.Index(self.ids[rows], name="id"),
+        )
+        if self.names:
+            frame.insert(0, "symbol", [self.names.get(coin_id, (None, None))[1] for coin_id in frame.index])
+            frame.insert(0, "name", [self.names.get(coin_id, (None, None))[0] for coin_id in frame.index])
+        return frame
+
+    def summary(self, ids=None):
+        """
+        Returns the all-time statistics of every coin (or of the given coin ids).
+
+        Returns:
+            pd.DataFrame: One row per coin, columns '<field>.<stat>' for the stats count, mean,
+                std (sample standard deviation), min, max, ewma and last.
+        """
+        rows = self._rows(ids)
+        count = self.count[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(self.m2[rows] / (count - 1))
+        std[count < 2] = np.nan
+        mean = np.where(count > 0, self.mean[rows], np.nan)
+        columns = [("count", count), ("mean", mean), ("std", std), ("min", self.minimum[rows]),
+                   ("max", self.maximum[rows]), ("ewma", self.ewma[rows]), ("last", self.last_value[rows])]
+        return self._frame(rows, columns)
+
+    def window(self, seconds, ids=None, now=None):
+        """
+        Returns the statistics over one of the windows.
+
+        Args:
+            seconds (float): The window, as given to the constructor.
+            ids (list, optional): Only these coin ids.
+            now (float, optional): Drop snapshots that are out of the window at this time
+                first. By default the window ends at the last snapshot.
+
+        Returns:
+            pd.DataFrame: One row per coin, columns '<field>.<stat>' for count, mean, std, min
+                and max over the window.
+        """
+        window = self.windows[seconds]
+        if now is not None:
+            window.expire(now)
+        rows = self._rows(ids)
+        count, mean, m2, minimum, maximum = (array[rows] for array in window.aggregate())
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(m2 / (count - 1))
+        std[count < 2] = np.nan
+        columns = [("count", count), ("mean", mean), ("std", std), ("min", minimum), ("max", maximum)]
+        return self._frame(rows, columns)
+
+
+def benchmark(coins=5000, snapshots=1440, interval=60.0, seed=0):
+    """
+    Feeds random minute snapshots to a CoinStats and times updates and queries.
+
+    Returns:
+        dict: Mean update time per snapshot and query times, in milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    stats = CoinStats(capacity=coins)
+    ids = np.arange(1, coins + 1)
+    prices = rng.lognormal(0, 3, coins)
+    start = time.time() - snapshots * interval
+    updates = []
+    for number in range(snapshots):
+        prices *= np.exp(rng.normal(0, 0.002, coins))
+        values = np.column_stack([prices, rng.normal(0, 2, (coins, len(FIELDS) - 1))])
+        began = time.perf_counter()
+        stats.update(start + number * interval, ids, values)
+        updates.append(time.perf_counter() - began)
+
+    timings = {"update_ms": 1000 * sum(updates) / len(updates), "update_max_ms": 1000 * max(updates)}
+    for name, query in [("summary_ms", lambda: stats.summary()),
+                        ("window_1h_ms", lambda: stats.window(3600.0)),
+                        ("window_24h_ms", lambda: stats.window(86400.0))]:
+        began = time.perf_counter()
+        query()
+        timings[name] = 1000 * (time.perf_counter() - began)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-coin running statistics over stored snapshots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="statistics of the snapshots in a store")
+    summary_parser.add_argument("store", help="store folder (see store.py)")
+    summary_parser.add_argument("--window", type=float, help="show this window (seconds) instead of all time")
+    summary_parser.add_argument("--symbols", nargs="*", help="only these coins")
+    bench_parser = commands.add_parser("bench", help="time updates and queries on random data")
+    bench_parser.add_argument("--coins", type=int, default=5000)
+    bench_parser.add_argument("--snapshots", type=int, default=1440)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        for name, value in benchmark(args.coins, args.snapshots).items():
+            print(f"{name}: {value:.2f}")
+    else:
+        from store import read_snapshots
+
+        pd.set_option("display.max_columns", None)
+        pd.set_option("display.width", 1000)
+        windows = (args.window,) if args.window else ()
+        stats = CoinStats(windows=windows)
+        stats.update_table(read_snapshots(args.store, symbols=args.symbols, columns=["name", "id", *FIELDS]))
+        frame = stats.window(args.window) if args.window else stats.summary()
+        print(frame[["name", "symbol"] + [column for column in frame.columns if column.endswith(".mean")]])
+        print(f"{stats.snapshots} snapshots, {len(stats.slots)} coins")
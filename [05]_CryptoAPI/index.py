@@ -0,0 +1,345 @@
+# An index over the Parquet store (see store.py) for fast point and range queries.
+#
+# 'df.query("name == 'Solana'")' looks at every row of the history to find one coin. This index
+# keeps, for every day of the store, the rows sorted two ways as plain numpy arrays on disk:
+#   - by (coin id, last_updated), with a directory of where each coin's rows start, so a
+#     coin's price series over a time range is two binary searches and a slice;
+#   - by (snapshot time, market cap, largest first), with the start of every snapshot, so the
+#     top N coins at a time t is one binary search and a slice.
+# The arrays are memory-mapped, so opening the index reads nothing up front and a query only
+# touches the pages it needs. Each day is indexed separately ("segments"), and only days whose
+# files changed are rebuilt.
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from store import SCHEMA, days, open_writer, partition_path, read_snapshots
+
+INDEX_FOLDER = "_index"
+# Value columns kept next to the keys: (store column, file name).
+VALUES = [("quote.USD.price", "price"), ("quote.USD.market_cap", "market_cap"), ("quote.USD.volume_24h", "volume_24h")]
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_micros(moment):
+    """Turns a datetime (naive ones are UTC) or np.datetime64 into microseconds since the epoch."""
+    if isinstance(moment, np.datetime64):
+        return int(moment.astype("datetime64[us]").astype(np.int64))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def _micros(column):
+    return pc.cast(column.cast(pa.timestamp("us", tz="UTC")), pa.int64()).to_numpy(zero_copy_only=False)
+
+
+def _floats(column):
+    return column.to_numpy(zero_copy_only=False).astype(np.float64)
+
+
+def build_segment(root, day):
+    """
+    Indexes one day of the store.
+
+    Args:
+        root (str): The store folder.
+        day (date): The day.
+
+    Returns:
+        dict: {symbol: id} of the coins in the day's last snapshot.
+    """
+    start = datetime.combine(day, datetime.min.time(), timezone.utc)
+    table = read_snapshots(root, start=start, end=start + timedelta(days=1),
+                           columns=["id", "last_updated", "cmc_rank"] + [column for column, _ in VALUES])
+    folder = os.path.join(root, INDEX_FOLDER, f"date={day.isoformat()}")
+    temporary = folder + ".tmp"
+    os.makedirs(temporary, exist_ok=True)
+    try:
+        _write_segment(table, temporary)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+    os.replace(temporary, folder)
+
+    if not table.num_rows:
+        return {}
+    last = table.filter(pc.equal(table.column("timestamp"), table.column("timestamp")[table.num_rows - 1]))
+    return dict(zip(last.column("symbol").to_pylist(), last.column("id").to_pylist()))
+
+
+def _write_segment(table, folder):
+    """Writes the arrays of one day's segment (see the top of this file) into 'folder'."""
+    ids = table.column("id").to_numpy(zero_copy_only=False).astype(np.int32)
+    snapshot_times = _micros(table.column("timestamp"))
+    # last_updated (ms) goes up to the snapshot times' microseconds, not the other way round:
+    # going down would lose the sub-millisecond part, which pyarrow refuses.
+    micro_type = table.column("timestamp").type
+    updated = _micros(table.column("last_updated").cast(micro_type).fill_null(table.column("timestamp")))
+    values = {name: _floats(table.column(column)) for column, name in VALUES}
+
+    # Rows by (id, last_updated). A quote that didn't change between two polls is the same
+    # point of the series; keep it once.
+    order = np.lexsort((updated, ids))
+    series_ids, series_times = ids[order], updated[order]
+    unique = np.ones(len(order), dtype=bool)
+    unique[1:] = (series_ids[1:] != series_ids[:-1]) | (series_times[1:] != series_times[:-1])
+    order, series_ids, series_times = order[unique], series_ids[unique], series_times[unique]
+    coin_ids, coin_starts = np.unique(series_ids, return_index=True)
+    arrays = {
+        "series_id": series_ids,
+        "series_time": series_times,
+        "coin_id": coin_ids,
+        "coin_start": np.append(coin_starts, len(series_ids)).astype(np.int64),
+    }
+    for name, column in values.items():
+        arrays[f"series_{name}"] = column[order]
+
+    # Rows by (snapshot time, market cap from largest). Coins without a market cap go last.
+    caps = values["market_cap"]
+    order = np.lexsort((-np.nan_to_num(caps, nan=-np.inf), snapshot_times))
+    times, snapshot_starts = np.unique(snapshot_times[order], return_index=True)
+    arrays["snapshot_time"] = times
+    arrays["snapshot_start"] = np.append(snapshot_starts, len(order)).astype(np.int64)
+    arrays["top_id"] = ids[order]
+    arrays["top_market_cap"] = caps[order]
+
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def _newest_change(folder):
+    """The latest modification time of the files in a folder."""
+    return max((entry.stat().st_mtime for entry in os.scandir(folder)), default=0.0)
+
+
+class HistoryIndex:
+    """
+    Memory-mapped point and range queries over a store. Call 'update' to (re)index new data.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.folder = os.path.join(root, INDEX_FOLDER)
+        self._segments = {}
+        self.symbols = {}
+        symbols_path = os.path.join(self.folder, "symbols.json")
+        if os.path.exists(symbols_path):
+            with open(symbols_path) as file:
+                self.symbols = json.load(file)
+        self.days = sorted(datetime.strptime(name, "date=%Y-%m-%d").date()
+                           for name in (os.listdir(self.folder) if os.path.isdir(self.folder) else [])
+                           if name.startswith("date=") and not name.endswith(".tmp"))
+
+    def update(self):
+        """
+        Indexes the days of the store that are new or changed since they were last indexed.
+
+        Returns:
+            list: The days that were (re)built.
+        """
+        built = []
+        for day in days(self.root):
+            segment = os.path.join(self.folder, f"date={day.isoformat()}")
+            data = partition_path(self.root, datetime.combine(day, datetime.min.time(), timezone.utc))
+            if os.path.isdir(segment) and _newest_change(segment) >= _newest_change(data):
+                continue
+            # Later days win, so a symbol maps to the coin that used it most recently.
+            self.symbols.update(build_segment(self.root, day))
+            self._segments.pop(day, None)
+            built.append(day)
+        if built:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(os.path.join(self.folder, "symbols.json"), "w") as file:
+                json.dump(self.symbols, file)
+            self.days = sorted(set(self.days) | set(built))
+        return built
+
+    def _segment(self, day):
+        segment = self._segments.get(day)
+        if segment is None:
+            folder = os.path.join(self.folder, f"date={day.isoformat()}")
+            segment = {name[:-len(".npy")]: np.load(os.path.join(folder, name), mmap_mode="r")
+                       for name in os.listdir(folder)}
+            self._segments[day] = segment
+        return segment
+
+    def coin_id(self, coin):
+        """Accepts a coin id or symbol and returns the id."""
+        if isinstance(coin, str):
+            if coin not in self.symbols:
+                raise KeyError(f"Unknown symbol: {coin}")
+            return self.symbols[coin]
+        return int(coin)
+
+    def series(self, coin, start, end, value="price"):
+        """
+        Returns the values of one coin with 'last_updated' in [start, end).
+
+        Args:
+            coin: The coin id or symbol.
+            start, end (datetime): The time range.
+            value (str): 'price', 'market_cap' or 'volume_24h'.
+
+        Returns:
+            tuple: (times as datetime64[us] UTC, values) numpy arrays, oldest first.
+        """
+        coin_id = self.coin_id(coin)
+        low, high = to_micros(start), to_micros(end)
+        first = datetime.fromtimestamp(low / 1e6, timezone.utc).date()
+        # A snapshot's quote can be a little older than the snapshot, so look one day further.
+        last = datetime.fromtimestamp(high / 1e6, timezone.utc).date() + timedelta(days=1)
+        times, values = [], []
+        for day in self.days:
+            if not first <= day <= last:
+                continue
+            segment = self._segment(day)
+            position = np.searchsorted(segment["coin_id"], coin_id)
+            if position == len(segment["coin_id"]) or segment["coin_id"][position] != coin_id:
+                continue
+            begin, finish = segment["coin_start"][position], segment["coin_start"][position + 1]
+            coin_times = segment["series_time"][begin:finish]
+            left = begin + np.searchsorted(coin_times, low)
+            right = begin + np.searchsorted(coin_times, high)
+            times.append(segment["series_time"][left:right])
+            values.append(segment[f"series_{value}"][left:right])
+        if not times:
+            return np.array([], dtype="datetime64[us]"), np.array([])
+        times, values = np.concatenate(times), np.concatenate(values)
+        # A quote from just before midnight can be in both days' snapshots.
+        unique = np.ones(len(times), dtype=bool)
+        unique[1:] = times[1:] != times[:-1]
+        return times[unique].astype("datetime64[us]"), values[unique]
+
+    def top(self, n, at):
+        """
+        Returns the n coins with the largest market cap in the last snapshot at or before 'at'.
+
+        Returns:
+            tuple: (snapshot time as datetime64[us] UTC, ids, market caps), or None if there
+                is no snapshot on that day before 'at'.
+        """
+        moment = to_micros(at)
+        day = datetime.fromtimestamp(moment / 1e6, timezone.utc).date()
+        for candidate in (day, day - timedelta(days=1)):
+            if candidate not in self.days:
+                continue
+            segment = self._segment(candidate)
+            position = np.searchsorted(segment["snapshot_time"], moment, side="right") - 1
+            if position < 0:
+                continue
+            begin = segment["snapshot_start"][position]
+            finish = min(begin + n, segment["snapshot_start"][position + 1])
+            return (np.datetime64(int(segment["snapshot_time"][position]), "us"),
+                    np.asarray(segment["top_id"][begin:finish]), np.asarray(segment["top_market_cap"][begin:finish]))
+        return None
+
+
+def _synthetic_store(root, coins, days, interval, seed=0):
+    """Fills a store with random snapshots (only the indexed columns are filled in)."""
+    rng = np.random.default_rng(seed)
+    ids = pa.array(np.arange(1, coins + 1, dtype=np.int32))
+    symbols = pa.array([f"C{number}" for number in range(1, coins + 1)]).dictionary_encode()
+    prices = rng.lognormal(0, 3, coins)
+    supply = rng.lognormal(18, 2, coins)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    per_day = int(86400 // interval)
+    nulls = {field.name: pa.nulls(coins, field.type) for field in SCHEMA}
+    for day in range(days):
+        with open_writer(root, start + timedelta(days=day), "synthetic.parquet") as writer:
+            for number in range(per_day):
+                # Microseconds, like the snapshot times ingest.py and migrate.py write.
+                moment = start + timedelta(days=day, seconds=number * interval,
+                                           microseconds=int(rng.integers(0, 1_000_000)))
+                prices = prices * np.exp(rng.normal(0, 0.002, coins))
+                stamp = pa.array([moment] * coins, SCHEMA.field("timestamp").type)
+                columns = dict(nulls, **{
+                    "timestamp": stamp, "id": ids, "symbol": symbols,
+                    "last_updated": pc.cast(stamp, SCHEMA.field("last_updated").type, safe=False),
+                    "quote.USD.price": pa.array(prices), "quote.USD.market_cap": pa.array(prices * supply),
+                    "quote.USD.volume_24h": pa.array(prices * supply / 50),
+                })
+                writer.write_table(pa.Table.from_pydict(columns, schema=SCHEMA))
+    return start
+
+
+def benchmark(root, coins=5000, days=2, interval=60.0, queries=1000):
+    """
+    Builds a synthetic store, times a full index rebuild, and times series and top-N queries.
+
+    Returns:
+        dict: Rows indexed, rebuild seconds, and microseconds per query.
+    """
+    start = _synthetic_store(root, coins, days, interval)
+    began = time.perf_counter()
+    index = HistoryIndex(root)
+    index.update()
+    rebuild = time.perf_counter() - began
+    rows = coins * days * int(86400 // interval)
+
+    rng = np.random.default_rng(1)
+    span = days * 86400
+    index = HistoryIndex(root)  # A fresh process would start like this: nothing in memory.
+    began = time.perf_counter()
+    for _ in range(queries):
+        first = start + timedelta(seconds=float(rng.uniform(0, span - 3600)))
+        index.series(f"C{rng.integers(1, coins + 1)}", first, first + timedelta(hours=1))
+    series = (time.perf_counter() - began) / queries
+    began = time.perf_counter()
+    for _ in range(queries):
+        index.top(10, start + timedelta(seconds=float(rng.uniform(0, span))))
+    top = (time.perf_counter() - began) / queries
+    return {"rows": rows, "rebuild_s": rebuild, "rows_per_second": rows / rebuild,
+            "series_1h_us": series * 1e6, "top10_us": top * 1e6}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index a store for fast series and top-N queries.")
+    parser.add_argument("store", help="store folder (see store.py)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("update", help="index new or changed days")
+    series_parser = commands.add_parser("series", help="print a coin's prices over a time range")
+    series_parser.add_argument("coin", help="symbol or id")
+    series_parser.add_argument("start", type=datetime.fromisoformat)
+    series_parser.add_argument("end", type=datetime.fromisoformat)
+    top_parser = commands.add_parser("top", help="print the largest coins at a time")
+    top_parser.add_argument("at", type=datetime.fromisoformat)
+    top_parser.add_argument("-n", type=int, default=10)
+    bench_parser = commands.add_parser("bench", help="rebuild and query a synthetic store in this (empty) folder")
+    bench_parser.add_argument("--coins", type=int, default=5000)
+    bench_parser.add_argument("--days", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        for name, value in benchmark(args.store, args.coins, args.days).items():
+            print(f"{name}: {value:,.2f}")
+    else:
+        index = HistoryIndex(args.store)
+        if args.command == "update":
+            print(f"Indexed {len(index.update())} days")
+        elif args.command == "series":
+            coin = int(args.coin) if args.coin.isdigit() else args.coin
+            for moment, price in zip(*index.series(coin, args.start, args.end)):
+                print(f"{moment}\t{price:,.6g}")
+        else:
+            result = index.top(args.n, args.at)
+            if result is None:
+                print("No snapshot at that time")
+            else:
+                moment, ids, caps = result
+                names = {coin_id: symbol for symbol, coin_id in index.symbols.items()}
+                print(f"Snapshot {moment}")
+                for rank, (coin_id, cap) in enumerate(zip(ids, caps), 1):
+                    print(f"{rank:3d}. {names.get(int(coin_id), coin_id)}\t{cap:,.0f}")
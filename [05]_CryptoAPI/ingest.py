@@ -0,0 +1,394 @@
+# An asynchronous ingester for the CoinMarketCap listings.
+#
+# main.py asks for all 5000 coins in one blocking request, with no timeout and no retry, and
+# the notebook's 'api_runner' opens a new Session for every call and then sleeps 60 seconds, so
+# every poll starts later than planned by however long the request took. This ingester:
+#   - fetches the listings as pages of 'page_size' coins, several at once, over one pool of
+#     kept-alive connections;
+#   - waits for a token bucket before every call, so it stays inside the plan's calls per
+#     minute and its credit budget (1 credit per 200 coins returned);
+#   - retries failed calls with exponential backoff, honouring the server's Retry-After;
+#   - polls on fixed deadlines (start, start + interval, ...), so the interval never drifts.
+# It can be pointed at mock_server.py instead of the real API.
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import pyarrow as pa
+from dotenv import load_dotenv
+
+from normalize import parse_response, with_timestamp
+from store import append_snapshot, snapshot_table
+
+API_URL = "https://pro-api.coinmarketcap.com"
+LISTINGS_PATH = "/v1/cryptocurrency/listings/latest"
+
+# The Basic (free) plan: 30 calls a minute and 10,000 credits a month, about 333 a day.
+CALLS_PER_MINUTE = 30
+CREDITS_PER_DAY = 333
+# The API charges 1 credit per this many coins returned.
+COINS_PER_CREDIT = 200
+# HTTP statuses that are worth trying again.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class IngestError(Exception):
+    """Raised when the API refuses a request for a reason retrying won't fix."""
+
+
+def parse_retry_after(value):
+    """
+    Reads a Retry-After header, which is either a number of seconds or an HTTP date.
+
+    Args:
+        value (str): The header, or None.
+
+    Returns:
+        float: Seconds to wait (0 for a date in the past), or None if the header is missing or
+            can't be read, so the computed backoff is used.
+    """
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            # HTTP dates are always GMT.
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    if not math.isfinite(seconds):
+        return None
+    return max(0.0, seconds)
+
+
+class TokenBucket:
+    """
+    Lets work through at a steady rate, with bursts of up to 'capacity'.
+
+    Tokens are added continuously at 'rate' per second. 'acquire' waits until enough are
+    there, in first-come first-served order, so one big request can't be starved by small ones.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): The most tokens the bucket holds. It starts full.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    async def acquire(self, tokens=1):
+        """
+        Waits until 'tokens' tokens are available and takes them.
+
+        Raises:
+            ValueError: If more tokens are asked for than the bucket can ever hold.
+        """
+        if tokens > self.capacity:
+            raise ValueError(f"Asked for {tokens} tokens, but the bucket holds at most {self.capacity}.")
+        async with self._lock:
+            while True:
+                now = self._refill()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def refund(self, tokens):
+        """Gives back tokens that were taken for work that didn't happen."""
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def pause(self, seconds):
+        """Stops handing out tokens for 'seconds', e.g. when the server says to back off."""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class ListingsClient:
+    """
+    Fetches the latest listings in parallel pages. Use it as an async context manager:
+
+        async with ListingsClient(api_key) as client:
+            snapshot = await client.fetch_listings(5000)
+    """
+
+    def __init__(self, api_key, base_url=API_URL, page_size=COINS_PER_CREDIT, concurrency=4,
+                 calls_per_minute=CALLS_PER_MINUTE, credits_per_day=CREDITS_PER_DAY,
+                 max_retries=5, timeout=30, columnar=False):
+        """
+        Args:
+            api_key (str): The CoinMarketCap API key.
+            base_url (str): The API server, e.g. the URL of a mock_server.py.
+            page_size (int): Coins per request. Multiples of 200 waste no credits.
+            concurrency (int): How many requests (and connections) may be open at once.
+            calls_per_minute (float): The plan's call rate limit.
+            credits_per_day (float): The credit budget. A day's worth can be spent in a burst.
+            max_retries (int): Attempts after the first one before giving up on a page.
+            timeout (float): Seconds before a request is abandoned (and retried).
+            columnar (bool): Parse responses straight into Arrow tables (see normalize.py)
+                instead of coin dicts.
+        """
+        self.api_key = api_key
+        self.url = base_url.rstrip("/") + LISTINGS_PATH
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.calls = TokenBucket(calls_per_minute / 60, max(1, calls_per_minute))
+        self.credits = TokenBucket(credits_per_day / 86400, credits_per_day)
+        self.max_retries = max_retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.columnar = columnar
+        self.session = None
+        self.retries = 0
+        self.credits_used = 0
+
+    async def __aenter__(self):
+        # One connector for all requests: connections are kept alive and reused between pages
+        # and between polls.
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=120)
+        headers = {"Accepts": "application/json", "X-CMC_PRO_API_KEY": self.api_key}
+        self.session = aiohttp.ClientSession(connector=connector, headers=headers, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def _backoff(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt: Retry-After if given, else 2^attempt with jitter."""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(60, 2 ** attempt))
+
+    async def fetch_page(self, start, limit):
+        """
+        Fetches one page of the listings, retrying on rate limits, server errors, timeouts and
+        malformed responses.
+
+        Args:
+            start (int): The rank of the first coin (1-based).
+            limit (int): How many coins to fetch.
+
+        Returns:
+            dict: The decoded JSON response ('status' and 'data'), or with 'columnar' set,
+                'status' and 'table' (the coins as a pa.Table, see 'normalize.parse_response').
+
+        Raises:
+            IngestError: If the API refuses the request, or it keeps failing.
+        """
+        params = {"start": str(start), "limit": str(limit), "convert": "USD"}
+        credits = math.ceil(limit / COINS_PER_CREDIT)
+        for attempt in range(self.max_retries + 1):
+            await self.credits.acquire(credits)
+            await self.calls.acquire()
+            retry_after = None
+            refund = True
+            try:
+                async with self.session.get(self.url, params=params) as response:
+                    if response.status == 200:
+                        try:
+                            if self.columnar:
+                                status, table = parse_response(await response.read())
+                                body = {"status": status, "table": table}
+                            else:
+                                body = await response.json()
+                            self.credits_used += body["status"].get("credit_count", credits)
+                            return body
+                        except (ValueError, KeyError, TypeError, AttributeError) as error:
+                            # A truncated or garbled body: try again, but the call was paid for.
+                            problem = f"Malformed response: {error}"
+                            refund = False
+                    elif response.status not in RETRY_STATUSES:
+                        try:
+                            message = (await response.json(content_type=None))["status"]["error_message"]
+                        except (ValueError, KeyError, TypeError):
+                            message = response.reason
+                        # Refused before any work was done: the reserved credits weren't spent.
+                        self.credits.refund(credits)
+                        raise IngestError(f"HTTP {response.status}: {message}")
+                    else:
+                        problem = f"HTTP {response.status}"
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        if retry_after is not None:
+                            # Every other request would hit the same limit: hold them all back.
+                            self.calls.pause(retry_after)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                problem = f"{type(error).__name__}: {error}"
+            if refund:
+                # A refused call costs no credits.
+                self.credits.refund(credits)
+            if attempt == self.max_retries:
+                break
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise IngestError(f"Giving up on coins {start}-{start + limit - 1} after "
+                          f"{self.max_retries + 1} attempts ({problem}).")
+
+    async def fetch_listings(self, total=5000):
+        """
+        Fetches the top 'total' coins as one snapshot, in parallel pages.
+
+        Returns:
+            dict: 'timestamp' (when the snapshot was taken, UTC), 'data' (the coins in rank
+                order, as the API returns them) and 'credits' (the credits it cost). With
+                'columnar' set, 'table' (a pa.Table with the store's columns) replaces 'data'.
+        """
+        timestamp = datetime.now(timezone.utc)
+        credits_before = self.credits_used
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def page(start):
+            async with semaphore:
+                return await self.fetch_page(start, min(self.page_size, total - start + 1))
+
+        pages = await asyncio.gather(*(page(start) for start in range(1, total + 1, self.page_size)))
+        credits = self.credits_used - credits_before
+        if self.columnar:
+            table = with_timestamp(pa.concat_tables(body["table"] for body in pages).unify_dictionaries(), timestamp)
+            return {"timestamp": timestamp, "table": table, "credits": credits}
+        data = [coin for body in pages for coin in body["data"]]
+        return {"timestamp": timestamp, "data": data, "credits": credits}
+
+
+async def poll(client, interval, handle, total=5000, count=None):
+    """
+    Fetches a snapshot every 'interval' seconds and hands it to 'handle'.
+
+    Polls are due at start, start + interval, start + 2 * interval, ... on the event loop's
+    monotonic clock, so the time a fetch takes doesn't push later polls back. If a fetch takes
+    longer than the interval, the polls it overran are skipped rather than run back to back.
+
+    Args:
+        client (ListingsClient): The client to fetch with.
+        interval (float): Seconds between polls.
+        handle (callable): Called with every snapshot (see 'fetch_listings').
+        total (int): Coins per snapshot.
+        count (int, optional): Stop after this many polls (skipped ones don't count). Runs
+            forever by default.
+
+    Returns:
+        int: The number of snapshots fetched.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline_number = polls = fetched = 0
+    while count is None or polls < count:
+        delay = start + deadline_number * interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        polls += 1
+        try:
+            handle(await client.fetch_listings(total))
+            fetched += 1
+        except IngestError as error:
+            print(f"Poll {polls} failed: {error}")
+        deadline_number = max(deadline_number + 1, math.ceil((loop.time() - start) / interval))
+    return fetched
+
+
+def _write_snapshot(file, snapshot):
+    """Appends a snapshot to a JSON lines file."""
+    record = {**snapshot, "timestamp": snapshot["timestamp"].isoformat()}
+    file.write(json.dumps(record, separators=(",", ":")) + "\n")
+    file.flush()
+
+
+async def _main(args):
+    runner = None
+    base_url = args.url
+    api_key = os.getenv("CMC_API_KEY")
+    if args.mock:
+        from mock_server import MockCoinMarketCap, start_server
+
+        mock = MockCoinMarketCap(max(args.total, 5000), args.mock_calls_per_minute, args.mock_failure_rate,
+                                 args.mock_latency)
+        runner, base_url = await start_server(mock)
+        api_key = "mock"
+    if not api_key:
+        raise SystemExit("Set CMC_API_KEY (or use --mock).")
+    if args.columnar and args.output:
+        raise SystemExit("--output writes the coin dicts, which --columnar doesn't make.")
+
+    output = open(args.output, "a") if args.output else None
+    alerts = None
+    if args.alerts:
+        from alerts import AlertEngine, JsonLinesSink, load_rules
+
+        sinks = [lambda events: print(f"  {len(events)} alerts: " + ", ".join(
+            f"{event['rule']} ({event['symbol']})" for event in events[:5]))]
+        if args.alerts_output:
+            sinks.append(JsonLinesSink(args.alerts_output))
+        alerts = AlertEngine(load_rules(args.alerts), sinks)
+    started = time.perf_counter()
+
+    def handle(snapshot):
+        elapsed = time.perf_counter() - started
+        coins = snapshot["table"].num_rows if "table" in snapshot else len(snapshot["data"])
+        print(f"[{elapsed:7.2f} s] {coins} coins, {snapshot['credits']} credits")
+        if output is not None:
+            _write_snapshot(output, snapshot)
+        if args.store:
+            append_snapshot(args.store, snapshot)
+        if alerts is not None:
+            alerts.update(snapshot["table"] if "table" in snapshot else snapshot_table(snapshot))
+
+    try:
+        async with ListingsClient(api_key, base_url, args.page_size, args.concurrency,
+                                  args.calls_per_minute, args.credits_per_day,
+                                  columnar=args.columnar) as client:
+            fetched = await poll(client, args.interval, handle, args.total, args.polls)
+            print(f"{fetched} snapshots, {client.credits_used} credits, {client.retries} retries")
+    finally:
+        if output is not None:
+            output.close()
+        if runner is not None:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Poll the CoinMarketCap listings.")
+    parser.add_argument("--url", default=API_URL, help="API server")
+    parser.add_argument("--total", type=int, default=5000, help="coins per snapshot")
+    parser.add_argument("--page-size", type=int, default=COINS_PER_CREDIT, help="coins per request")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--interval", type=float, default=60.0, help="seconds between polls")
+    parser.add_argument("--polls", type=int, help="stop after this many polls")
+    parser.add_argument("--calls-per-minute", type=float, default=CALLS_PER_MINUTE)
+    parser.add_argument("--credits-per-day", type=float, default=CREDITS_PER_DAY)
+    parser.add_argument("--output", help="append every snapshot to this JSON lines file")
+    parser.add_argument("--store", help="store every snapshot in this Parquet store folder (see store.py)")
+    parser.add_argument("--alerts", help="check the alert rules in this JSON file on every snapshot (see alerts.py)")
+    parser.add_argument("--alerts-output", help="append the alerts to this JSON lines file")
+    parser.add_argument("--columnar", action="store_true",
+                        help="parse responses straight into columns (see normalize.py)")
+    parser.add_argument("--mock", action="store_true", help="poll a local mock server instead")
+    parser.add_argument("--mock-calls-per-minute", type=int, help="rate limit of the mock server")
+    parser.add_argument("--mock-failure-rate", type=float, default=0.0, help="share of mock calls that fail")
+    parser.add_argument("--mock-latency", type=float, default=0.0, help="seconds the mock takes to answer")
+    asyncio.run(_main(parser.parse_args()))
@@ -1,21 +1,11 @@
 from dotenv import load_dotenv  # <-- load .env
+import argparse
 import json
 import os
 import pandas as pd
 from requests import Request, Session
 from requests.exceptions import ConnectionError, Timeout, TooManyRedirects
 
-# Load environment variables from .env file
-load_dotenv()
-API_KEY = os.getenv("CMC_API_KEY")
-
-# The following two lines are crucial for displaying the entire DataFrame in your terminal.
-# They override Pandas' default display settings which truncate wide DataFrames.
-pd.set_option('display.max_columns', None)
-pd.set_option('display.width', 1000)
-# You may also want to set max_rows if your data has many rows, to avoid truncation.
-pd.set_option('display.max_rows', None)
-
 # API URL & parameters
 url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest'
 parameters = {
@@ -24,23 +14,79 @@ parameters = {
     'convert': 'USD'
 }
 
-# Use API key from environment variable
-headers = {
-    'Accepts': 'application/json',
-    'X-CMC_PRO_API_KEY': API_KEY,
-}
 
-# Create session & fetch data
-session = Session()
-session.headers.update(headers)
+def get_listings(api_key, limit=None, convert=None):
+    """
+    Fetches the latest listings from CoinMarketCap.
+
+    Args:
+        api_key (str): The CoinMarketCap API key.
+        limit (int): How many coins to fetch; the 'parameters' default if None.
+        convert (str): The currency the quotes are in; the 'parameters' default if None.
+
+    Returns:
+        dict: The decoded JSON reply, or None if the request failed (the error is printed).
+    """
+    # Use API key from environment variable
+    headers = {
+        'Accepts': 'application/json',
+        'X-CMC_PRO_API_KEY': api_key,
+    }
+
+    # Create session & fetch data
+    session = Session()
+    session.headers.update(headers)
+
+    try:
+        params = dict(parameters)
+        if limit is not None:
+            params['limit'] = str(limit)
+        if convert is not None:
+            params['convert'] = convert
+        response = session.get(url, params=params)
+        return json.loads(response.text)
+    except (ConnectionError, Timeout, TooManyRedirects) as e:
+        print(e)
+        return None
+    finally:
+        session.close()
 
-try:
-    response = session.get(url, params=parameters)
-    data = json.loads(response.text)
+
+def main(argv=None):
+    """
+    Fetches the listings, prints the reply and returns it as a DataFrame.
+
+    Nothing runs when this module is imported: the options are parsed, the key is read and the
+    request sent here.
+    """
+    parser = argparse.ArgumentParser(
+        description="Fetch the latest CoinMarketCap listings and print them. "
+                    "The API key is read from CMC_API_KEY (or a .env file).")
+    parser.add_argument("--limit", type=int, default=int(parameters['limit']),
+                        help="how many coins to fetch (default: %(default)s)")
+    parser.add_argument("--convert", default=parameters['convert'],
+                        help="the currency of the quotes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    # Load environment variables from .env file
+    load_dotenv()
+    api_key = os.getenv("CMC_API_KEY")
+
+    # The following two lines are crucial for displaying the entire DataFrame in your terminal.
+    # They override Pandas' default display settings which truncate wide DataFrames.
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', 1000)
+    # You may also want to set max_rows if your data has many rows, to avoid truncation.
+    pd.set_option('display.max_rows', None)
+
+    data = get_listings(api_key, args.limit, args.convert)
+    if data is None:
+        return None
     print(data)
-except (ConnectionError, Timeout, TooManyRedirects) as e:
-    print(e)
+
+    # Convert JSON data into DataFrame
+    return pd.json_normalize(data['data'])
 
 
-# Convert JSON data into DataFrame
-pd.json_normalize(data['data'])
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# Imports legacy CSV exports like api.csv into the Parquet store (see store.py).
+#
+# api.csv holds flattened API records ('quote.USD.price', 'platform.id', ...) with the tag lists
+# saved as Python text ("['pow', 'layer-1']"), and because the notebook re-appended its whole
+# DataFrame on every poll, most rows are there several times. 'pd.read_csv' would load the
+# whole file as Python objects and guess every column's type.
+#
+# This importer streams the file in blocks with pyarrow's CSV reader and fixed column types, so
+# memory use doesn't grow with the file. It works in two passes:
+#   1. Every block is typed and appended to staging files for the day of its 'last_updated'.
+#      Copies of a row have the same 'last_updated', so they always end up in the same day.
+#   2. For each day, only the (id, last_updated) keys are read to find the first copy of every
+#      row; the rows are then streamed into the store, keeping just those copies.
+
+import argparse
+import ast
+import collections
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from store import COLUMNS, SCHEMA, open_writer
+
+# Bytes of CSV parsed per block. The reader keeps a few dozen blocks in flight, so this sets the
+# memory use: about 350 MB at 4 MB, whatever the size of the file.
+BLOCK_SIZE = 4 << 20
+
+# Staging files kept open at once. The CSV is in polling order, so 'last_updated' days mostly
+# come one after another; a day that comes back after its file was closed gets another file.
+MAX_OPEN_DAYS = 16
+
+# Tag lists whose repr is just quoted slugs can be split with string kernels; anything else
+# (quotes or backslashes inside a tag) goes through ast.literal_eval.
+_SIMPLE_TAGS = r"^\[('[^'\\]*'(, '[^'\\]*')*)?\]$"
+_TAGS_TYPE = SCHEMA.field("tags").type
+
+
+def _csv_types():
+    """The types the CSV columns are parsed as, before they are converted to the store's."""
+    types = {}
+    for name, kind in COLUMNS:
+        if name == "tags" or pa.types.is_dictionary(kind):
+            kind = pa.string()
+        elif pa.types.is_integer(kind):
+            # pandas writes integer columns that have gaps as floats ('1027.0').
+            kind = pa.float64()
+        elif name == "timestamp":
+            # pd.to_datetime('now') wrote UTC times without a time zone.
+            kind = pa.timestamp("us")
+        types[name] = kind
+    return types
+
+
+def parse_tags(tags):
+    """
+    Turns tag lists saved as Python text into a list<string> array.
+
+    The same coin has the same tags in every snapshot, so each distinct text is parsed only
+    once and the results are shared between the rows.
+
+    Args:
+        tags (pa.Array): Strings like "['pow', 'layer-1']", or nulls.
+
+    Returns:
+        pa.Array: The tag lists.
+    """
+    encoded = tags.dictionary_encode()
+    texts = encoded.dictionary
+    if pc.all(pc.match_substring_regex(texts, _SIMPLE_TAGS)).as_py() is not False:
+        inner = pc.replace_substring_regex(texts, r"^\['|'\]$", "")
+        # Splitting "" gives [""], but "[]" should be an empty list.
+        lists = pc.if_else(pc.equal(texts, "[]"), pa.scalar([], _TAGS_TYPE), pc.split_pattern(inner, "', '"))
+    else:
+        lists = pa.array([ast.literal_eval(text) for text in texts.to_pylist()], _TAGS_TYPE)
+    return lists.take(encoded.indices)
+
+
+def convert_batch(batch):
+    """
+    Converts a parsed CSV block to the store's schema.
+
+    Args:
+        batch (pa.RecordBatch): Columns parsed with '_csv_types'.
+
+    Returns:
+        pa.Table: The same rows with the SCHEMA columns.
+    """
+    arrays = []
+    for name, kind in COLUMNS:
+        column = batch.column(name)
+        if name == "tags":
+            column = parse_tags(column)
+        elif name == "timestamp":
+            # Casting a plain timestamp to a UTC one keeps its value, i.e. reads it as UTC.
+            column = column.cast(kind)
+        elif pa.types.is_dictionary(kind):
+            column = column.dictionary_encode()
+        elif column.type != kind:
+            column = column.cast(kind)
+        arrays.append(column)
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def _stage(path, directory, block_size):
+    """
+    First pass: splits the CSV into one staging file per 'last_updated' day.
+
+    Returns:
+        tuple: (rows read, {day: [staging file paths]}).
+    """
+    types = _csv_types()
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=block_size),
+        convert_options=pacsv.ConvertOptions(column_types=types, include_columns=list(types),
+                                             include_missing_columns=True, strings_can_be_null=True),
+    )
+    writers = collections.OrderedDict()
+    staged = {}
+    rows = 0
+    try:
+        for batch in reader:
+            table = convert_batch(batch)
+            rows += table.num_rows
+            days = pc.strftime(table.column("last_updated"), "%Y-%m-%d")
+            for day in pc.unique(days).to_pylist():
+                part = table.filter(pc.is_null(days) if day is None else pc.equal(days, day))
+                day = day or "unknown"
+                if day in writers:
+                    writers.move_to_end(day)
+                else:
+                    if len(writers) == MAX_OPEN_DAYS:
+                        writers.popitem(last=False)[1].close()
+                    paths = staged.setdefault(day, [])
+                    paths.append(os.path.join(directory, f"{day}-{len(paths)}.parquet"))
+                    writers[day] = pq.ParquetWriter(paths[-1], SCHEMA)
+                writers[day].write_table(part)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return rows, staged
+
+
+def first_copies(keys):
+    """
+    Finds the first copy of every row: rows with the same (id, last_updated) are the same quote.
+
+    Args:
+        keys (pa.Table): The 'id' and 'last_updated' columns.
+
+    Returns:
+        np.ndarray: True for the rows to keep.
+    """
+    numbered = keys.append_column("row", pa.array(np.arange(keys.num_rows)))
+    first = numbered.group_by(["id", "last_updated"], use_threads=False).aggregate([("row", "min")])
+    keep = np.zeros(keys.num_rows, dtype=bool)
+    keep[first.column("row_min").to_numpy()] = True
+    return keep
+
+
+def _source_tag(path):
+    """A short name for a source file, so that imports of different files never share a file."""
+    return hashlib.sha1(os.path.realpath(path).encode()).hexdigest()[:12]
+
+
+def _write_day(staging_paths, root, day, tag):
+    """
+    Second pass: deduplicates the staging files of one day and writes them to the store.
+
+    Only the key columns are read in full; the rows themselves are streamed through one row
+    group at a time. The store is split by the day of the snapshot time, which can differ from
+    the day of 'last_updated' around midnight, so a staging day can end up in two folders.
+
+    Returns:
+        tuple: (rows written, files written).
+    """
+    staged = [pq.ParquetFile(path) for path in staging_paths]
+    keep = first_copies(pa.concat_tables(part.read(columns=["id", "last_updated"]) for part in staged))
+    written = offset = 0
+    writers = {}
+    with contextlib.ExitStack() as stack:
+        for part in staged:
+            for number in range(part.num_row_groups):
+                group = part.read_row_group(number)
+                rows = group.num_rows
+                group = group.filter(pa.array(keep[offset:offset + rows]))
+                offset += rows
+                written += group.num_rows
+                snapshot_days = pc.cast(group.column("timestamp"), pa.date32())
+                for snapshot_day in pc.unique(snapshot_days).to_pylist():
+                    if snapshot_day not in writers:
+                        moment = datetime.combine(snapshot_day, datetime.min.time(), timezone.utc)
+                        name = f"migrated-{day}-{tag}.parquet"
+                        writers[snapshot_day] = stack.enter_context(open_writer(root, moment, name))
+                    writers[snapshot_day].write_table(group.filter(pc.equal(snapshot_days, snapshot_day)))
+    return written, len(writers)
+
+
+def migrate(path, root, block_size=BLOCK_SIZE):
+    """
+    Imports a legacy CSV file into a store.
+
+    Memory use depends on the block size (and on the number of rows of one day, 16 bytes per
+    row for the deduplication keys), not on the size of the file. Rows are written to files
+    named after their 'last_updated' day and the source file ('migrated-<day>-<source>.parquet'),
+    so importing the same file again replaces what its last import wrote, while other files
+    covering the same days are kept.
+
+    Args:
+        path (str): The CSV file, with the columns of api.csv.
+        root (str): The store folder.
+        block_size (int): Bytes of CSV parsed at a time.
+
+    Returns:
+        dict: Rows read and written, duplicates dropped, files written, seconds and rows/second.
+    """
+    started = time.perf_counter()
+    written = files = 0
+    tag = _source_tag(path)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(root))) as directory:
+        rows, staged = _stage(path, directory, block_size)
+        for day, staging_paths in sorted(staged.items()):
+            day_written, day_files = _write_day(staging_paths, root, day, tag)
+            written += day_written
+            files += day_files
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "written": written,
+        "duplicates": rows - written,
+        "files": files,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a legacy listings CSV into the Parquet store.")
+    parser.add_argument("csv", help="CSV file with the columns of api.csv")
+    parser.add_argument("store", help="store folder")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="bytes of CSV parsed at a time")
+    args = parser.parse_args()
+
+    report = migrate(args.csv, args.store, args.block_size)
+    print(f"Read {report['rows']:,} rows in {report['seconds']:.2f} s ({report['rows_per_second']:,.0f} rows/s)")
+    print(f"Wrote {report['written']:,} rows to {report['files']} files, dropped {report['duplicates']:,} duplicates")
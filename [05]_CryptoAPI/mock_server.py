@@ -0,0 +1,220 @@
+# A local stand-in for the CoinMarketCap listings API.
+#
+# It serves '/v1/cryptocurrency/listings/latest' with the same JSON layout as the real API,
+# built from the coins recorded in api.csv (repeated under new ids to reach any number of
+# coins). Prices move a little on every request. It can also act like a busy server: limit
+# the calls per minute (answering 429 with a Retry-After header) and fail some requests, so
+# the ingester's rate limiting and retries can be tried out without an API key or credits.
+
+import argparse
+import ast
+import asyncio
+import csv
+import math
+import os
+import random
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.csv")
+LISTINGS_PATH = "/v1/cryptocurrency/listings/latest"
+
+# The columns of api.csv that hold whole numbers and true/false values. Every other column
+# except the text ones holds a float.
+INTEGER_COLUMNS = {"id", "num_market_pairs", "cmc_rank", "platform.id"}
+BOOLEAN_COLUMNS = {"infinite_supply"}
+TEXT_COLUMNS = {"name", "symbol", "slug", "date_added", "last_updated", "quote.USD.last_updated",
+                "platform.name", "platform.symbol", "platform.slug", "platform.token_address"}
+
+
+def _parse_value(column, value):
+    """Turns one api.csv cell back into the JSON value the API sent."""
+    if value == "":
+        return None
+    if column == "tags":
+        # The notebook saved the tag lists with their Python repr, e.g. "['pow', 'layer-1']".
+        return ast.literal_eval(value)
+    if column in TEXT_COLUMNS:
+        return value
+    if column in INTEGER_COLUMNS:
+        return int(float(value))
+    if column in BOOLEAN_COLUMNS:
+        return value == "True"
+    return float(value)
+
+
+def load_fixture(path=FIXTURE, count=None):
+    """
+    Rebuilds API coin records from the flattened rows of api.csv.
+
+    Args:
+        path (str): The CSV file written by the notebook.
+        count (int, optional): How many coins to return. The recorded coins are repeated
+            under new ids, names and ranks until there are this many.
+
+    Returns:
+        list: Coin dicts, nested like the API's 'data' list ('quote' -> 'USD' -> ...).
+    """
+    coins = {}
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file):
+            coin = {}
+            for column, value in row.items():
+                if column in ("", "timestamp"):
+                    continue
+                # 'quote.USD.price' -> coin['quote']['USD']['price']
+                *parents, key = column.split(".")
+                target = coin
+                for parent in parents:
+                    if target.get(parent) is None:
+                        target[parent] = {}
+                    target = target[parent]
+                target[key] = _parse_value(column, value)
+            if all(value is None for value in coin["platform"].values()):
+                coin["platform"] = None
+            # The file holds the same coins many times over; keep the last snapshot of each.
+            coins[coin["id"]] = coin
+    coins = sorted(coins.values(), key=lambda coin: coin["cmc_rank"])
+
+    if count is None:
+        return coins
+    fixture = []
+    for rank in range(1, count + 1):
+        base = coins[(rank - 1) % len(coins)]
+        copy = (rank - 1) // len(coins)
+        coin = {**base, "quote": {"USD": dict(base["quote"]["USD"])}, "cmc_rank": rank}
+        if copy:
+            coin["id"] = 1000000 + rank
+            coin["name"] = f"{base['name']} {copy}"
+            coin["symbol"] = f"{base['symbol']}{copy}"
+            coin["slug"] = f"{base['slug']}-{copy}"
+        fixture.append(coin)
+    return fixture
+
+
+class MockCoinMarketCap:
+    """
+    The mock API: a list of coins plus the rules for rate limits and failures.
+    """
+
+    def __init__(self, coins=5000, calls_per_minute=None, failure_rate=0.0, latency=0.0, seed=None):
+        """
+        Args:
+            coins (int): How many coins the listings hold.
+            calls_per_minute (int, optional): Answer 429 to calls over this limit.
+            failure_rate (float): The share of calls that fail with a 500 error.
+            latency (float): Seconds to wait before answering, like a far-away server.
+            seed (int, optional): Seed for the price moves and failures.
+        """
+        self.coins = load_fixture(count=coins)
+        self.calls_per_minute = calls_per_minute
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.calls = []  # Times of the calls in the last minute.
+        self.requests = 0
+        self.credits = 0
+
+    def _move_prices(self, now):
+        """Moves every price by a small random step, as between two real snapshots."""
+        stamp = now.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        for coin in self.coins:
+            quote = coin["quote"]["USD"]
+            step = math.exp(self.random.gauss(0, 0.002))
+            quote["price"] *= step
+            if quote["market_cap"] is not None:
+                quote["market_cap"] *= step
+            quote["last_updated"] = coin["last_updated"] = stamp
+
+    async def listings(self, request):
+        """Handles GET /v1/cryptocurrency/listings/latest."""
+        self.requests += 1
+        if not request.headers.get("X-CMC_PRO_API_KEY"):
+            return _error(401, 1002, "API key missing.")
+
+        loop_time = asyncio.get_running_loop().time()
+        if self.calls_per_minute is not None:
+            self.calls = [time for time in self.calls if time > loop_time - 60]
+            if len(self.calls) >= self.calls_per_minute:
+                retry_after = math.ceil(self.calls[0] + 60 - loop_time)
+                return _error(429, 1008, "You've exceeded your API Key's HTTP request rate limit.",
+                              {"Retry-After": str(retry_after)})
+            self.calls.append(loop_time)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            return _error(500, 500, "An internal server error occurred.")
+
+        try:
+            start = int(request.query.get("start", 1))
+            limit = int(request.query.get("limit", 100))
+        except ValueError:
+            return _error(400, 400, "Invalid value for start or limit.")
+        if start < 1 or not 1 <= limit <= 5000:
+            return _error(400, 400, "Invalid value for start or limit.")
+
+        now = datetime.now(timezone.utc)
+        if start == 1:
+            # A new snapshot starts with the first page.
+            self._move_prices(now)
+        data = self.coins[start - 1:start - 1 + limit]
+        # Like the real API: one credit per 200 coins returned, rounded up.
+        credits = max(1, math.ceil(len(data) / 200))
+        self.credits += credits
+        status = {
+            "timestamp": now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "error_code": 0,
+            "error_message": None,
+            "elapsed": 1,
+            "credit_count": credits,
+            "notice": None,
+            "total_count": len(self.coins),
+        }
+        return web.json_response({"status": status, "data": data})
+
+
+def _error(http_status, code, message, headers=None):
+    status = {"error_code": code, "error_message": message, "credit_count": 0}
+    return web.json_response({"status": status}, status=http_status, headers=headers)
+
+
+def create_app(mock):
+    """Builds the aiohttp application that serves a MockCoinMarketCap."""
+    app = web.Application()
+    app.router.add_get(LISTINGS_PATH, mock.listings)
+    return app
+
+
+async def start_server(mock, host="127.0.0.1", port=0):
+    """
+    Starts the mock server in the running event loop.
+
+    Args:
+        mock (MockCoinMarketCap): The mock API to serve.
+        port (int): The port to listen on; 0 picks a free one.
+
+    Returns:
+        tuple: (web.AppRunner to clean up with, base URL of the server).
+    """
+    runner = web.AppRunner(create_app(mock), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a mock CoinMarketCap listings API.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--coins", type=int, default=5000, help="number of coins listed")
+    parser.add_argument("--calls-per-minute", type=int, help="answer 429 over this rate")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls that fail")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every answer")
+    args = parser.parse_args()
+
+    mock = MockCoinMarketCap(args.coins, args.calls_per_minute, args.failure_rate, args.latency)
+    print(f"Serving {args.coins} coins at http://127.0.0.1:{args.port}{LISTINGS_PATH}")
+    web.run_app(create_app(mock), host="127.0.0.1", port=args.port, print=None)
@@ -0,0 +1,179 @@
+# Turns listings responses straight into typed columns.
+#
+# main.py handles a response in two passes: 'json.loads(response.text)' decodes the bytes to
+# text and builds a dict for every coin (and for its 'quote', 'USD' and 'platform'), then
+# 'pd.json_normalize' walks all those dicts again to build a 38-column DataFrame of Python
+# objects. Only then can the numbers be turned into real numeric columns.
+#
+# The layout of the response is known in advance, so this module hands the raw bytes to
+# pyarrow's JSON reader together with that layout (RESPONSE_SCHEMA). The reader parses the
+# bytes in C++ directly into typed Arrow arrays: no Python objects are made for the coins, and
+# the text isn't decoded first. The nested 'quote.USD.*' and 'platform.*' fields come out as
+# struct columns, which are split into the store's flat columns without copying any values.
+
+import argparse
+import io
+import json
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pajson
+
+from store import COLUMNS, SCHEMA
+
+
+def _nest(columns):
+    """Builds nested struct fields from dotted column names ('quote.USD.price' -> quote/USD/price)."""
+    tree = {}
+    for name, kind in columns:
+        *parents, key = name.split(".")
+        branch = tree
+        for parent in parents:
+            branch = branch.setdefault(parent, {})
+        # The reader can't build dictionary columns; those are encoded afterwards.
+        branch[key] = kind.value_type if pa.types.is_dictionary(kind) else kind
+
+    def fields(branch):
+        return [pa.field(key, pa.struct(fields(value)) if isinstance(value, dict) else value)
+                for key, value in branch.items()]
+
+    return fields(tree)
+
+
+# The coin records as the API sends them (the store's columns without the snapshot time).
+COIN_TYPE = pa.struct(_nest(COLUMNS[1:]))
+RESPONSE_SCHEMA = pa.schema([
+    ("status", pa.struct([("timestamp", pa.string()), ("error_code", pa.int32()),
+                          ("error_message", pa.string()), ("credit_count", pa.int32()),
+                          ("total_count", pa.int32())])),
+    ("data", pa.list_(COIN_TYPE)),
+])
+_PARSE_OPTIONS = pajson.ParseOptions(explicit_schema=RESPONSE_SCHEMA, unexpected_field_behavior="ignore")
+
+
+def _flatten(array, prefix=""):
+    """Yields (dotted name, array) for the leaves of a struct array."""
+    for number, field in enumerate(array.type):
+        child = array.field(number)
+        # A null parent (e.g. 'platform': null) makes all of its fields null.
+        if array.null_count:
+            child = pc.if_else(array.is_valid(), child, pa.nulls(len(child), child.type))
+        name = prefix + field.name
+        if pa.types.is_struct(field.type):
+            yield from _flatten(child, name + ".")
+        else:
+            yield name, child
+
+
+def parse_response(body):
+    """
+    Parses a listings response into its status and a table of its coins.
+
+    Args:
+        body (bytes): The response body, as read from the socket.
+
+    Returns:
+        tuple: (status dict, pa.Table of the coins with the SCHEMA columns except 'timestamp').
+
+    Raises:
+        ValueError: If the body isn't a listings response.
+    """
+    # The whole response is one JSON object, so it has to fit in one block.
+    options = pajson.ReadOptions(use_threads=False, block_size=max(len(body) + 1, 1 << 16))
+    try:
+        parsed = pajson.read_json(io.BytesIO(body), read_options=options, parse_options=_PARSE_OPTIONS)
+    except pa.ArrowInvalid as error:
+        raise ValueError(f"Not a listings response: {error}") from None
+    if parsed.num_rows != 1:
+        raise ValueError(f"Expected one JSON object, got {parsed.num_rows}.")
+    status = parsed.column("status")[0].as_py()
+    coins = parsed.column("data").combine_chunks()
+    columns = dict(_flatten(coins.flatten()))
+    arrays = []
+    for name, kind in COLUMNS[1:]:
+        column = columns[name]
+        arrays.append(column.dictionary_encode() if pa.types.is_dictionary(kind) else column)
+    return status, pa.Table.from_arrays(arrays, schema=pa.schema(COLUMNS[1:]))
+
+
+def with_timestamp(table, timestamp):
+    """Adds the snapshot time as the first column, giving a table with the SCHEMA columns."""
+    column = pa.array([timestamp] * table.num_rows, SCHEMA.field("timestamp").type)
+    return table.add_column(0, SCHEMA.field("timestamp"), column)
+
+
+def _dict_path(body):
+    """What main.py does with a response."""
+    import pandas as pd
+
+    data = json.loads(body.decode())
+    return pd.json_normalize(data["data"])
+
+
+def _arrow_path(body):
+    return parse_response(body)[1]
+
+
+def _measure(path, coins, repeats):
+    """Runs one way of parsing in this process and prints its timings and peak memory as JSON."""
+    from mock_server import load_fixture
+
+    body = json.dumps({"status": {"credit_count": 1}, "data": load_fixture(count=coins)}).encode()
+    parse = _dict_path if path == "dict" else _arrow_path
+    import pandas  # noqa: F401  Imported up front so its import isn't measured as parsing memory.
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = parse(body)
+        times.append(time.perf_counter() - started)
+        del result
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"bytes": len(body), "best_ms": min(times) * 1e3,
+                      "median_ms": sorted(times)[len(times) // 2] * 1e3, "peak_mb": (peak - before) / 1024}))
+
+
+def benchmark(coins=5000, repeats=20):
+    """
+    Compares json.loads + pd.json_normalize with parse_response on a fixture response.
+
+    Each way runs in its own process, so the peak memory of one doesn't hide the other's.
+
+    Returns:
+        dict: {'dict': results, 'arrow': results}; results hold the response size, the best
+            and median milliseconds per response and the peak extra memory in MB.
+    """
+    results = {}
+    for path in ("dict", "arrow"):
+        output = subprocess.run([sys.executable, __file__, "--measure", path, "--coins", str(coins),
+                                 "--repeats", str(repeats)], capture_output=True, text=True, check=True).stdout
+        results[path] = json.loads(output)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse listings responses into columns, or benchmark it.")
+    parser.add_argument("response", nargs="?", help="a saved listings response to parse")
+    parser.add_argument("--coins", type=int, default=5000, help="coins in the benchmark's response")
+    parser.add_argument("--repeats", type=int, default=20, help="responses parsed per benchmark")
+    parser.add_argument("--measure", choices=["dict", "arrow"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        _measure(args.measure, args.coins, args.repeats)
+    elif args.response:
+        with open(args.response, "rb") as file:
+            status, table = parse_response(file.read())
+        print(status)
+        print(with_timestamp(table, datetime.now(timezone.utc)).to_pandas().head())
+    else:
+        for path, result in benchmark(args.coins, args.repeats).items():
+            name = "json.loads + json_normalize" if path == "dict" else "parse_response"
+            print(f"{name:28} {result['best_ms']:7.1f} ms best, {result['median_ms']:7.1f} ms median, "
+                  f"{result['peak_mb']:6.1f} MB peak ({result['bytes'] / 1e6:.1f} MB response)")
@@ -0,0 +1,245 @@
+# A columnar time-series store for listings snapshots.
+#
+# The notebook's 'api_runner' kept every snapshot in one growing DataFrame ('pd.concat') and
+# appended the whole of it to api.csv on every poll, so each poll wrote more than the last and
+# earlier rows were written again and again. Tags were saved as the text of a Python list and
+# timestamps as plain strings.
+#
+# This store writes each snapshot once, as its own Parquet file, in one folder per day:
+#
+#     root/date=2025-08-17/snapshot-170326393686.parquet
+#
+# Every column has a proper type: tags are a list of strings, times are UTC timestamps, and the
+# repeated name/symbol/slug strings are dictionary-encoded. The reader only opens the folders
+# of the days asked for, and only the columns and rows (symbols, time range) asked for.
+
+import contextlib
+import os
+from datetime import date, datetime, time, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+_text = pa.dictionary(pa.int32(), pa.string())
+_utc = pa.timestamp("ms", tz="UTC")
+
+# (column name, type) in file order. The names are those of 'pd.json_normalize' on the API's
+# 'data' list (and so of api.csv), so code written against the notebook's DataFrames still works.
+COLUMNS = [
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("id", pa.int32()),
+    ("name", _text),
+    ("symbol", _text),
+    ("slug", _text),
+    ("num_market_pairs", pa.int32()),
+    ("date_added", _utc),
+    ("tags", pa.list_(pa.string())),
+    ("max_supply", pa.float64()),
+    ("circulating_supply", pa.float64()),
+    ("total_supply", pa.float64()),
+    ("infinite_supply", pa.bool_()),
+    ("cmc_rank", pa.int32()),
+    ("self_reported_circulating_supply", pa.float64()),
+    ("self_reported_market_cap", pa.float64()),
+    ("tvl_ratio", pa.float64()),
+    ("last_updated", _utc),
+    ("quote.USD.price", pa.float64()),
+    ("quote.USD.volume_24h", pa.float64()),
+    ("quote.USD.volume_change_24h", pa.float64()),
+    ("quote.USD.percent_change_1h", pa.float64()),
+    ("quote.USD.percent_change_24h", pa.float64()),
+    ("quote.USD.percent_change_7d", pa.float64()),
+    ("quote.USD.percent_change_30d", pa.float64()),
+    ("quote.USD.percent_change_60d", pa.float64()),
+    ("quote.USD.percent_change_90d", pa.float64()),
+    ("quote.USD.market_cap", pa.float64()),
+    ("quote.USD.market_cap_dominance", pa.float64()),
+    ("quote.USD.fully_diluted_market_cap", pa.float64()),
+    ("quote.USD.tvl", pa.float64()),
+    ("quote.USD.last_updated", _utc),
+    ("platform.id", pa.int32()),
+    ("platform.name", pa.string()),
+    ("platform.symbol", pa.string()),
+    ("platform.slug", pa.string()),
+    ("platform.token_address", pa.string()),
+]
+SCHEMA = pa.schema(COLUMNS)
+# The day folders, as a column the reader can filter on.
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+_DATASET_SCHEMA = SCHEMA.append(pa.field("date", pa.string()))
+
+
+def _value(coin, path):
+    """Follows a dotted column name into a coin dict; missing parts (e.g. no platform) are None."""
+    for key in path:
+        if coin is None:
+            return None
+        coin = coin.get(key)
+    return coin
+
+
+def snapshot_table(snapshot):
+    """
+    Turns a snapshot (see 'ingest.ListingsClient.fetch_listings') into a typed table.
+
+    Args:
+        snapshot (dict): 'timestamp' (an aware datetime) and 'data' (the API's coin dicts).
+
+    Returns:
+        pa.Table: One row per coin, with the SCHEMA columns.
+    """
+    coins = snapshot["data"]
+    arrays = [pa.array([snapshot["timestamp"]] * len(coins), SCHEMA.field("timestamp").type)]
+    for name, kind in COLUMNS[1:]:
+        values = [_value(coin, name.split(".")) for coin in coins]
+        if pa.types.is_timestamp(kind):
+            # The API sends times as ISO 8601 text ('2025-08-17T15:01:00.000Z').
+            arrays.append(pa.array(values, pa.string()).cast(kind))
+        elif pa.types.is_dictionary(kind):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, kind))
+    return pa.Table.from_arrays(arrays, schema=SCHEMA)
+
+
+def partition_path(root, timestamp):
+    """Returns the folder of the day 'timestamp' (UTC) falls on."""
+    return os.path.join(root, f"date={timestamp.astimezone(timezone.utc).date().isoformat()}")
+
+
+def file_path(root, timestamp, name=None):
+    """Returns where a file for 'timestamp' goes: its day folder, named after the time by default."""
+    if name is None:
+        name = f"snapshot-{timestamp.astimezone(timezone.utc):%H%M%S%f}.parquet"
+    return os.path.join(partition_path(root, timestamp), name)
+
+
+@contextlib.contextmanager
+def open_writer(root, timestamp, name=None):
+    """
+    Opens a new file in the folder of the day 'timestamp' falls on, to write tables to.
+
+    The file is written under a temporary name and renamed when the writer is closed, so
+    readers never see half a file, even if the writer crashes.
+
+    Args:
+        root (str): The store folder.
+        timestamp (datetime): Picks the day folder, and names the file unless 'name' is given.
+        name (str, optional): The file name.
+
+    Yields:
+        pq.ParquetWriter: Takes tables with the SCHEMA columns (rows of that day only).
+    """
+    path = file_path(root, timestamp, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    writer = pq.ParquetWriter(temporary, SCHEMA, compression="zstd")
+    try:
+        yield writer
+    except BaseException:
+        writer.close()
+        os.remove(temporary)
+        raise
+    writer.close()
+    os.replace(temporary, path)
+
+
+def write_table(root, table, timestamp, name=None):
+    """
+    Writes a table of one day's rows as a new file in that day's folder. See 'open_writer'.
+
+    Returns:
+        str: The path of the new file.
+    """
+    with open_writer(root, timestamp, name) as writer:
+        writer.write_table(table)
+    return file_path(root, timestamp, name)
+
+
+def append_snapshot(root, snapshot):
+    """
+    Stores one snapshot. Only the new snapshot is written; nothing already stored is touched.
+
+    Args:
+        root (str): The store folder.
+        snapshot (dict): 'timestamp' and either 'data' (coin dicts) or 'table' (already in
+            the SCHEMA columns, see normalize.py).
+
+    Returns:
+        str: The path of the new file.
+    """
+    table = snapshot["table"] if "table" in snapshot else snapshot_table(snapshot)
+    return write_table(root, table, snapshot["timestamp"])
+
+
+def _as_utc(moment):
+    """Accepts a date (its midnight), a naive datetime (taken as UTC) or an aware datetime."""
+    if not isinstance(moment, datetime):
+        moment = datetime.combine(moment, time())
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def dataset(root):
+    """Opens the store as a pyarrow dataset, with the day folders as a 'date' column."""
+    return ds.dataset(root, schema=_DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING,
+                      ignore_prefixes=[".", "_"])
+
+
+def read_snapshots(root, symbols=None, start=None, end=None, columns=None):
+    """
+    Reads stored rows, scanning only what is asked for.
+
+    Day folders outside [start, end) are never opened, only the requested columns are read
+    from the files, and rows are filtered while they are read.
+
+    Args:
+        root (str): The store folder.
+        symbols (list, optional): Only these coins (e.g. ['BTC', 'SOL']).
+        start (datetime, optional): Only snapshots taken at or after this time.
+        end (datetime, optional): Only snapshots taken before this time.
+        columns (list, optional): Only these columns. 'timestamp' and 'symbol' are always read.
+
+    Returns:
+        pa.Table: The rows, sorted by time and then rank.
+    """
+    if not os.path.isdir(root):
+        return SCHEMA.empty_table() if columns is None else SCHEMA.empty_table().select(_with_keys(columns))
+    condition = None
+
+    def both(left, right):
+        return right if left is None else left & right
+
+    if start is not None:
+        start = _as_utc(start)
+        condition = both(condition, ds.field("date") >= start.date().isoformat())
+        condition = both(condition, ds.field("timestamp") >= pa.scalar(start, SCHEMA.field("timestamp").type))
+    if end is not None:
+        end = _as_utc(end)
+        # 'end' is exclusive, so a snapshot at exactly midnight does not need the next day.
+        last_day = (end - timedelta(microseconds=1)).date()
+        condition = both(condition, ds.field("date") <= last_day.isoformat())
+        condition = both(condition, ds.field("timestamp") < pa.scalar(end, SCHEMA.field("timestamp").type))
+    if symbols is not None:
+        condition = both(condition, ds.field("symbol").isin(list(symbols)))
+
+    table = dataset(root).to_table(columns=SCHEMA.names if columns is None else _with_keys(columns),
+                                   filter=condition)
+    sort_keys = [("timestamp", "ascending")]
+    if "cmc_rank" in table.column_names:
+        sort_keys.append(("cmc_rank", "ascending"))
+    return table.take(pc.sort_indices(table, sort_keys=sort_keys))
+
+
+def _with_keys(columns):
+    return list(dict.fromkeys(["timestamp", "symbol", *columns]))
+
+
+def days(root):
+    """Returns the days that have snapshots, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(date.fromisoformat(entry[len("date="):]) for entry in os.listdir(root) if entry.startswith("date="))
@@ -0,0 +1,251 @@
+# A cache for the WeatherApp's lookups.
+#
+# Every lookup used to go to OpenWeatherMap, even for the city shown a minute ago, and the free
+# plan only allows so many calls. OpenWeatherMap refreshes its readings about every 10 minutes,
+# so a reply can be reused for that long. This cache has two tiers:
+#   - memory: the most recently used replies (an OrderedDict used as an LRU list);
+#   - disk: every reply, in a SQLite file, so the cache survives restarts.
+# Lookups are keyed on the normalized query ("q:london", "id:2643743"), and every reply is also
+# stored under its city ID, so a later lookup by ID finds a reply fetched by name.
+#
+# When the API can't be reached, the last reply for the city is shown however old it is,
+# marked as stale. Hits and misses are counted (and added up on disk across runs) so you can
+# check how many API calls the cache saves.
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from worker import OfflineError
+
+# Seconds a reply is served without asking the API again.
+TTL = 600
+# Replies kept in memory.
+MEMORY_SIZE = 256
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather_cache.sqlite3")
+COUNTERS = ("memory_hits", "disk_hits", "misses", "stale_served", "api_calls")
+
+
+def cache_key(query):
+    """
+    Normalizes a query: " New  York " and "new york" are the same lookup.
+
+    Args:
+        query (dict): A WeatherClient query, e.g. {"q": "London"} or {"id": 2643743}.
+
+    Returns:
+        str: The key, e.g. "q:london" or "id:2643743".
+    """
+    return ";".join(f"{name}:{' '.join(str(value).split()).casefold()}" for name, value in sorted(query.items()))
+
+
+class WeatherCache:
+    """
+    A two-tier (memory LRU, then SQLite) cache of API replies with a time to live.
+
+    Safe to use from several threads: the fetches run on a thread pool.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=TTL, memory_size=MEMORY_SIZE, clock=time.time):
+        """
+        Args:
+            path (str): The SQLite file (":memory:" for no disk tier).
+            ttl (float): Seconds a reply stays fresh.
+            memory_size (int): Replies kept in memory.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.clock = clock
+        self.memory = OrderedDict()  # key -> (time stored, data), least recently used first
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS replies (key TEXT PRIMARY KEY, stored REAL, data TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, key):
+        """
+        Finds an entry in memory, or else on disk. Call with the lock held.
+
+        Returns:
+            tuple: ((time stored, data), name of the hit counter), or (None, None).
+        """
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            return entry, "memory_hits"
+        row = self.db.execute("SELECT stored, data FROM replies WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        entry = (row[0], json.loads(row[1]))
+        self._remember(key, entry)
+        return entry, "disk_hits"
+
+    def get(self, query):
+        """
+        Returns the fresh reply for a query, or None if there is none (a miss).
+        """
+        key = cache_key(query)
+        with self.lock:
+            entry, tier = self._lookup(key)
+            if entry is None or self.clock() - entry[0] >= self.ttl:
+                self.counters["misses"] += 1
+                return None
+            self.counters[tier] += 1
+            return entry[1]
+
+    def get_stale(self, query):
+        """
+        Returns the last reply for a query however old, marked with 'stale_since' (the time
+        it was fetched), or None if the city was never looked up.
+        """
+        with self.lock:
+            entry, _ = self._lookup(cache_key(query))
+            if entry is None:
+                return None
+            self.counters["stale_served"] += 1
+            return {**entry[1], "stale_since": entry[0]}
+
+    def put(self, query, data):
+        """Stores a reply under its query and under its city ID."""
+        entry = (self.clock(), data)
+        keys = {cache_key(query)}
+        if "id" in data:
+            keys.add(cache_key({"id": data["id"]}))
+        text = json.dumps(data)
+        with self.lock:
+            for key in keys:
+                self._remember(key, entry)
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO replies VALUES (?, ?, ?)",
+                                    [(key, entry[0], text) for key in keys])
+
+    def fetch(self, client, query):
+        """
+        Returns a fresh cached reply, or fetches one with 'client' and caches it. If the API
+        can't be reached, returns the last reply (see 'get_stale') instead.
+
+        Raises:
+            WeatherError: If the lookup failed and there is nothing to fall back on.
+        """
+        data = self.get(query)
+        if data is not None:
+            return data
+        with self.lock:
+            self.counters["api_calls"] += 1
+        try:
+            data = client.fetch(query)
+        except OfflineError:
+            stale = self.get_stale(query)
+            if stale is None:
+                raise
+            return stale
+        self.put(query, data)
+        return data
+
+    def fetch_group(self, client, ids):
+        """
+        Like 'fetch' for several city IDs, with one call (see WeatherClient.fetch_group) for
+        the ones that aren't cached or are out of date.
+
+        Returns:
+            dict: {city ID: reply} for the cities found (stale replies when offline).
+        """
+        replies = {}
+        missing = []
+        for city_id in ids:
+            data = self.get({"id": city_id})
+            if data is None:
+                missing.append(city_id)
+            else:
+                replies[city_id] = data
+        if not missing:
+            return replies
+        with self.lock:
+            self.counters["api_calls"] += 1
+        try:
+            fetched = client.fetch_group(missing)
+        except OfflineError:
+            stale = {city_id: self.get_stale({"id": city_id}) for city_id in missing}
+            if not any(stale.values()):
+                raise
+            replies.update((city_id, data) for city_id, data in stale.items() if data is not None)
+            return replies
+        for city_id, data in fetched.items():
+            self.put({"id": city_id}, data)
+            replies[city_id] = data
+        return replies
+
+    def stats(self):
+        """Returns this run's counters and the hit rate (share of lookups served from the cache)."""
+        with self.lock:
+            stats = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def totals(self):
+        """Returns the counters added up over all runs, this one included."""
+        with self.lock:
+            totals = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+            for name, value in self.counters.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def close(self):
+        """Adds this run's counters to the totals on disk and closes the file."""
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    list(self.counters.items()))
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.db.close()
+
+
+class CachedClient:
+    """A WeatherClient that goes through a WeatherCache; it can stand in for the client."""
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def fetch(self, query):
+        return self.cache.fetch(self.client, query)
+
+    def fetch_group(self, ids):
+        """Returns {city ID: reply}; see WeatherCache.fetch_group."""
+        return self.cache.fetch_group(self.client, ids)
+
+    def close(self):
+        self.cache.close()
+        self.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the WeatherApp cache's counters.")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="the cache file")
+    args = parser.parse_args()
+
+    cache = WeatherCache(args.path)
+    totals = cache.totals()
+    replies = cache.db.execute("SELECT COUNT(*) FROM replies").fetchone()[0]
+    cache.close()
+    lookups = sum(totals.get(name, 0) for name in ("memory_hits", "disk_hits", "misses"))
+    print(f"{replies} replies cached")
+    for name in COUNTERS:
+        print(f"{name}: {totals.get(name, 0)}")
+    if lookups:
+        print(f"hit rate: {(totals.get('memory_hits', 0) + totals.get('disk_hits', 0)) / lookups:.1%}")
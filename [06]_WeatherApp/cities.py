@@ -0,0 +1,296 @@
+# A local index of city names, for instant autocomplete and lookups by city ID.
+#
+# The app used to put whatever was typed into '?q=' and only found out that a name was wrong
+# from the API's 404. This index holds OpenWeatherMap's city list (about 200,000 cities, from
+# https://bulk.openweathermap.org/sample/city.list.json.gz) as a few parallel lists sorted by
+# normalized name ("são paulo" -> "sao paulo"). So:
+#   - the cities starting with what was typed are one binary search away (bisect);
+#   - a typo is found by trying every string one edit away (a letter left out, added, changed
+#     or two swapped) that some name starts with, and looking each up;
+#   - a name resolves to a city ID before any request, so requests go out as '?id=' (which the
+#     cache can share between spellings) and unknown names never reach the API.
+#
+# Build the index once from the downloaded list:
+#     python cities.py build city.list.json.gz
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import time
+import unicodedata
+from array import array
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.tsv.gz")
+# Past every character in the keys, to find the end of the keys starting with a prefix.
+LAST_CHAR = chr(0x10FFFF)
+# Typo variants shorter than this aren't completed: "" or one letter would match whole swathes
+# of the index.
+MIN_TYPO_PREFIX = 2
+
+
+def normalize(text):
+    """Lowercases, drops accents and squeezes spaces: " São  Paulo" -> "sao paulo"."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def _split_country(text):
+    """
+    Splits "London, GB" into ("london", "GB"); the country code is optional. Any two letters
+    after the last comma are taken for one, so "Portland, ME" (a US state) comes back as
+    ("portland", "ME") too: see 'CityIndex.resolve'.
+    """
+    name, comma, country = text.rpartition(",")
+    country = country.strip()
+    if comma and len(country) == 2 and country.isalpha():
+        return normalize(name), country.upper()
+    return normalize(text), None
+
+
+class CityIndex:
+    """
+    Cities sorted by normalized name, in parallel lists: keys, names, states, countries, ids.
+    """
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows (list): (key, name, state, country, id) tuples, sorted by key.
+        """
+        self.keys = [row[0] for row in rows]
+        self.names = [row[1] for row in rows]
+        self.states = [row[2] for row in rows]
+        self.countries = [row[3] for row in rows]
+        self.ids = array("l", (row[4] for row in rows))
+        # key -> position of its first city, for exact lookups without a binary search.
+        self.first = {}
+        for position, key in enumerate(self.keys):
+            self.first.setdefault(key, position)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        """Loads an index written by 'build'."""
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            rows = [line.rstrip("\n").split("\t") for line in file]
+        return cls([(key, name, state, country, int(city_id)) for key, name, state, country, city_id in rows])
+
+    def label(self, position):
+        """The text shown for a city: "London, GB", or "Portland, OR, US" where there is a state."""
+        parts = [self.names[position], self.states[position], self.countries[position]]
+        return ", ".join(part for part in parts if part)
+
+    def _prefixed(self, prefix, country, limit, labels):
+        """
+        Adds the labels of the cities whose key starts with 'prefix' to 'labels' ({label: id}),
+        until it holds 'limit' of them.
+        """
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix) and len(labels) < limit:
+            if country is None or self.countries[position] == country:
+                labels.setdefault(self.label(position), self.ids[position])
+            position += 1
+
+    def _in_state(self, key, state, country):
+        """Positions of the cities called exactly 'key' in a state ("or", or "OR")."""
+        state = normalize(state)
+        return [position for position in self._exact(key, country) if normalize(self.states[position]) == state]
+
+    def _exact(self, key, country):
+        """Positions of the cities called exactly 'key'."""
+        position = self.first.get(key)
+        found = []
+        while position is not None and position < len(self.keys) and self.keys[position] == key:
+            if country is None or self.countries[position] == country:
+                found.append(position)
+            position += 1
+        return found
+
+    def _next_chars(self, prefix, low, high):
+        """
+        The characters that follow 'prefix' in the keys between 'low' and 'high' (the keys
+        starting with it), one binary search per character found.
+        """
+        found = []
+        length = len(prefix)
+        low = bisect.bisect_right(self.keys, prefix, low, high)  # Past the keys that are just the prefix.
+        while low < high:
+            char = self.keys[low][length]
+            found.append(char)
+            low = bisect.bisect_left(self.keys, prefix + char + LAST_CHAR, low, high)
+        return found
+
+    def edits(self, word):
+        """
+        The strings one edit (a letter left out, swapped with the next, changed or added) away
+        from 'word' that can start a key.
+
+        Only positions up to where 'word' stops matching any key are edited, and only with
+        letters that some key has there, so a long word costs a few dozen binary searches
+        rather than one for every letter of the alphabet at every position.
+        """
+        variants = set()
+        low, high = 0, len(self.keys)
+        for index in range(len(word) + 1):
+            left, right = word[:index], word[index:]
+            low = bisect.bisect_left(self.keys, left, low, high)
+            high = bisect.bisect_left(self.keys, left + LAST_CHAR, low, high)
+            if low == high:
+                break  # Nothing starts with 'left': the typo is before here.
+            if right:
+                variants.add(left + right[1:])
+            if len(right) > 1:
+                variants.add(left + right[1] + right[0] + right[2:])
+            for char in self._next_chars(left, low, high):
+                variants.add(left + char + right)
+                if right:
+                    variants.add(left + char + right[1:])
+        variants.discard(word)
+        return variants
+
+    def complete(self, text, limit=10):
+        """
+        Suggests cities for what has been typed so far.
+
+        Cities called exactly that come first, then the others whose name starts with the
+        text, in alphabetical order. If there are fewer than 'limit' of those, names one typo
+        away are added.
+
+        Args:
+            text (str): The typed text, optionally followed by ", <country code>".
+            limit (int): The most suggestions to return.
+
+        Returns:
+            list: (label, city ID) pairs, e.g. [("London, GB", 2643743), ...].
+        """
+        key, country = _split_country(text)
+        if not key:
+            return []
+        labels = {}
+        self._prefixed(key, country, limit, labels)
+        if len(labels) < limit:
+            for variant in sorted(self.edits(key)):
+                if len(variant) < MIN_TYPO_PREFIX:
+                    continue
+                self._prefixed(variant, country, limit, labels)
+                if len(labels) >= limit:
+                    break
+        return list(labels.items())
+
+    def resolve(self, text):
+        """
+        Finds the city a finished entry means.
+
+        Args:
+            text (str): A city name, optionally followed by a state and/or ", <country code>",
+                or a label from 'complete'.
+
+        Returns:
+            tuple: (city ID or None, suggestions). The ID is that of the first city with
+                exactly that name; without one, the suggestions are the cities one typo away.
+        """
+        key, country = _split_country(text)
+        if not key:
+            return None, []
+        positions = self._exact(key, country)
+        if not positions and country is not None:
+            # The two letters may be a state and not a country: "Portland, ME".
+            positions = self._in_state(key, country, None)
+        if not positions and "," in key:
+            # A label with a state: "Portland, OR, US".
+            name, _, state = key.rpartition(",")
+            positions = self._in_state(name.strip(), state, country)
+        if positions:
+            return self.ids[positions[0]], []
+        typos = {}
+        for variant in self.edits(key):
+            for position in self._exact(variant, country):
+                typos.setdefault(self.label(position), self.ids[position])
+        return None, sorted(typos.items())[:5]
+
+
+def build(source, path=DEFAULT_PATH):
+    """
+    Builds the index file from OpenWeatherMap's city list.
+
+    Args:
+        source (str): city.list.json (optionally gzipped): [{"id", "name", "state", "country", ...}].
+        path (str): Where to write the index (a gzipped, sorted TSV).
+
+    Returns:
+        int: The number of cities.
+    """
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, "rt", encoding="utf-8") as file:
+        cities = json.load(file)
+    rows = []
+    for city in cities:
+        name = " ".join(city["name"].split())
+        key = normalize(name)
+        if key:
+            rows.append((key, name, city.get("state") or "", city.get("country") or "", int(city["id"])))
+    rows.sort()
+    temporary = path + ".tmp"
+    with gzip.open(temporary, "wt", encoding="utf-8") as file:
+        for row in rows:
+            # Tabs and newlines can't appear in the fields.
+            file.write("\t".join(" ".join(str(field).split()) for field in row) + "\n")
+    os.replace(temporary, path)
+    return len(rows)
+
+
+def benchmark(index, queries=1000, seed=0):
+    """
+    Times autocomplete on random prefixes and on prefixes with a typo.
+
+    Returns:
+        dict: Microseconds per call, for clean prefixes, typos and 'resolve'.
+    """
+    import random
+
+    rng = random.Random(seed)
+    names = [index.keys[rng.randrange(len(index))] for _ in range(queries)]
+    prefixes = [name[:rng.randint(1, len(name))] for name in names]
+    typos = []
+    for name in names:
+        position = rng.randrange(len(name))
+        typos.append(name[:position] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[position + 1:])
+    timings = {}
+    for label, function, texts in [("complete_us", index.complete, prefixes),
+                                   ("complete_typo_us", index.complete, typos),
+                                   ("resolve_us", index.resolve, names),
+                                   ("resolve_typo_us", index.resolve, typos)]:
+        started = time.perf_counter()
+        for text in texts:
+            function(text)
+        timings[label] = (time.perf_counter() - started) / len(texts) * 1e6
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local city index.")
+    parser.add_argument("--index", default=DEFAULT_PATH, help="the index file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build the index from OpenWeatherMap's city list")
+    build_parser.add_argument("source", help="city.list.json(.gz)")
+    search_parser = commands.add_parser("search", help="show suggestions for some text")
+    search_parser.add_argument("text")
+    commands.add_parser("bench", help="time autocomplete on the index")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"Indexed {build(args.source, args.index):,} cities into {args.index}")
+    else:
+        started = time.perf_counter()
+        index = CityIndex.load(args.index)
+        print(f"Loaded {len(index):,} cities in {time.perf_counter() - started:.2f} s")
+        if args.command == "search":
+            for label, city_id in index.complete(args.text):
+                print(f"{city_id:>10}  {label}")
+        else:
+            for name, value in benchmark(index).items():
+                print(f"{name}: {value:.1f}")
@@ -0,0 +1,270 @@
+# A dashboard that keeps the weather of many cities up to date, in one table.
+#
+# Looking up hundreds of cities one button press at a time isn't practical, and sending hundreds
+# of requests at once would blow through the API's rate limit and flood the GUI thread with
+# results. The dashboard instead:
+# - asks for up to 20 cities per call with OpenWeatherMap's group endpoint (by city ID), and falls
+#   back to one call per city if the API key can't use it, or for cities given by name;
+# - sends the calls one batch at a time on a timer, spaced to stay under the calls-per-minute
+#   limit, with a few running at once on the shared thread pool and session;
+# - goes through the cache, so cities fetched within the last 10 minutes cost nothing;
+# - only touches the table cells whose text changed, so a refresh where little changed costs
+#   the GUI thread almost nothing.
+#
+# Run it with a file of cities, one per line, each an OpenWeatherMap city ID or a name:
+#     python dashboard.py cities.txt
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QHeaderView, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget
+from dotenv import load_dotenv
+
+from cache import CachedClient, WeatherCache
+from main import WeatherApp
+from worker import GROUP_SIZE, MAX_THREADS, WeatherClient, WeatherError
+
+# Seconds between refreshes of every city (OpenWeatherMap updates about every 10 minutes).
+REFRESH_INTERVAL = 600
+# The free plan allows 60 calls a minute.
+CALLS_PER_MINUTE = 60
+COLUMNS = ["City", "Temperature", "Weather", "Updated"]
+
+
+def load_cities(path):
+    """
+    Reads a cities file: one city ID or name per line; empty lines and '#' comments are skipped.
+
+    Returns:
+        list: Queries for WeatherClient.fetch, e.g. [{"id": 2643743}, {"q": "Paris,FR"}].
+    """
+    cities = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                cities.append({"id": int(line)} if line.isdigit() else {"q": line})
+    return cities
+
+
+class BatchSignals(QObject):
+    """Signals of a BatchTask."""
+    finished = pyqtSignal(object, object)  # batch, {row: reply}
+    failed = pyqtSignal(object, object)  # batch, WeatherError
+
+
+class BatchTask(QRunnable):
+    """
+    Fetches one batch on a pool thread: ("group", [(row, city ID), ...]) with one group call,
+    or ("single", [(row, query)]) with one ordinary call.
+    """
+
+    def __init__(self, client, batch):
+        super().__init__()
+        self.client = client
+        self.batch = batch
+        self.signals = BatchSignals()
+
+    def run(self):
+        kind, cities = self.batch
+        try:
+            if kind == "group":
+                replies = self.client.fetch_group([city_id for _, city_id in cities])
+                result = {row: replies[city_id] for row, city_id in cities if city_id in replies}
+            else:
+                row, query = cities[0]
+                result = {row: self.client.fetch(query)}
+        except WeatherError as error:
+            self.signals.failed.emit(self.batch, error)
+        except Exception as error:
+            # Anything else (sqlite3.Error from the cache, an odd reply) must still be reported,
+            # or the batch would stay pending and never be refreshed again.
+            self.signals.failed.emit(self.batch, WeatherError(f"Something went wrong:\n{type(error).__name__}"))
+        else:
+            self.signals.finished.emit(self.batch, result)
+
+
+class Dashboard(QWidget):
+    """
+    A table of cities with their current weather, refreshed in the background.
+    """
+
+    def __init__(self, client, cities, interval=REFRESH_INTERVAL, calls_per_minute=CALLS_PER_MINUTE,
+                 pool=None, parent=None):
+        """
+        Args:
+            client: A WeatherClient, or a CachedClient.
+            cities (list): Queries (see load_cities), one row each.
+            interval (float): Seconds between refreshes of every city.
+            calls_per_minute (float): The most API calls to send in a minute.
+            pool (QThreadPool, optional): Where to run the calls. By default, a pool of
+                MAX_THREADS threads.
+        """
+        super().__init__(parent)
+        self.client = client
+        self.cities = cities
+        self.interval = interval
+        self.min_spacing = 60.0 / calls_per_minute
+        self.pool = pool
+        if self.pool is None:
+            self.pool = QThreadPool(self)
+            self.pool.setMaxThreadCount(MAX_THREADS)
+        self.use_group = True  # Until the API says the key can't use it.
+        self.queue = deque()  # Batches waiting to be sent.
+        self.pending = set()  # Rows queued or being fetched.
+        self.tasks = []  # Running tasks, kept alive until they report back.
+        self.cell_updates = 0  # Table cells changed (to see how much GUI work a refresh was).
+        self.refreshes = 0
+
+        self.setWindowTitle("Weather Dashboard")
+        self.table = QTableWidget(len(cities), len(COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.shown = []  # The text in every cell, to compare new values with.
+        for row, query in enumerate(cities):
+            texts = [str(query.get("q", query.get("id"))), "…", "", ""]
+            for column, text in enumerate(texts):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+            self.shown.append(texts)
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.table)
+        self.setLayout(vbox)
+        self.resize(700, 600)
+
+        # Sends the next batch; its interval spaces the calls out.
+        self.send_timer = QTimer(self)
+        self.send_timer.timeout.connect(self._send_next)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(int(interval * 1000))
+
+    def _batches(self, rows):
+        """Splits rows into batches: groups of city IDs where possible, single calls otherwise."""
+        batches = []
+        ids = [(row, self.cities[row]["id"]) for row in rows if "id" in self.cities[row]]
+        others = [row for row in rows if "id" not in self.cities[row]]
+        if self.use_group:
+            batches += [("group", ids[start:start + GROUP_SIZE]) for start in range(0, len(ids), GROUP_SIZE)]
+        else:
+            others = rows
+        batches += [("single", [(row, self.cities[row])]) for row in others]
+        return batches
+
+    def refresh(self):
+        """
+        Queues every city for fetching. The batches go out one at a time, spread over the
+        refresh interval (the first refresh as fast as the rate limit allows).
+        """
+        batches = self._batches([row for row in range(len(self.cities)) if row not in self.pending])
+        for _, cities in batches:
+            self.pending.update(row for row, _ in cities)
+        self.queue.extend(batches)
+        spacing = self.min_spacing
+        if self.refreshes and self.queue:
+            spacing = max(spacing, 0.9 * self.interval / len(self.queue))
+        self.refreshes += 1
+        self.send_timer.start(int(spacing * 1000))
+        self._send_next()
+
+    def _send_next(self):
+        if not self.queue:
+            self.send_timer.stop()
+            return
+        if len(self.tasks) >= self.pool.maxThreadCount():
+            return  # All threads busy; try again on the next tick.
+        task = BatchTask(self.client, self.queue.popleft())
+        task.setAutoDelete(False)
+        task.signals.finished.connect(self._finished)
+        task.signals.failed.connect(self._failed)
+        self.tasks.append(task)
+        self.pool.start(task)
+
+    def _forget(self, batch):
+        self.tasks = [task for task in self.tasks if task.batch is not batch]
+        self.pending.difference_update(row for row, _ in batch[1])
+
+    def _finished(self, batch, replies):
+        self._forget(batch)
+        for row, data in replies.items():
+            self._show(row, data)
+        for row, _ in batch[1]:
+            if row not in replies:
+                self._set(row, [self.shown[row][0], "", "Not found", ""])
+
+    def _failed(self, batch, error):
+        kind, cities = batch
+        self._forget(batch)
+        if kind == "group" and error.status in (401, 404):
+            # This key can't use the group endpoint: ask for these cities, and those of the
+            # groups still waiting, one by one.
+            self.use_group = False
+            rows = [row for row, _ in cities]
+            waiting = deque()
+            for queued in self.queue:
+                if queued[0] == "group":
+                    rows += [row for row, _ in queued[1]]
+                else:
+                    waiting.append(queued)
+            retry = self._batches(rows)
+            for _, retried in retry:
+                self.pending.update(row for row, _ in retried)
+            self.queue = deque(retry) + waiting
+            if not self.send_timer.isActive():
+                self.send_timer.start(int(self.min_spacing * 1000))
+            return
+        message = str(error).replace("\n", " ")
+        for row, _ in cities:
+            self._set(row, [self.shown[row][0], "", message, ""])
+
+    def _show(self, row, data):
+        city = data.get("name") or self.shown[row][0]
+        country = data.get("sys", {}).get("country")
+        temperature = data["main"]["temp"] - 273.15  # Kelvin to Celsius
+        weather = data["weather"][0]
+        updated = time.strftime("%H:%M", time.localtime(data.get("dt", time.time())))
+        if "stale_since" in data:
+            updated += " (offline)"
+        self._set(row, [f"{city}, {country}" if country else city, f"{temperature:.0f}°C",
+                        f"{WeatherApp.get_weather_emoji(weather['id'])} {weather['description']}", updated])
+
+    def _set(self, row, texts):
+        """Updates the cells of a row whose text changed."""
+        shown = self.shown[row]
+        for column, text in enumerate(texts):
+            if shown[column] != text:
+                self.table.item(row, column).setText(text)
+                shown[column] = text
+                self.cell_updates += 1
+
+    def closeEvent(self, event):
+        self.refresh_timer.stop()
+        self.send_timer.stop()
+        self.queue.clear()
+        self.pool.waitForDone()
+        self.client.close()
+        super().closeEvent(event)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the weather of many cities in one table.")
+    parser.add_argument("cities", help="file with one OpenWeatherMap city ID or name per line")
+    parser.add_argument("--interval", type=float, default=REFRESH_INTERVAL, help="seconds between refreshes")
+    parser.add_argument("--calls-per-minute", type=float, default=CALLS_PER_MINUTE)
+    args, qt_args = parser.parse_known_args(argv)
+
+    load_dotenv()
+    app = QApplication([sys.argv[0]] + qt_args)
+    client = CachedClient(WeatherClient(os.getenv("OPENWEATHER_API_KEY")), WeatherCache())
+    dashboard = Dashboard(client, load_cities(args.cities), args.interval, args.calls_per_minute)
+    dashboard.show()
+    dashboard.refresh()
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
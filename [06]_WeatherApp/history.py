@@ -0,0 +1,496 @@
+# A recorder that keeps the weather of some cities over time, and a compact store for it.
+#
+# The app shows a reading and throws it away. Here a background thread polls a list of cities
+# (with the group endpoint, through the cache) and appends every new reading to a file per
+# city in the 'history' folder:
+#   - a 64-byte header: the time of the first reading ('base'), the number of readings and the
+#     city's offset from UTC at that first reading (kept, so daily buckets don't move when
+#     daylight saving time starts or ends);
+#   - then fixed-size records: the reading time as seconds after 'base' (uint32, good for 136
+#     years) and the values as float32 - 20 bytes a reading, about 1 MB a year at one reading
+#     every 10 minutes.
+# The files are memory-mapped with numpy. Readings are appended in time order, so a time range
+# is two binary searches and a slice, and downsampling to hourly or daily
+# min/mean/max goes through the range in fixed-size chunks, so neither reads more than it needs
+# nor uses more memory as the years pile up.
+#
+# Record the cities of a file (one city ID or name per line) every 10 minutes:
+#     python history.py record cities.txt
+# and look at one:
+#     python history.py show 2643743 --every day
+
+import argparse
+import bisect
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from worker import GROUP_SIZE, WeatherError
+
+DEFAULT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+# Seconds between polls (OpenWeatherMap updates about every 10 minutes).
+RECORD_INTERVAL = 600
+MAGIC = b"WXHIST1"
+HEADER = np.dtype([("magic", "S8"), ("base", "<i8"), ("count", "<i8"), ("utc_offset", "<i4"), ("unused", "V36")])
+FIELDS = ["temp", "humidity", "pressure", "wind_speed"]  # °C, %, hPa, m/s
+RECORD = np.dtype([("offset", "<u4")] + [(field, "<f4") for field in FIELDS])
+# Readings a new file has room for; it doubles when full.
+INITIAL_CAPACITY = 4096
+# Readings processed at a time when downsampling.
+CHUNK = 65536
+BUCKETS = {"hour": 3600, "day": 86400}
+
+
+def reading(data):
+    """
+    Picks out what is kept of an API reply.
+
+    Returns:
+        tuple: (time of the reading, seconds east of UTC, {field: value}).
+    """
+    values = {
+        "temp": data["main"]["temp"] - 273.15,  # Kelvin to Celsius
+        "humidity": data["main"].get("humidity", np.nan),
+        "pressure": data["main"].get("pressure", np.nan),
+        "wind_speed": data.get("wind", {}).get("speed", np.nan),
+    }
+    return int(data["dt"]), int(data.get("timezone", 0)), values
+
+
+class CitySeries:
+    """
+    The readings of one city, in one memory-mapped file (see the top of this file).
+
+    One process should write a file at a time; others can read it while it is written.
+    """
+
+    def __init__(self, path, writable=False):
+        """
+        Args:
+            path (str): The file. It is created (when writable) if it doesn't exist.
+            writable (bool): Whether readings will be added.
+        """
+        self.path = path
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            with open(path, "wb") as file:
+                header = np.zeros(1, HEADER)
+                header["magic"] = MAGIC
+                file.write(header.tobytes())
+                file.truncate(HEADER.itemsize + INITIAL_CAPACITY * RECORD.itemsize)
+        self._map()
+        if self.header["magic"][0] != MAGIC:
+            raise ValueError(f"{path} is not a weather history file")
+
+    def _map(self):
+        mode = "r+" if self.writable else "r"
+        capacity = (os.path.getsize(self.path) - HEADER.itemsize) // RECORD.itemsize
+        self.header = np.memmap(self.path, HEADER, mode, shape=(1,))
+        self.records = np.memmap(self.path, RECORD, mode, offset=HEADER.itemsize, shape=(capacity,))
+
+    def __len__(self):
+        # The header may count readings added (by a writer) past the end of this map.
+        return min(int(self.header["count"][0]), len(self.records))
+
+    @property
+    def base(self):
+        return int(self.header["base"][0])
+
+    @property
+    def utc_offset(self):
+        return int(self.header["utc_offset"][0])
+
+    def last_time(self):
+        """The time of the last reading, or None if there is none."""
+        count = len(self)
+        return self.base + int(self.records["offset"][count - 1]) if count else None
+
+    def append(self, when, utc_offset, values):
+        """
+        Adds a reading if it is newer than the last one (the same reading, polled twice, isn't
+        stored twice).
+
+        Args:
+            when (int): Unix time of the reading.
+            utc_offset (int): The city's offset from UTC in seconds. Only the first reading's is
+                kept (for daily buckets).
+            values (dict): {field: value} for FIELDS.
+
+        Returns:
+            bool: Whether it was added.
+        """
+        count = len(self)
+        if count == 0:
+            self.header["base"] = when
+            self.header["utc_offset"] = utc_offset
+        elif when <= self.last_time():
+            return False
+        if count == len(self.records):
+            self._grow()
+        self.records[count] = (when - self.base, *(values[field] for field in FIELDS))
+        # Count the reading only once it is written, for readers of the file.
+        self.header["count"] = count + 1
+        return True
+
+    def _grow(self):
+        """Doubles the room for readings."""
+        self.flush()
+        capacity = len(self.records) * 2
+        del self.header, self.records
+        with open(self.path, "r+b") as file:
+            file.truncate(HEADER.itemsize + capacity * RECORD.itemsize)
+        self._map()
+
+    def _range(self, start, end):
+        """The positions of the readings with start <= time < end (None for no bound)."""
+        count = len(self)
+        if not self.writable and count < int(self.header["count"][0]):
+            self._map()  # The file grew since it was opened.
+            count = len(self)
+        # A binary search over the mapped column: np.searchsorted would first copy the
+        # (strided) column whole, reading every page of the file.
+        offsets = self.records["offset"][:count]
+        low = 0 if start is None else bisect.bisect_left(offsets, start - self.base)
+        high = count if end is None else bisect.bisect_left(offsets, end - self.base, low)
+        return low, high
+
+    def between(self, start=None, end=None):
+        """
+        The readings with start <= time < end.
+
+        Args:
+            start, end (int, optional): Unix times; None for no bound.
+
+        Returns:
+            tuple: (times as an int64 array, the records: a view of the file, with a column
+                for each of FIELDS).
+        """
+        low, high = self._range(start, end)
+        records = self.records[low:high]
+        return self.base + records["offset"].astype(np.int64), records
+
+    def downsample(self, every="hour", start=None, end=None, chunk=CHUNK):
+        """
+        The min, mean and max of every field per hour or day (in the city's time zone), for the
+        readings with start <= time < end.
+
+        The readings are processed 'chunk' at a time, so memory use doesn't grow with the range
+        (only with the number of buckets in the result).
+
+        Args:
+            every (str or int): "hour", "day" or a bucket width in seconds.
+            start, end (int, optional): Unix times; None for no bound.
+            chunk (int): Readings processed at a time.
+
+        Returns:
+            dict: "time" (the start of each bucket, Unix time), "count", and for every field
+                "<field>_min", "<field>_mean" and "<field>_max"; all numpy arrays, one value a
+                bucket with readings in it.
+        """
+        width = BUCKETS.get(every, every)
+        if not isinstance(width, int) or width <= 0:
+            raise ValueError(f"Unknown bucket size: {every!r}")
+        low, high = self._range(start, end)
+        # Bucket numbers are counted from 'base', shifted to the city's midnight.
+        shift = (self.base + self.utc_offset) % width
+        parts = {"bucket": [], "count": []}
+        for field in FIELDS:
+            parts.update({f"{field}_min": [], f"{field}_sum": [], f"{field}_max": []})
+        for position in range(low, high, chunk):
+            records = self.records[position:min(position + chunk, high)]
+            buckets = (records["offset"].astype(np.int64) + shift) // width
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+            chunk_parts = {"bucket": buckets[starts], "count": np.diff(np.append(starts, len(buckets)))}
+            for field in FIELDS:
+                values = records[field]
+                chunk_parts[f"{field}_min"] = np.minimum.reduceat(values, starts)
+                chunk_parts[f"{field}_sum"] = np.add.reduceat(values.astype(np.float64), starts)
+                chunk_parts[f"{field}_max"] = np.maximum.reduceat(values, starts)
+            if parts["bucket"] and parts["bucket"][-1][-1] == chunk_parts["bucket"][0]:
+                # The last bucket of the previous chunk goes on in this one: merge the two.
+                for name, merge in _MERGES.items():
+                    parts[name][-1][-1] = merge(parts[name][-1][-1], chunk_parts[name][0])
+                    chunk_parts[name] = chunk_parts[name][1:]
+            if len(chunk_parts["bucket"]):
+                for name, values in chunk_parts.items():
+                    parts[name].append(values)
+        joined = {name: np.concatenate(values) if values else np.array([]) for name, values in parts.items()}
+        result = {"time": self.base - shift + joined["bucket"].astype(np.int64) * width, "count": joined["count"]}
+        for field in FIELDS:
+            result[f"{field}_min"] = joined[f"{field}_min"]
+            result[f"{field}_mean"] = joined[f"{field}_sum"] / np.maximum(joined["count"], 1)
+            result[f"{field}_max"] = joined[f"{field}_max"]
+        return result
+
+    def flush(self):
+        if self.writable:
+            self.header.flush()
+            self.records.flush()
+
+
+# How downsample merges a bucket split between two chunks.
+_MERGES = {"bucket": lambda a, b: a, "count": lambda a, b: a + b}
+for _field in FIELDS:
+    _MERGES.update({f"{_field}_min": min, f"{_field}_sum": lambda a, b: a + b, f"{_field}_max": max})
+
+
+class HistoryStore:
+    """
+    A folder of CitySeries, one per city ID ("<id>.wxh"). Safe to write from several threads.
+    """
+
+    def __init__(self, folder=DEFAULT_FOLDER, writable=True):
+        self.folder = folder
+        self.writable = writable
+        self.series = {}  # city ID -> open CitySeries
+        self.lock = threading.Lock()
+        if writable:
+            os.makedirs(folder, exist_ok=True)
+
+    def cities(self):
+        """The IDs of the cities with readings."""
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.folder) if name.endswith(".wxh"))
+
+    def city(self, city_id):
+        """
+        The CitySeries of a city.
+
+        Raises:
+            KeyError: If there is no history for it (and the store isn't writable).
+        """
+        with self.lock:
+            series = self.series.get(city_id)
+            if series is None:
+                path = os.path.join(self.folder, f"{city_id}.wxh")
+                if not self.writable and not os.path.exists(path):
+                    raise KeyError(city_id)
+                series = self.series[city_id] = CitySeries(path, self.writable)
+            return series
+
+    def record(self, data):
+        """
+        Adds the reading in an API reply to its city's history.
+
+        Returns:
+            bool: Whether it was new. Replies served from the cache when offline (see
+                cache.py) are old readings and aren't recorded.
+        """
+        if "stale_since" in data or "id" not in data:
+            return False
+        series = self.city(data["id"])
+        with self.lock:
+            return series.append(*reading(data))
+
+    def close(self):
+        with self.lock:
+            for series in self.series.values():
+                series.flush()
+            self.series.clear()
+
+
+class HistoryRecorder:
+    """
+    Polls a list of cities on a background thread and records their readings.
+    """
+
+    def __init__(self, client, cities, store, interval=RECORD_INTERVAL):
+        """
+        Args:
+            client: A WeatherClient, or a CachedClient.
+            cities (list): Queries, e.g. [{"id": 2643743}, {"q": "Paris,FR"}] (see
+                dashboard.load_cities). Cities with IDs are fetched GROUP_SIZE at a time.
+            store (HistoryStore): Where to record.
+            interval (float): Seconds between polls.
+        """
+        self.client = client
+        self.cities = cities
+        self.store = store
+        self.interval = interval
+        self.use_group = True  # Until the API says the key can't use it.
+        self.recorded = 0
+        self.errors = 0
+        self.last_error = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def _replies(self):
+        """Fetches every city once; yields the replies and counts the failures."""
+        ids = [query["id"] for query in self.cities if "id" in query]
+        singles = [query for query in self.cities if "id" not in query]
+        for start in range(0, len(ids) if self.use_group else 0, GROUP_SIZE):
+            group = ids[start:start + GROUP_SIZE]
+            try:
+                yield from self.client.fetch_group(group).values()
+            except WeatherError as error:
+                if error.status in (401, 404):
+                    # This key can't use the group endpoint.
+                    self.use_group = False
+                    break
+                self._failed(error)
+            except Exception as error:  # e.g. sqlite3.Error from the cache
+                self._failed(error)
+        if not self.use_group:
+            singles = [{"id": city_id} for city_id in ids] + singles
+        for query in singles:
+            try:
+                yield self.client.fetch(query)
+            except Exception as error:
+                self._failed(error)
+
+    def _failed(self, error):
+        self.errors += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+
+    def poll(self):
+        """
+        Fetches every city once and records the new readings.
+
+        A reply that can't be recorded (one without "main", a full disk, ...) is counted in
+        'errors' and the others are still recorded.
+
+        Returns:
+            int: The number of new readings.
+        """
+        added = 0
+        for data in self._replies():
+            try:
+                added += self.store.record(data)
+            except Exception as error:
+                self._failed(error)
+        self.recorded += added
+        return added
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                self.poll()
+            except Exception as error:  # Keep polling: the thread is the only one that would.
+                self._failed(error)
+            self.stopping.wait(self.interval)
+
+    def start(self):
+        """Starts polling (the first poll right away) on a daemon thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="HistoryRecorder", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops polling, after the poll in progress, and flushes the store."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.store.close()
+
+
+def benchmark(folder, years=10, interval=600, seed=0):
+    """
+    Fills a city with 'years' of readings and times queries on it.
+
+    Returns:
+        dict: The number of readings, the file size and timings (milliseconds), and the peak
+            memory of downsampling everything to days (megabytes).
+    """
+    import tracemalloc
+
+    rng = np.random.default_rng(seed)
+    count = int(years * 365 * 86400 / interval)
+    start = 1_500_000_000
+    times = start + np.arange(count, dtype=np.int64) * interval
+    series = CitySeries(os.path.join(folder, "0.wxh"), writable=True)
+    values = {"humidity": 60.0, "pressure": 1013.0, "wind_speed": 3.0}
+    temps = 10 + 8 * np.sin(times / 86400 * 2 * np.pi) + rng.normal(0, 1, count)
+    started = time.perf_counter()
+    for when, temp in zip(times.tolist(), temps.tolist()):
+        values["temp"] = temp
+        series.append(when, 3600, values)
+    series.flush()
+    timings = {"readings": count, "file_mb": os.path.getsize(series.path) / 1e6,
+               "append_us": (time.perf_counter() - started) / count * 1e6}
+
+    reader = CitySeries(series.path)
+    days = rng.integers(0, years * 365 - 1, 200)
+    started = time.perf_counter()
+    for day in days.tolist():
+        reader.between(start + day * 86400, start + (day + 1) * 86400)
+    timings["day_range_ms"] = (time.perf_counter() - started) / len(days) * 1e3
+    started = time.perf_counter()
+    for day in days.tolist():
+        reader.downsample("hour", start + day * 86400, start + (day + 7) * 86400)
+    timings["week_hourly_ms"] = (time.perf_counter() - started) / len(days) * 1e3
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    daily = reader.downsample("day")
+    timings["all_daily_ms"] = (time.perf_counter() - started) * 1e3
+    timings["all_daily_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    timings["days"] = len(daily["time"])
+    return timings
+
+
+def _time(text):
+    """Parses "2024-05-01" or "2024-05-01T12:00" (UTC) into Unix time."""
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp()) if text else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and query the weather history of cities.")
+    parser.add_argument("--folder", default=DEFAULT_FOLDER, help="where the history files are")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="poll cities and record their readings")
+    record_parser.add_argument("cities", help="file with one OpenWeatherMap city ID or name per line")
+    record_parser.add_argument("--interval", type=float, default=RECORD_INTERVAL, help="seconds between polls")
+    show_parser = commands.add_parser("show", help="show a city's readings")
+    show_parser.add_argument("city", type=int, help="the city ID")
+    show_parser.add_argument("--every", choices=sorted(BUCKETS), help="downsample to hours or days")
+    show_parser.add_argument("--start", help="from this UTC date/time (ISO format)")
+    show_parser.add_argument("--end", help="until this UTC date/time (ISO format)")
+    bench_parser = commands.add_parser("bench", help="time queries on years of synthetic readings")
+    bench_parser.add_argument("--years", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from dotenv import load_dotenv
+
+        from cache import CachedClient, WeatherCache
+        from dashboard import load_cities
+        from worker import WeatherClient
+
+        load_dotenv()
+        client = CachedClient(WeatherClient(os.getenv("OPENWEATHER_API_KEY")), WeatherCache())
+        recorder = HistoryRecorder(client, load_cities(args.cities), HistoryStore(args.folder), args.interval)
+        recorder.start()
+        try:
+            while True:
+                time.sleep(args.interval)
+                print(f"{time.strftime('%H:%M')} {recorder.recorded} readings recorded, {recorder.errors} errors")
+        except KeyboardInterrupt:
+            recorder.stop()
+            client.close()
+    elif args.command == "show":
+        series = HistoryStore(args.folder, writable=False).city(args.city)
+        start, end = _time(args.start), _time(args.end)
+        if args.every:
+            buckets = series.downsample(args.every, start, end)
+            for index, when in enumerate(buckets["time"].tolist()):
+                stamp = datetime.fromtimestamp(when + series.utc_offset, timezone.utc).strftime("%Y-%m-%d %H:%M")
+                print(f"{stamp}  {buckets['temp_min'][index]:6.1f} {buckets['temp_mean'][index]:6.1f} "
+                      f"{buckets['temp_max'][index]:6.1f} °C  ({buckets['count'][index]} readings)")
+        else:
+            times, records = series.between(start, end)
+            for when, record in zip(times.tolist(), records):
+                stamp = datetime.fromtimestamp(when + series.utc_offset, timezone.utc).strftime("%Y-%m-%d %H:%M")
+                print(f"{stamp}  {record['temp']:6.1f} °C  {record['humidity']:3.0f}%  "
+                      f"{record['pressure']:6.0f} hPa  {record['wind_speed']:4.1f} m/s")
+    else:
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as folder:
+            for name, value in benchmark(folder, args.years).items():
+                print(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}")
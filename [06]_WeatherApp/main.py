@@ -1,10 +1,13 @@
 import sys
 import os
-import requests
+import time
 from PyQt5.QtWidgets import (QApplication, QWidget, QLabel,
-                             QLineEdit, QPushButton, QVBoxLayout)
-from PyQt5.QtCore import Qt
+                             QLineEdit, QPushButton, QVBoxLayout, QCompleter)
+from PyQt5.QtCore import Qt, QStringListModel
 from dotenv import load_dotenv  # For loading environment variables from .env
+from worker import WeatherClient, WeatherFetcher  # Runs the API requests off the GUI thread
+from cache import CachedClient, WeatherCache  # Reuses recent replies, and the last one when offline
+from cities import DEFAULT_PATH as CITY_INDEX, CityIndex  # Offline city names, for autocomplete
 
 
 class WeatherApp(QWidget):
@@ -17,11 +20,22 @@ class WeatherApp(QWidget):
     - Displays temperature, weather description, and corresponding emoji
     - Handles errors gracefully with user-friendly messages
     - Loads API key from .env file for security.
+    - Fetches in the background, so the window never freezes while waiting.
+    - Caches replies for 10 minutes (also across restarts), and shows the last one when offline.
+    - Suggests city names while typing, and catches typos without asking the API (once the
+      city index is built, see cities.py).
     """
 
     def __init__(self):
         """Initialize the WeatherApp UI and components."""
         super().__init__()
+        # Load the API key once, and keep one client (and its open connections) for all lookups
+        load_dotenv()
+        client = CachedClient(WeatherClient(os.getenv("OPENWEATHER_API_KEY")), WeatherCache())
+        self.fetcher = WeatherFetcher(client, parent=self)
+        self.fetcher.weather_ready.connect(self.display_weather)
+        self.fetcher.error.connect(self.display_error)
+
         # UI elements
         self.city_label = QLabel("Enter City Name: ", self)
         self.city_input = QLineEdit(self)
@@ -30,6 +44,14 @@ class WeatherApp(QWidget):
         self.emoji_label = QLabel(self)
         self.description_label = QLabel(self)
 
+        # City name suggestions, from the local index if it has been built
+        self.cities = CityIndex.load(CITY_INDEX) if os.path.exists(CITY_INDEX) else None
+        self.suggestions = {}  # label shown in the completer -> city ID
+        self.completer_model = QStringListModel(self)
+        self.completer = QCompleter(self.completer_model, self)
+        # The index has already picked the suggestions (typos included): show them all
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+
         # Setup the UI
         self.initUI()
 
@@ -98,65 +120,57 @@ class WeatherApp(QWidget):
         # Trigger get_weather when Enter/Return is pressed in the city_input field
         self.city_input.returnPressed.connect(self.get_weather)
 
+        # Suggest cities as the user types
+        if self.cities is not None:
+            self.city_input.setCompleter(self.completer)
+            self.city_input.textEdited.connect(self.suggest_cities)
+            self.completer.activated[str].connect(self.choose_city)
+
+    def suggest_cities(self, text):
+        """Fill the completer with the cities matching what has been typed so far."""
+        self.suggestions = dict(self.cities.complete(text))
+        self.completer_model.setStringList(list(self.suggestions))
+        if self.suggestions:
+            self.completer.complete()
+
+    def choose_city(self, label):
+        """Fetch the weather of the suggestion the user picked."""
+        self.city_input.setText(label)
+        self.get_weather()
+
     def get_weather(self):
         """
-        Fetch weather data from OpenWeatherMap API based on city input.
-        """
-        load_dotenv()  # Load environment variables from .env file
-        api_key = os.getenv("OPENWEATHER_API_KEY")
-        city_name = self.city_input.text().strip()  # Remove leading/trailing spaces
+        Start fetching weather data from OpenWeatherMap API based on city input.
 
-        # Construct the API URL
-        url = f"https://api.openweathermap.org/data/2.5/weather?q={city_name}&appid={api_key}"
+        The request runs in the background; display_weather or display_error is called with
+        the result. Pressing Enter again while the same city is loading doesn't send another
+        request.
 
+        With the city index, the city is looked up by ID, and a name that isn't in the index
+        is reported (with the closest name) without asking the API.
         """
-        Displays weather data or error messages depending on the API response.
-        """
-        try:
-            # Send GET request to the API
-            response = requests.get(url)
-            response.raise_for_status()  # Raise error for bad HTTP responses
-            data = response.json()
-
-            # If response code is 200, weather data exists for this city
-            if data["cod"] == 200:
-                self.display_weather(data)
-
-        except requests.exceptions.HTTPError as http_error:
-            # Handling specific HTTP error codes
-            match response.status_code:
-                case 400:
-                    self.display_error(
-                        "Bad request:\nPlease check your city name")
-                case 401:
-                    self.display_error("Unauthorized:\nInvalid API key")
-                case 403:
-                    self.display_error("Forbidden:\nAccess is denied")
-                case 404:
+        city_name = self.city_input.text().strip()  # Remove leading/trailing spaces
+        if not city_name:
+            self.display_error("Bad request:\nPlease check your city name")
+            return
+        if self.cities is None:
+            self.fetcher.request({"q": city_name})
+            return
+        city_id = self.suggestions.get(city_name)
+        if city_id is None:
+            city_id, typos = self.cities.resolve(city_name)
+            if city_id is None:
+                if typos:
+                    self.display_error(f"Not found:\nDid you mean {typos[0][0]}?")
+                else:
                     self.display_error("Not found:\nCity not found")
-                case 500:
-                    self.display_error(
-                        "Internal Server Error:\nPlease try again later")
-                case 502:
-                    self.display_error(
-                        "Bad Gateway:\nInvalid response from the server")
-                case 503:
-                    self.display_error("Service Unavailable:\nService is down")
-                case 504:
-                    self.display_error(
-                        "Gateway Timeout:\nNo response from the server")
-                case _:
-                    self.display_error(f"HTTP error occurred:\n{http_error}")
-
-        # Additional network-related error handling
-        except requests.exceptions.ConnectionError:
-            print("Connection Error:\nCheck your Internet Connection")
-        except requests.exceptions.Timeout:
-            print("Timeout Error:\nThe request timed out")
-        except requests.exceptions.TooManyRedirects:
-            print("Too many Redirects:\nCheck the URL")
-        except requests.exceptions.RequestException as req_error:
-            print(f"Something went wrong:\n{req_error}")
+                return
+        self.fetcher.request({"id": city_id})
+
+    def closeEvent(self, event):
+        """Let running requests finish before the window goes away."""
+        self.fetcher.shutdown()
+        super().closeEvent(event)
 
     def display_error(self, message):
         """
@@ -190,6 +204,10 @@ class WeatherApp(QWidget):
         # Update UI with weather data
         self.temperature_label.setText(f"{temperature_c:.0f}°C")
         self.emoji_label.setText(self.get_weather_emoji(weather_id))
+        if "stale_since" in data:
+            # Served from the cache because the API couldn't be reached
+            fetched = time.strftime("%H:%M", time.localtime(data["stale_since"]))
+            weather_description = f"{weather_description}\n(offline, as of {fetched})"
         self.description_label.setText(f"{weather_description}")
 
     @staticmethod
@@ -227,6 +245,11 @@ class WeatherApp(QWidget):
 
 
 if __name__ == "__main__":
+    # Dashboard mode: "python main.py --dashboard cities.txt" shows many cities at once
+    if len(sys.argv) > 1 and sys.argv[1] == "--dashboard":
+        import dashboard
+        sys.exit(dashboard.main(sys.argv[2:]))
+
     # Entry point: Create the application and run the event loop
     app = QApplication(sys.argv)
     weather_app = WeatherApp()
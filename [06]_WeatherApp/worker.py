@@ -0,0 +1,246 @@
+# Background fetching for the WeatherApp.
+#
+# A blocking requests.get on the GUI thread freezes the window for the whole round trip, and
+# every Enter press while it is frozen is queued up as another request. Here the requests run on
+# a QThreadPool and their results come back to the GUI thread as Qt signals:
+#
+# - WeatherClient does the HTTP work with one persistent Session (kept-alive, pooled connections)
+#   and a timeout, and turns failures into the messages the app shows.
+# - FetchTask is one request, run on a pool thread.
+# - WeatherFetcher is what the window talks to. It skips a request that is already in flight and
+#   drops the replies of requests that a newer one has replaced.
+
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+API_URL = "https://api.openweathermap.org/data/2.5/weather"
+# Current weather of up to GROUP_SIZE cities by ID in one call.
+GROUP_URL = "https://api.openweathermap.org/data/2.5/group"
+GROUP_SIZE = 20
+# Seconds to wait for the server (to connect, and then between bytes of the reply).
+TIMEOUT = 10
+# Requests that may run at once.
+MAX_THREADS = 4
+
+# Messages for the HTTP errors the API returns.
+HTTP_ERRORS = {
+    400: "Bad request:\nPlease check your city name",
+    401: "Unauthorized:\nInvalid API key",
+    403: "Forbidden:\nAccess is denied",
+    404: "Not found:\nCity not found",
+    500: "Internal Server Error:\nPlease try again later",
+    502: "Bad Gateway:\nInvalid response from the server",
+    503: "Service Unavailable:\nService is down",
+    504: "Gateway Timeout:\nNo response from the server",
+}
+
+
+class WeatherError(Exception):
+    """A failed lookup. The message is meant for the user."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status  # The HTTP status, if the server answered.
+
+
+class OfflineError(WeatherError):
+    """The API couldn't be reached (no connection, or no reply in time)."""
+
+
+class WeatherClient:
+    """
+    Fetches current weather from OpenWeatherMap over one persistent session.
+
+    The session is shared by the pool threads: it only sends GET requests and keeps no cookies,
+    and its connection pool is thread-safe.
+    """
+
+    def __init__(self, api_key, url=API_URL, timeout=TIMEOUT, pool_size=MAX_THREADS, group_url=GROUP_URL):
+        """
+        Args:
+            api_key (str): The OpenWeatherMap API key.
+            url (str): The current weather endpoint.
+            group_url (str): The endpoint for several cities at once.
+            timeout (float): Seconds before a request is given up on.
+            pool_size (int): Connections kept open to the server.
+        """
+        self.api_key = api_key
+        self.url = url
+        self.group_url = group_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _get(self, url, params):
+        """Sends a request and returns the decoded JSON reply, or raises WeatherError."""
+        try:
+            response = self.session.get(url, params={**params, "appid": self.api_key}, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.HTTPError as http_error:
+            status = http_error.response.status_code
+            raise WeatherError(HTTP_ERRORS.get(status, f"HTTP error occurred:\n{http_error}"), status) from None
+        except requests.exceptions.ConnectionError:
+            raise OfflineError("Connection Error:\nCheck your Internet Connection") from None
+        except requests.exceptions.Timeout:
+            raise OfflineError("Timeout Error:\nThe request timed out") from None
+        except requests.exceptions.TooManyRedirects:
+            raise WeatherError("Too many Redirects:\nCheck the URL") from None
+        except requests.exceptions.RequestException as req_error:
+            raise WeatherError(f"Something went wrong:\n{req_error}") from None
+        except ValueError:
+            raise WeatherError("Bad Gateway:\nInvalid response from the server") from None
+        return data
+
+    def fetch(self, query):
+        """
+        Fetches the current weather.
+
+        Args:
+            query (dict): What to look up, e.g. {"q": "London"} or {"id": 2643743}.
+
+        Returns:
+            dict: The API's JSON reply.
+
+        Raises:
+            WeatherError: If the lookup failed, with a message to show.
+        """
+        data = self._get(self.url, query)
+        # The API repeats the HTTP status in the reply, sometimes as a string.
+        if str(data.get("cod")) != "200":
+            raise WeatherError(f"Something went wrong:\n{data.get('message', 'unexpected reply')}")
+        return data
+
+    def fetch_group(self, ids):
+        """
+        Fetches the current weather of up to GROUP_SIZE cities in one call.
+
+        Not every plan can use this endpoint; it then fails with a 401 (or 404) WeatherError.
+
+        Args:
+            ids (list): City IDs.
+
+        Returns:
+            dict: {city ID: reply} for the cities found, the replies like those of 'fetch'.
+        """
+        data = self._get(self.group_url, {"id": ",".join(str(city_id) for city_id in ids)})
+        return {city["id"]: city for city in data.get("list", [])}
+
+    def close(self):
+        self.session.close()
+
+
+class FetchSignals(QObject):
+    """
+    Signals of a FetchTask. (A QRunnable isn't a QObject, so it can't have signals itself.)
+
+    Each carries the task's generation number and query, so the receiver can tell which
+    request it answers.
+    """
+    finished = pyqtSignal(int, object, object)  # generation, query, data
+    failed = pyqtSignal(int, object, str)  # generation, query, message
+
+
+class FetchTask(QRunnable):
+    """One lookup, run on a pool thread. The result is emitted to the thread of the receivers."""
+
+    def __init__(self, client, query, generation):
+        super().__init__()
+        self.client = client
+        self.query = query
+        self.generation = generation
+        self.signals = FetchSignals()
+
+    def run(self):
+        try:
+            data = self.client.fetch(self.query)
+        except WeatherError as error:
+            self.signals.failed.emit(self.generation, self.query, str(error))
+        except Exception as error:
+            # Anything else (sqlite3.Error from the cache, an odd reply) must still be reported,
+            # or the query would stay in flight and never be asked for again.
+            self.signals.failed.emit(self.generation, self.query, f"Something went wrong:\n{type(error).__name__}")
+        else:
+            self.signals.finished.emit(self.generation, self.query, data)
+
+
+class WeatherFetcher(QObject):
+    """
+    Runs lookups in the background for a window that shows one result at a time.
+
+    Only the reply to the latest request is passed on: if the user asks for another city
+    while a lookup is running, the running one is left to finish (an HTTP request can't be
+    recalled) but its reply is dropped. Asking again for the city that is already being
+    looked up doesn't start another request.
+    """
+    weather_ready = pyqtSignal(object)  # data
+    error = pyqtSignal(str)  # message
+
+    def __init__(self, client, pool=None, parent=None):
+        """
+        Args:
+            client (WeatherClient): Does the requests.
+            pool (QThreadPool, optional): The threads to run them on. By default, a pool of
+                MAX_THREADS threads.
+        """
+        super().__init__(parent)
+        self.client = client
+        self.pool = pool
+        if self.pool is None:
+            self.pool = QThreadPool(self)
+            self.pool.setMaxThreadCount(MAX_THREADS)
+        self.generation = 0  # Number of the last request sent.
+        self.wanted = 0  # Number of the request whose reply is wanted.
+        self.in_flight = {}  # query key -> generation of the running request for it
+        self.tasks = set()  # Running tasks, kept alive until they report back.
+
+    @staticmethod
+    def _key(query):
+        return tuple(sorted(query.items()))
+
+    def request(self, query):
+        """
+        Looks up 'query' in the background (see WeatherClient.fetch).
+
+        Returns:
+            bool: False if the same lookup was already running and no request was sent.
+        """
+        key = self._key(query)
+        if key in self.in_flight:
+            # Its reply is the one wanted now, whatever was asked for in between.
+            self.wanted = self.in_flight[key]
+            return False
+        self.generation += 1
+        self.wanted = self.generation
+        self.in_flight[key] = self.generation
+        task = FetchTask(self.client, query, self.generation)
+        task.setAutoDelete(False)
+        task.signals.finished.connect(self._finished)
+        task.signals.failed.connect(self._failed)
+        self.tasks.add(task)
+        self.pool.start(task)
+        return True
+
+    def _done(self, generation, query):
+        """Forgets a finished task and says whether its reply is still wanted."""
+        key = self._key(query)
+        if self.in_flight.get(key) == generation:
+            del self.in_flight[key]
+        self.tasks = {task for task in self.tasks if task.generation != generation}
+        return generation == self.wanted
+
+    def _finished(self, generation, query, data):
+        if self._done(generation, query):
+            self.weather_ready.emit(data)
+
+    def _failed(self, generation, query, message):
+        if self._done(generation, query):
+            self.error.emit(message)
+
+    def shutdown(self):
+        """Waits for running requests to finish and closes the session."""
+        self.pool.waitForDone()
+        self.client.close()
@@ -0,0 +1,2 @@
+# Benchmarks of the projects' hot paths; see suite.py for what is measured and __main__.py for
+# how to run them and compare two runs.
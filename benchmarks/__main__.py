@@ -0,0 +1,201 @@
+# Runs the benchmarks of suite.py and compares runs.
+#
+#     python -m benchmarks run -o before.json            # every benchmark, median of 3 runs
+#     python -m benchmarks run --only slots,passgen --instrument
+#     python -m benchmarks compare before.json after.json  # exit status 1 on a regression
+#
+# Every benchmark runs in a process of its own: the projects have modules with the same names
+# ("main", "store"), and one benchmark's imports and garbage shouldn't slow down the next.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.suite import BENCHMARKS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPEAT = 3
+# A change of more than this share in the wrong direction is a regression.
+THRESHOLD = 0.10
+
+
+def direction(metric):
+    """1 if a measurement is better when higher, -1 if better when lower, 0 if not compared."""
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_ns", "_us", "_ms", "_pct")):
+        return -1
+    return 0
+
+
+def measure(name, repeat=REPEAT, seed=0, instrumented=False):
+    """
+    Runs one benchmark 'repeat' times in this process.
+
+    Returns:
+        dict: "metrics" (the median of every measurement), "runs" (every run's measurements)
+            and, if instrumented, "instrument" (timers of its hooks and the sampled profile).
+    """
+    function, tool, hooks = BENCHMARKS[name]
+    if instrumented:
+        from pyprojects import instrument, load
+
+        instrument.enable()
+        for target in hooks:
+            load(tool, target.partition(":")[0])
+            instrument.patch(target)
+        instrument.start_sampler()
+    runs = [function(seed=seed) for _ in range(repeat)]
+    result = {"metrics": {metric: statistics.median(run[metric] for run in runs)
+                          for metric, value in runs[0].items() if isinstance(value, (int, float))},
+              "runs": runs}
+    if instrumented:
+        instrument.stop_sampler()
+        result["instrument"] = instrument.snapshot(top=15)
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, repeat=REPEAT, seed=0, instrumented=False, timeout=600):
+    """
+    Runs benchmarks, each in a new process.
+
+    Returns:
+        dict: "meta" (when, where and how it ran) and "benchmarks" ({name: result of 'measure',
+            plus "seconds"}, or {"error": ...} for a benchmark that failed).
+    """
+    document = {"meta": {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                         "commit": _git_commit(), "python": platform.python_version(),
+                         "platform": platform.platform(), "cpus": os.cpu_count(), "repeat": repeat,
+                         "seed": seed, "instrumented": instrumented},
+                "benchmarks": {}}
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    for name in names:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "result.json")
+            command = [sys.executable, "-m", "benchmarks", "measure", name, "--repeat", str(repeat),
+                       "--seed", str(seed), "--result", path] + (["--instrument"] if instrumented else [])
+            started = time.perf_counter()
+            try:
+                process = subprocess.run(command, cwd=ROOT, env=environment, capture_output=True, text=True,
+                                         timeout=timeout)
+                failure = process.stderr.strip().splitlines()[-1:] if process.returncode else None
+            except subprocess.TimeoutExpired:
+                failure = [f"timed out after {timeout} s"]
+            if failure is not None:
+                result = {"error": failure[0] if failure else f"exit status {process.returncode}"}
+            else:
+                with open(path) as file:
+                    result = json.load(file)
+            result["seconds"] = time.perf_counter() - started
+        document["benchmarks"][name] = result
+        yield name, result
+    return document
+
+
+def compare(before, after, threshold=THRESHOLD):
+    """
+    Compares the measurements of two runs.
+
+    Returns:
+        list: (benchmark, measurement, before, after, change, regressed) for every measurement
+            in both runs that has a direction (see 'direction').
+    """
+    rows = []
+    for name, result in after["benchmarks"].items():
+        old = before["benchmarks"].get(name, {}).get("metrics", {})
+        for metric, value in result.get("metrics", {}).items():
+            sign = direction(metric)
+            if metric not in old or not sign or not old[metric]:
+                continue
+            change = value / old[metric] - 1
+            rows.append((name, metric, old[metric], value, change, sign * change < -threshold))
+    return rows
+
+
+def _print_result(name, result):
+    if "error" in result:
+        print(f"{name:16} failed: {result['error']}")
+        return
+    print(f"{name:16} ({result['seconds']:.1f} s)")
+    for metric, value in result["metrics"].items():
+        print(f"    {metric:28} {value:14,.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks", description="Benchmark the projects' hot paths.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run benchmarks and save the results as JSON")
+    run_parser.add_argument("--only", help=f"comma-separated benchmarks (default: all of {', '.join(BENCHMARKS)})")
+    run_parser.add_argument("--repeat", type=int, default=REPEAT, help="runs of each benchmark; the median is kept")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--instrument", action="store_true",
+                            help="time the benchmarks' hooks and sample a profile (see pyprojects/instrument.py)")
+    run_parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                                help="share of change in the wrong direction that is a regression")
+    measure_parser = commands.add_parser("measure", help=argparse.SUPPRESS)
+    measure_parser.add_argument("name", choices=BENCHMARKS)
+    measure_parser.add_argument("--repeat", type=int, default=REPEAT)
+    measure_parser.add_argument("--seed", type=int, default=0)
+    measure_parser.add_argument("--instrument", action="store_true")
+    measure_parser.add_argument("--result", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "measure":
+        result = measure(args.name, args.repeat, args.seed, args.instrument)
+        with open(args.result, "w") as file:
+            json.dump(result, file)
+        return 0
+
+    if args.command == "compare":
+        with open(args.before) as file:
+            before = json.load(file)
+        with open(args.after) as file:
+            after = json.load(file)
+        for key in ("instrumented", "python", "platform"):
+            if before["meta"].get(key) != after["meta"].get(key):
+                print(f"warning: the runs differ in {key}: {before['meta'].get(key)} -> {after['meta'].get(key)}",
+                      file=sys.stderr)
+        rows = compare(before, after, args.threshold)
+        for name, metric, old, new, change, regressed in rows:
+            print(f"{name:16} {metric:28} {old:14,.1f} -> {new:14,.1f} {change:+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+        return 1 if any(row[-1] for row in rows) else 0
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    runner = run(names, args.repeat, args.seed, args.instrument)
+    while True:
+        try:
+            _print_result(*next(runner))
+        except StopIteration as finished:
+            document = finished.value
+            break
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+    return 1 if any("error" in result for result in document["benchmarks"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# The benchmarks: one function per hot path, each returning its measurements as a dict.
+#
+# A measurement ending in "_per_s" is better when higher; one ending in a unit of time or cost
+# ("_ns", "_us", "_ms", "_pct") is better when lower; others (like "response_mb") only describe
+# the input. Every benchmark starts from a fixed seed and fixed inputs (api.csv for the listings,
+# fixtures/owm_weather.json for the weather API), so two runs measure the same work.
+
+import json
+import os
+import random
+import statistics
+import threading
+import time
+
+from pyprojects import load
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# name -> (function, the tool it measures, its functions to time with --instrument)
+BENCHMARKS = {}
+
+
+def benchmark(tool=None, hooks=()):
+    """Registers a benchmark function under its name."""
+    def register(function):
+        BENCHMARKS[function.__name__] = (function, tool, list(hooks))
+        return function
+    return register
+
+
+def _percentiles(samples, scale=1e6):
+    """p50, p99 and max of some durations in seconds, in microseconds by default."""
+    samples = sorted(samples)
+    return {"p50": samples[len(samples) // 2] * scale, "p99": samples[int(len(samples) * 0.99)] * scale,
+            "max": samples[-1] * scale}
+
+
+@benchmark("slots", ["main:get_slot_machine_spin", "main:check_winnings"])
+def slots(seed=0, spins=20000):
+    """Spins of the original slot machine: get_slot_machine_spin, then check_winnings."""
+    game = load("slots")
+    random.seed(seed)
+    started = time.perf_counter()
+    grids = [game.get_slot_machine_spin(game.ROWS, game.COLS, game.symbol_count) for _ in range(spins)]
+    spin_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for grid in grids:
+        game.check_winnings(grid, game.MAX_LINES, 1, game.symbol_value)
+    check_time = time.perf_counter() - started
+    return {"spins_per_s": spins / spin_time, "checks_per_s": spins / check_time}
+
+
+@benchmark("passgen", ["main:generate_password"])
+def passgen(seed=0, count=20000, length=16):
+    """generate_password with numbers and special characters, and with letters only."""
+    generator = load("passgen")
+    random.seed(seed)
+    results = {}
+    for name, numbers, special in [("passwords_per_s", True, True), ("letters_only_per_s", False, False)]:
+        started = time.perf_counter()
+        for _ in range(count):
+            generator.generate_password(length, numbers, special)
+        results[name] = count / (time.perf_counter() - started)
+    return results
+
+
+@benchmark("crypto", ["normalize:parse_response"])
+def crypto_parse(seed=0, coins=5000, repeats=5):
+    """
+    A listings response of 'coins' coins (rebuilt from api.csv) parsed the way main.py does it
+    (json.loads + pd.json_normalize) and with normalize.parse_response.
+    """
+    import pandas as pd
+
+    fixture = load("crypto", "mock_server").load_fixture(count=coins)
+    body = json.dumps({"status": {"credit_count": 1}, "data": fixture}).encode()
+    results = {"response_mb": len(body) / 1e6}
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        pd.json_normalize(json.loads(body)["data"])
+        times.append(time.perf_counter() - started)
+    results["json_normalize_ms"] = statistics.median(times) * 1e3
+    try:
+        normalize = load("crypto", "normalize")
+    except ImportError as error:  # pyarrow missing
+        results["parse_response_error"] = str(error)
+        return results
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        normalize.parse_response(body)
+        times.append(time.perf_counter() - started)
+    results["parse_response_ms"] = statistics.median(times) * 1e3
+    return results
+
+
+def _stub_server(latency):
+    """A local OpenWeatherMap stand-in answering every request with the recorded reply."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    with open(os.path.join(FIXTURES, "owm_weather.json"), "rb") as file:
+        reply = file.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real API.
+        # Headers and body go out in two writes: with Nagle's algorithm, the body would wait
+        # for the client's delayed ACK (~40 ms) and the benchmark would measure that.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/data/2.5/weather"
+
+
+@benchmark("weather", ["worker:WeatherClient.fetch"])
+def weather_fetch(seed=0, requests=200, latency=0.0):
+    """
+    The fetch behind WeatherApp.get_weather against a local stub server: the client alone,
+    and request -> weather_ready through the WeatherFetcher's thread pool and Qt signals (the
+    window itself isn't created, so no display is needed).
+    """
+    worker = load("weather", "worker")
+    server, url = _stub_server(latency)
+    rng = random.Random(seed)
+    cities = [f"city{rng.randrange(10 ** 6)}" for _ in range(requests)]
+    client = worker.WeatherClient("benchmark", url=url)
+    try:
+        client.fetch({"q": "warm-up"})
+        times = []
+        for city in cities:
+            started = time.perf_counter()
+            client.fetch({"q": city})
+            times.append(time.perf_counter() - started)
+        results = {f"client_{name}_us": value for name, value in _percentiles(times).items()}
+
+        from PyQt5.QtCore import QCoreApplication, QEventLoop, QTimer
+
+        app = QCoreApplication.instance() or QCoreApplication([])
+        fetcher = worker.WeatherFetcher(client)
+        loop = QEventLoop()
+        fetcher.weather_ready.connect(loop.quit)
+        fetcher.error.connect(loop.quit)
+        give_up = QTimer()  # Don't hang if a reply never comes.
+        give_up.setSingleShot(True)
+        give_up.timeout.connect(loop.quit)
+        times = []
+        for city in cities:
+            started = time.perf_counter()
+            fetcher.request({"q": city})
+            give_up.start(5000)
+            loop.exec_()
+            times.append(time.perf_counter() - started)
+        fetcher.pool.waitForDone()
+        results.update({f"get_weather_{name}_us": value for name, value in _percentiles(times).items()})
+    finally:
+        client.close()
+        server.shutdown()
+    return results
+
+
+@benchmark("alarm", ["scheduler:Scheduler.call_at"])
+def alarm_jitter(seed=0, alarms=300, spacing=0.002):
+    """How late the alarm scheduler runs callbacks after their deadlines."""
+    scheduler = load("alarm", "scheduler").Scheduler()
+    rng = random.Random(seed)
+    lateness = []
+    start = scheduler.clock() + 0.05
+    for index in range(alarms):
+        deadline = start + index * spacing + rng.random() * spacing / 2
+        scheduler.call_at(deadline, lambda deadline=deadline: lateness.append(scheduler.clock() - deadline))
+    scheduler.run()
+    return {f"late_{name}_us": value for name, value in _percentiles(lateness).items()}
+
+
+@benchmark()
+def instrumentation(seed=0, calls=200000):
+    """What the instrument hooks cost per call, off and on, and the sampler's cost on a busy loop."""
+    from pyprojects import instrument
+
+    def work():
+        return None
+
+    hooked = instrument.timed("benchmark")(work)
+    results = {}
+    was_enabled = instrument.ENABLED
+    started = time.perf_counter()
+    for _ in range(calls):
+        work()
+    bare = time.perf_counter() - started
+    for state in ("off", "on"):
+        instrument.ENABLED = state == "on"
+        started = time.perf_counter()
+        for _ in range(calls):
+            hooked()
+        results[f"timed_{state}_ns"] = (time.perf_counter() - started - bare) / calls * 1e9
+    instrument.ENABLED = was_enabled
+
+    def busy():
+        total = 0
+        for value in range(3_000_000):
+            total += value
+        return total
+
+    started = time.perf_counter()
+    busy()
+    alone = time.perf_counter() - started
+    sampler = instrument.Sampler().start()
+    started = time.perf_counter()
+    busy()
+    sampled = time.perf_counter() - started
+    sampler.stop()
+    results["sampler_overhead_pct"] = max(sampled / alone - 1, 0) * 100
+    return results
@@ -0,0 +1,89 @@
+# One entry point for all the projects in this repository.
+#
+# Each project lives in its own folder ("[03]_PasswordGenerator", ...) and its modules import
+# each other by plain name ("from policy import Policy"), so the folders can't be imported as
+# packages. This package finds a project's modules by path and loads them only when asked:
+# importing it (or asking the command line for help) loads none of pandas, PyQt5, numpy or
+# requests; each tool pays for its own dependencies, when it runs.
+#
+#     python -m pyprojects passgen --length 16
+#     python -m pyprojects crypto ingest --columnar
+#
+# or from Python:
+#     import pyprojects
+#     pyprojects.load("passgen").generate_password(16)
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Tool name -> (project folder, what it does).
+TOOLS = {
+    "slots": ("[01]_SlotMachine", "Play the slot machine, or simulate it"),
+    "alarm": ("[02]_AlarmClock", "Count down and sound an alarm"),
+    "passgen": ("[03]_PasswordGenerator", "Generate and audit passwords"),
+    "crypto": ("[05]_CryptoAPI", "Fetch, store and analyse CoinMarketCap listings"),
+    "weather": ("[06]_WeatherApp", "Look up the current weather"),
+}
+
+
+def folder(tool):
+    """
+    The folder of a tool's project.
+
+    Raises:
+        ValueError: If there is no such tool.
+    """
+    if tool not in TOOLS:
+        raise ValueError(f"Unknown tool: {tool!r} (choose from {', '.join(TOOLS)})")
+    return os.path.join(ROOT, TOOLS[tool][0])
+
+
+def scripts(tool):
+    """The names of the modules of a tool's project, e.g. ["audit", "bulk", "main", "policy"]."""
+    return sorted(name[:-3] for name in os.listdir(folder(tool)) if name.endswith(".py"))
+
+
+def use(tool):
+    """Puts a project's folder first on sys.path, so its modules can import each other."""
+    path = folder(tool)
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+    return path
+
+
+def load(tool, module="main"):
+    """
+    Imports one of a project's modules by path.
+
+    The module is imported under its own name (as its siblings import it), so load modules of
+    one project per process: several projects have a "main" or a "store".
+
+    Args:
+        tool (str): A name from TOOLS.
+        module (str): The module, without ".py".
+
+    Returns:
+        module: The imported module.
+
+    Raises:
+        ValueError: If there is no such tool or module.
+    """
+    import importlib.util  # Only here: the command line doesn't need it.
+
+    path = os.path.join(use(tool), module + ".py")
+    loaded = sys.modules.get(module)
+    if loaded is not None and getattr(loaded, "__file__", None) == path:
+        return loaded
+    if not os.path.exists(path):
+        raise ValueError(f"{tool} has no module {module!r} (choose from {', '.join(scripts(tool))})")
+    spec = importlib.util.spec_from_file_location(module, path)
+    loaded = importlib.util.module_from_spec(spec)
+    sys.modules[module] = loaded
+    try:
+        spec.loader.exec_module(loaded)
+    except BaseException:
+        del sys.modules[module]
+        raise
+    return loaded
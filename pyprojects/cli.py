@@ -0,0 +1,126 @@
+# The command line of pyprojects: "python -m pyprojects <tool> [<script>] [arguments]".
+#
+# The tool's script (its "main" by default) is run as if it had been started directly, with
+# the remaining arguments, so every script keeps its own options and --help. Scripts without
+# options (the slot machine, the weather window) aren't run for --help: they would start playing
+# or open their window, so their description is printed instead. Nothing of a tool is imported
+# before it is chosen.
+#
+# --profile and --time turn on the instrumentation (see instrument.py) for the run:
+#     python -m pyprojects --profile run.json --time worker:WeatherClient.fetch weather
+# Both only see this process: run scripts with worker processes with one worker (e.g.
+# "slots simulate --workers 1") to time what the workers would do.
+
+import argparse
+import json
+import os
+import runpy
+import sys
+
+from pyprojects import TOOLS, load, scripts, use
+
+
+def _takes_options(path):
+    """Whether a script reads its arguments with argparse (found without importing it)."""
+    with open(path, encoding="utf-8") as file:
+        return "argparse" in file.read()
+
+
+def _describe(tool, script, path):
+    """
+    The help of a script without options: its header comment, or the tool's description.
+    """
+    about = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.startswith("#"):
+                break
+            about.append(line[1:].strip())
+    if script == "main" or not about:
+        about = [TOOLS[tool][1] + "."]
+    usage = f"pyprojects {tool}" + ("" if script == "main" else f" {script}")
+    return f"usage: {usage}\n\n" + "\n".join(about).strip() + "\n\nThis script takes no options."
+
+
+def run(tool, argv):
+    """
+    Runs a tool's script as __main__.
+
+    Args:
+        tool (str): A name from TOOLS.
+        argv (list): The arguments; the first one picks the script if it names one
+            (e.g. ["audit", "--help"]), otherwise they all go to "main".
+
+    Returns:
+        int: The exit status.
+    """
+    script = "main"
+    if argv and argv[0] in scripts(tool):
+        script, argv = argv[0], argv[1:]
+    path = os.path.join(use(tool), script + ".py")
+    if ("-h" in argv or "--help" in argv) and not _takes_options(path):
+        print(_describe(tool, script, path))
+        return 0
+    saved_argv = sys.argv
+    sys.argv = [path] + list(argv)
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            return error.code or 0
+        print(error.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.argv = saved_argv
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pyprojects", description="Run one of the projects.",
+        epilog="Run a script other than a tool's main by naming it first, e.g. 'pyprojects crypto ingest "
+               "--help'; 'pyprojects <tool> --scripts' lists them.")
+    parser.add_argument("tool", choices=TOOLS, metavar="tool",
+                        help="; ".join(f"{name}: {about}" for name, (_, about) in TOOLS.items()))
+    parser.add_argument("arguments", nargs=argparse.REMAINDER, help="the script and its arguments")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="sample where the time goes and write it, with the timers, to FILE as JSON")
+    parser.add_argument("--time", action="append", default=[], metavar="MODULE:FUNCTION",
+                        help="time every call of a function of the tool, e.g. worker:WeatherClient.fetch "
+                             "(can be repeated)")
+    args = parser.parse_args(argv)
+    if args.arguments == ["--scripts"]:
+        print("\n".join(scripts(args.tool)))
+        return 0
+    if not args.profile and not args.time:
+        return run(args.tool, args.arguments)
+
+    script = args.arguments[0] if args.arguments and args.arguments[0] in scripts(args.tool) else "main"
+    for target in args.time:
+        if target.partition(":")[0] == script:
+            parser.error(f"--time {target}: the script being run is started afresh, so only the functions "
+                         f"of the modules it imports can be timed")
+
+    from pyprojects import instrument
+
+    instrument.enable()
+    for target in args.time:
+        load(args.tool, target.partition(":")[0])
+        instrument.patch(target)
+    if args.profile:
+        instrument.start_sampler()
+    try:
+        return run(args.tool, args.arguments)
+    finally:
+        instrument.stop_sampler()
+        snapshot = instrument.snapshot()
+        if args.profile:
+            with open(args.profile, "w") as file:
+                json.dump(snapshot, file, indent=2)
+        else:
+            json.dump(snapshot["timers"], sys.stderr, indent=2)
+            print(file=sys.stderr)
+        for target in args.time:
+            if target not in snapshot["timers"]:
+                print(f"pyprojects: warning: --time {target}: no calls were timed. Calls in worker processes "
+                      f"aren't seen; run the script with one worker (e.g. --workers 1).", file=sys.stderr)
@@ -0,0 +1,314 @@
+# Opt-in instrumentation: timers, counters and a sampling profiler, cheap enough to leave on.
+#
+# Everything is off until enable() is called (or PYPROJECTS_INSTRUMENT=1 is set). A hook that
+# is off still costs something: timer() returns a shared do-nothing context manager, and a
+# function wrapped by timed() or patch() still goes through the wrapper, about 200 ns a call
+# on top of the function itself (see "timed_off_ns" in benchmarks/suite.py). When on:
+#   - timer("name") (a context manager) and timed("name") (a decorator) time code. Durations
+#     are added up per name - count, total, min, max and a histogram of powers of two for
+#     percentiles - so nothing is kept per call and memory doesn't grow;
+#   - count("name") adds to a counter;
+#   - patch("module:Class.method") wraps a function from outside with a timer, for code that
+#     has no hooks of its own;
+#   - Sampler looks at the stack of every thread (sys._current_frames) every few milliseconds
+#     and counts the functions it finds, which shows where the time goes without any cost
+#     per call.
+# snapshot() returns it all as a dict, ready for json.dump.
+#
+# Everything is kept per process. Work done in worker processes (e.g. a ProcessPoolExecutor)
+# is neither patched nor timed there: the parent's timers only cover the parent.
+
+import functools
+import importlib
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+ENABLED = False
+# Durations (ns) fall in bucket n when they are below 2**n: 65 buckets cover any int64.
+BUCKETS = 65
+SAMPLE_INTERVAL = 0.005
+
+_lock = threading.Lock()
+_timers = {}  # name -> _Stats
+_counters = Counter()
+_patches = []  # (owner, attribute, original)
+_sampler = None
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """Forgets every timer and counter (the sampler keeps its own counts)."""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+class _Stats:
+    """The durations of one timer."""
+    __slots__ = ("count", "total", "low", "high", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.low = None
+        self.high = 0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if self.low is None or duration < self.low:
+            self.low = duration
+        if duration > self.high:
+            self.high = duration
+        self.buckets[duration.bit_length()] += 1
+
+    def percentile(self, share):
+        """An estimate of a percentile (in ns): the middle of the bucket it falls in."""
+        wanted = share * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                low, high = (1 << bucket) >> 1, (1 << bucket) - 1
+                return min(max((low + high) / 2, self.low), self.high)
+        return self.high
+
+    def summary(self):
+        return {"count": self.count, "total_ms": self.total / 1e6, "mean_us": self.total / self.count / 1e3,
+                "min_us": self.low / 1e3, "p50_us": self.percentile(0.5) / 1e3,
+                "p99_us": self.percentile(0.99) / 1e3, "max_us": self.high / 1e3}
+
+
+def record(name, duration):
+    """Adds a duration (in nanoseconds) to a timer."""
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            stats = _timers[name] = _Stats()
+        stats.add(duration)
+
+
+def count(name, amount=1):
+    """Adds to a counter (when enabled)."""
+    if ENABLED:
+        with _lock:
+            _counters[name] += amount
+
+
+class _Timing:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter_ns() - self.started)
+
+
+class _NoTiming:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+_NO_TIMING = _NoTiming()
+
+
+def timer(name):
+    """
+    Times a block of code, when enabled:
+
+        with instrument.timer("fetch"):
+            ...
+    """
+    return _Timing(name) if ENABLED else _NO_TIMING
+
+
+def timed(name=None):
+    """
+    Decorates a function so that its calls are timed (when enabled) under 'name', by default
+    its qualified name.
+    """
+    def decorate(function):
+        label = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            started = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter_ns() - started)
+
+        wrapper.__wrapped_by_instrument__ = True
+        return wrapper
+
+    return decorate
+
+
+def patch(target):
+    """
+    Wraps an existing function with a timer named after it.
+
+    Only code that looks the function up after this sees the timer: a module that did
+    "from worker import fetch" before keeps the original.
+
+    Args:
+        target (str): "module:attribute.path", e.g. "worker:WeatherClient.fetch". The module
+            is imported if it isn't yet.
+
+    Raises:
+        ValueError: If the target can't be found or isn't callable.
+    """
+    module_name, _, path = target.partition(":")
+    if not path:
+        raise ValueError(f"Expected 'module:function', got {target!r}")
+    owner = sys.modules.get(module_name) or importlib.import_module(module_name)
+    *parents, attribute = path.split(".")
+    for parent in parents:
+        owner = getattr(owner, parent)
+    original = vars(owner).get(attribute)  # None when inherited: then it is put back by deleting.
+    function = getattr(owner, attribute, None)
+    if not callable(function):
+        raise ValueError(f"{target} is not a function")
+    if getattr(function, "__wrapped_by_instrument__", False):
+        return
+    if isinstance(original, (staticmethod, classmethod)):
+        wrapper = type(original)(timed(target)(original.__func__))
+    else:
+        wrapper = timed(target)(original or function)
+    setattr(owner, attribute, wrapper)
+    _patches.append((owner, attribute, original))
+
+
+def unpatch_all():
+    """Puts back every function patch() wrapped."""
+    while _patches:
+        owner, attribute, original = _patches.pop()
+        if original is None:
+            delattr(owner, attribute)
+        else:
+            setattr(owner, attribute, original)
+
+
+class Sampler:
+    """
+    A sampling profiler: a thread that counts, every 'interval' seconds, the function each
+    other thread is in ("self") and every function on its stack ("total").
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, depth=64):
+        """
+        Args:
+            interval (float): Seconds between samples.
+            depth (int): The most frames of a stack looked at.
+        """
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        self.self_counts = Counter()  # code object -> samples it was running in
+        self.total_counts = Counter()  # code object -> samples it was on the stack in
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        """Takes one sample of every other thread."""
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            self.samples += 1
+            self.self_counts[frame.f_code] += 1
+            seen = set()
+            depth = 0
+            while frame is not None and depth < self.depth:
+                seen.add(frame.f_code)
+                frame = frame.f_back
+                depth += 1
+            self.total_counts.update(seen)
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="Sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def top(self, n=20):
+        """
+        The functions seen most often.
+
+        Returns:
+            list: Dicts with "function" ("file:line name"), "self" and "total" (shares of
+                the samples), most "self" time first.
+        """
+        def label(code):
+            return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+
+        samples = max(self.samples, 1)
+        codes = sorted(self.total_counts, key=lambda code: (-self.self_counts[code], -self.total_counts[code]))
+        return [{"function": label(code), "self": self.self_counts[code] / samples,
+                 "total": self.total_counts[code] / samples} for code in codes[:n]]
+
+
+def start_sampler(interval=SAMPLE_INTERVAL):
+    """Starts the process-wide sampler (its results go into snapshot())."""
+    global _sampler
+    if _sampler is None:
+        _sampler = Sampler(interval).start()
+    return _sampler
+
+
+def stop_sampler():
+    if _sampler is not None:
+        _sampler.stop()
+
+
+def snapshot(top=20):
+    """
+    Everything measured so far.
+
+    Returns:
+        dict: "timers" ({name: count, total, mean, min, percentiles, max}), "counters" and,
+            if the sampler ran, "profile" (its samples and top functions).
+    """
+    with _lock:
+        result = {"timers": {name: stats.summary() for name, stats in sorted(_timers.items())},
+                  "counters": dict(sorted(_counters.items()))}
+    if _sampler is not None:
+        result["profile"] = {"samples": _sampler.samples, "interval": _sampler.interval, "top": _sampler.top(top)}
+    return result
+
+
+if os.environ.get("PYPROJECTS_INSTRUMENT", "").lower() in ("1", "true", "yes"):
+    enable()